@@ -0,0 +1,47 @@
+"""Compare the throughput of the blotter cleaners on a fixed corpus
+
+Usage: python benchmarks/bench_cleaners.py [--blotters N] [--repeat N]
+"""
+import argparse
+import time
+
+from ct_pd_scraper import cleaner
+
+from synthetic import corpus
+
+
+def bench_cleaner(variety, blotters, repeat=5):
+    """Time cleaning every blotter with a cleaner, keeping the best run
+
+    Returns:
+        (seconds, records): best time to clean the corpus (float), and the
+            number of records cleaned (int)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = 0
+        for dirty_incident, _, _ in blotters:
+            records += len(cleaner.get_cleaner(variety).clean_incidents(dirty_incident))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blotters", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    blotters = corpus(args.blotters)
+    for variety in cleaner.CLEANERS:
+        seconds, records = bench_cleaner(variety, blotters, args.repeat)
+        print(
+            f"{variety:>10}: {records} records in {seconds:.3f}s "
+            f"({records / seconds:,.0f} records/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
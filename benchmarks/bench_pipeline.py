@@ -0,0 +1,464 @@
+"""Per-stage and end-to-end benchmarks of ct_pd_scraper, run offline
+
+Every stage main runs through (getting links, scraping, cleaning, and
+inserting) is timed against a local stand-in for rep-am.com serving a seeded
+synthetic site, followed by the whole run end to end. Inserting and the end
+to end run are timed for SQLite, and for MySQL too if connection options are
+given. Then the whole run is repeated with the response cache on, twice (so
+the second run's pages are answered from the cache), with the configured
+parser and with the "stream" parser, measuring the peak memory allocated by
+each. Last, a few long roundup blotters, of a tenth of --roundup-arrests
+records and then all of them, are scraped and archived with each parser, to
+show how peak memory grows with the length of a page. Results are written to
+a JSON file; pass an earlier file to --compare to see which stages got
+slower.
+
+Usage: python benchmarks/bench_pipeline.py [--blotters N] [--output FILE]
+    [--compare FILE] [--mysql KEY=VALUE ...] [--roundup-arrests N]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+import ct_pd_scraper
+from ct_pd_scraper import cleaner, inserter, linkstore, settings
+from ct_pd_scraper.archive import BlotterArchive
+from ct_pd_scraper.__main__ import get_fetcher, get_links, get_page_links, page_url
+from ct_pd_scraper.pipeline import run_pipeline
+from ct_pd_scraper.scrape_police import login, scrape
+
+from server import StandInServer
+
+
+def summarize(items, seconds, latencies=()):
+    """Summarize a timed stage
+
+    Args:
+        items: number of items (pages, blotters, or records) processed (int)
+        seconds: wall time of the stage (float)
+        latencies: seconds taken by each item, if timed one by one (list)
+
+    Returns:
+        result: items, seconds, per_second, and latency percentiles in
+            milliseconds (dict)
+    """
+    result = {
+        "items": items,
+        "seconds": round(seconds, 6),
+        "per_second": round(items / seconds, 3) if seconds else None,
+    }
+    if latencies:
+        ordered = sorted(latencies)
+        result["latency_ms"] = {
+            "p50": round(ordered[len(ordered) // 2] * 1000, 3),
+            "p95": round(ordered[int(len(ordered) * 0.95)] * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+        }
+    return result
+
+
+def timed(func, items):
+    """Call func on each item in turn, timing each call
+
+    Returns:
+        (results, seconds, latencies): results of each call (list), total
+            wall time (float), and time of each call (list)
+    """
+    results = []
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        began = time.perf_counter()
+        results.append(func(item))
+        latencies.append(time.perf_counter() - began)
+    return results, time.perf_counter() - start, latencies
+
+
+def bench_config(args, server, data_path):
+    """Make a SettingsObj pointed at the stand-in server
+
+    Options come from the given config file, as a real run's would, except
+    those which would touch the real site or the real data folder.
+    """
+    config = settings.SettingsObj(args.config, need_login=False)
+    config.login_url = server.login_url
+    config.base_url = server.listing_url
+    config.base_pages = server.listing_pages
+    config.login_headers = _local_headers(config.login_headers)
+    config.session_headers = _local_headers(config.session_headers)
+    config.data_path = data_path
+    config.cache_enabled = False
+    config.archive_enabled = False
+    config.fetch_config = {
+        "concurrency": args.concurrency,
+        "retries": 0,
+        "rate": 10000,
+        "burst": 10000,
+        "max_rate": 10000,
+    }
+    return config
+
+
+def _local_headers(headers):
+    """Drop the headers naming rep-am.com, which would not suit the stand-in"""
+    dropped = {"host", "origin", "referer"}
+    return {k: v for k, v in (headers or {}).items() if k.lower() not in dropped}
+
+
+def sqlite_connconfig(config, data_path, name):
+    """Make the connection config for a fresh SQLite database in data_path,
+    which the inserter creates on connecting"""
+    connconfig = dict(config.connconfig, data_path=data_path)
+    connconfig["sqlite"] = dict(connconfig.get("sqlite", {}), database=name)
+    return connconfig
+
+
+def bench_links(config, session, results):
+    """Time getting links: the whole crawl, and each listing page alone"""
+    fetcher = get_fetcher(session, config)
+    start = time.perf_counter()
+    links = get_links(fetcher, config)
+    seconds = time.perf_counter() - start
+    results["get_links"] = summarize(config.base_pages, seconds)
+
+    urls = [page_url(config.base_url, page) for page in range(1, config.base_pages + 1)]
+    _, seconds, latencies = timed(
+        lambda url: get_page_links(session, url, config.session_headers), urls
+    )
+    results["get_page_links"] = summarize(len(urls), seconds, latencies)
+    return [link["href"] for link in links]
+
+
+def bench_scrape(config, session, links, results):
+    """Time scraping each blotter in turn"""
+    blotters, seconds, latencies = timed(
+        lambda link: scrape(link, session, config.session_headers, None, config.parser),
+        links,
+    )
+    results["scrape"] = summarize(len(links), seconds, latencies)
+    return blotters
+
+
+def bench_clean(blotters, results, repeat=5):
+    """Time every cleaner on the scraped blotters, keeping the best of repeat
+    runs, as cleaning a corpus takes too little time to time once"""
+    for variety in cleaner.CLEANERS:
+        runs = [
+            timed(
+                lambda blotter: cleaner.get_cleaner(variety).clean_incidents(
+                    blotter[0]
+                ),
+                blotters,
+            )
+            for _ in range(repeat)
+        ]
+        cleaned, seconds, latencies = min(runs, key=lambda run: run[1])
+        records = sum(len(incidents) for incidents in cleaned)
+        results[f"clean.{variety}"] = summarize(records, seconds, latencies)
+
+
+def bench_insert(variety, connconfig, cleaned, batch_size, results):
+    """Time inserting cleaned blotters one at a time, then in batches
+
+    Args:
+        variety: inserter type, "sqlite" or "mysql" (str)
+        connconfig: connection config for the inserter (dict)
+        cleaned: list of (incidents, date, pdcity) tuples (list)
+        batch_size: blotters per insert_many call (int)
+        results: dict to add the results to (dict)
+    """
+    records = sum(len(incidents) for incidents, _, _ in cleaned)
+    insert = inserter.get_inserter(variety, config=connconfig)
+    # Each pass gives the blotters its own urls, so its records are new, and
+    # not skipped as already inserted by the pass before
+    try:
+        with insert:
+            _, seconds, latencies = timed(
+                lambda item: insert.insert(*item[1], url=f"insert/{item[0]}"),
+                list(enumerate(cleaned)),
+            )
+        results[f"insert.{variety}"] = summarize(records, seconds, latencies)
+
+        batches = [
+            (
+                cleaned[start : start + batch_size],
+                [f"insert_many/{n}" for n in range(start, start + batch_size)],
+            )
+            for start in range(0, len(cleaned), batch_size)
+        ]
+        with insert:
+            _, seconds, latencies = timed(
+                lambda batch: insert.insert_many(*batch), batches
+            )
+        results[f"insert_many.{variety}"] = summarize(records, seconds, latencies)
+    finally:
+        insert.close()
+
+
+def bench_end_to_end(variety, config, connconfig, data_path, results):
+    """Time a whole run, from logging in to the last batch being committed"""
+    config.inserter_type = variety
+    config.connconfig = connconfig
+    start = time.perf_counter()
+    with requests.Session() as session:
+        login(config.login_url, session, config.login_headers, config.log_info)
+        fetcher = get_fetcher(session, config)
+        store = linkstore.get_link_store("sqlite", data_path / f"seen-{variety}.db")
+        with store as prev_links:
+            links = [link["href"] for link in get_links(fetcher, config, prev_links)]
+            insert = inserter.get_inserter(variety, config=connconfig)
+            try:
+                failed = run_pipeline(links, fetcher, insert, prev_links, config)
+            finally:
+                insert.close()
+    seconds = time.perf_counter() - start
+    results[f"end_to_end.{variety}"] = summarize(len(links), seconds)
+    results[f"end_to_end.{variety}"]["failed"] = len(failed)
+
+
+def bench_cached_memory(config, data_path, results, parsers):
+    """Time whole runs with the response cache on, measuring their peak
+    memory: a first run storing every page in the cache, then a second one
+    with every page answered from it, for each parser
+
+    Args:
+        parsers: parsers to run with, e.g. "html.parser" and "stream" (list)
+    """
+    config.cache_enabled = True
+    config.inserter_type = "sqlite"
+    try:
+        for parser in parsers:
+            config.parser = parser
+            config.cache_dir = Path(f"cache-{parser}")
+            for run in ("cold", "warm"):
+                config.connconfig = sqlite_connconfig(
+                    config, data_path, f"cached-{parser}-{run}.db"
+                )
+                tracemalloc.start()
+                start = time.perf_counter()
+                with requests.Session() as session:
+                    login(
+                        config.login_url, session, config.login_headers, config.log_info
+                    )
+                    fetcher = get_fetcher(session, config)
+                    links = [link["href"] for link in get_links(fetcher, config)]
+                    store = linkstore.get_link_store(
+                        "sqlite", data_path / f"seen-{parser}-{run}.db"
+                    )
+                    insert = inserter.get_inserter("sqlite", config=config.connconfig)
+                    try:
+                        with store as prev_links:
+                            failed = run_pipeline(
+                                links, fetcher, insert, prev_links, config
+                            )
+                    finally:
+                        insert.close()
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                result = summarize(len(links), seconds)
+                result["failed"] = len(failed)
+                result["peak_mib"] = round(peak / 1024 / 1024, 2)
+                results[f"cached.{parser}.{run}"] = result
+    finally:
+        config.cache_enabled = False
+
+
+def bench_roundup_memory(args, data_path, results, parsers, blotters=4):
+    """Time whole runs over a site of a few long roundup blotters, archiving
+    them, and measure their peak memory, for each parser and two lengths of
+    roundup
+
+    Args:
+        parsers: parsers to run with, e.g. "html.parser" and "stream" (list)
+        blotters: roundups on the site (int)
+    """
+    for arrests in (args.roundup_arrests // 10, args.roundup_arrests):
+        with StandInServer(blotters, seed=args.seed, arrests=arrests) as server:
+            config = bench_config(args, server, data_path)
+            for parser in parsers:
+                config.parser = parser
+                name = f"roundup-{parser}-{arrests}"
+                connconfig = sqlite_connconfig(config, data_path, f"{name}.db")
+                tracemalloc.start()
+                start = time.perf_counter()
+                with requests.Session() as session, BlotterArchive(
+                    data_path / name
+                ) as archive:
+                    login(
+                        config.login_url, session, config.login_headers, config.log_info
+                    )
+                    fetcher = get_fetcher(session, config)
+                    links = [link["href"] for link in get_links(fetcher, config)]
+                    store = linkstore.get_link_store(
+                        "sqlite", data_path / f"seen-{name}.db"
+                    )
+                    insert = inserter.get_inserter("sqlite", config=connconfig)
+                    try:
+                        with store as prev_links:
+                            failed = run_pipeline(
+                                links, fetcher, insert, prev_links, config, archive
+                            )
+                    finally:
+                        insert.close()
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                result = summarize(len(links) * arrests, seconds)
+                result["failed"] = len(failed)
+                result["peak_mib"] = round(peak / 1024 / 1024, 2)
+                results[f"roundup.{parser}.{arrests}"] = result
+
+
+def git_commit():
+    """Get the commit being benchmarked, if this is a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_file, tolerance):
+    """Print how each stage's throughput changed since a baseline run
+
+    Runs are only comparable if they used the same parameters (and machine);
+    a warning is printed if the parameters differ.
+
+    Returns:
+        slower: names of stages slower than the baseline by more than
+            tolerance (list)
+    """
+    baseline = json.loads(Path(baseline_file).read_text())
+    base_version = baseline.get("version"), baseline.get("commit")
+    print(f"Compared with {baseline_file} ({base_version[0]} {base_version[1]}):")
+    if baseline.get("params") != report["params"]:
+        print("Warning: the baseline was run with different parameters")
+    slower = []
+    for stage, result in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("per_second")
+        after = result.get("per_second")
+        if not before or not after:
+            print(f"{stage:>24}: no baseline")
+            continue
+        ratio = after / before
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  SLOWER"
+            slower.append(stage)
+        print(
+            f"{stage:>24}: {before:>12,.1f} -> {after:>12,.1f}/s "
+            f"({ratio:.2f}x){flag}"
+        )
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blotters", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=2020)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server latency in milliseconds"
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5, help="runs of cleaning")
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fraction slower a stage may get before it is flagged",
+    )
+    parser.add_argument(
+        "--mysql",
+        nargs="*",
+        metavar="KEY=VALUE",
+        help="connection options for a scratch MySQL database to benchmark too",
+    )
+    parser.add_argument(
+        "--roundup-arrests",
+        type=int,
+        default=20000,
+        help="records in each of the long roundup blotters",
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, StandInServer(
+        args.blotters, args.per_page, args.seed, latency=args.latency / 1000
+    ) as server:
+        data_path = Path(tmp)
+        config = bench_config(args, server, data_path)
+        connconfigs = {"sqlite": sqlite_connconfig(config, data_path, "stages.db")}
+        if args.mysql is not None:
+            mysql = dict(option.split("=", 1) for option in args.mysql)
+            connconfigs["mysql"] = dict(config.connconfig, mysql=mysql)
+
+        with requests.Session() as session:
+            login(config.login_url, session, config.login_headers, config.log_info)
+            links = bench_links(config, session, results)
+            blotters = bench_scrape(config, session, links, results)
+        bench_clean(blotters, results, args.repeat)
+        cleaned = [
+            (cleaner.get_cleaner(config.cleaner_type).clean_incidents(blot), *rest)
+            for blot, *rest in blotters
+        ]
+        for variety, connconfig in connconfigs.items():
+            bench_insert(variety, connconfig, cleaned, config.batch_size, results)
+
+        connconfigs["sqlite"] = sqlite_connconfig(config, data_path, "end_to_end.db")
+        for variety, connconfig in connconfigs.items():
+            bench_end_to_end(variety, config, connconfig, data_path, results)
+
+        parser_name = config.parser
+        parsers = list(dict.fromkeys([config.parser, "stream"]))
+        bench_cached_memory(config, data_path, results, parsers)
+        config.parser = parser_name
+        bench_roundup_memory(args, data_path, results, parsers)
+
+    report = {
+        "version": ct_pd_scraper.__version__,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "blotters": args.blotters,
+            "per_page": args.per_page,
+            "seed": args.seed,
+            "latency_ms": args.latency,
+            "concurrency": args.concurrency,
+            "parser": config.parser,
+            "batch_size": config.batch_size,
+            "repeat": args.repeat,
+            "roundup_arrests": args.roundup_arrests,
+        },
+        "stages": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    for stage, result in results.items():
+        peak = f", peak {result['peak_mib']} MiB" if "peak_mib" in result else ""
+        print(f"{stage:>24}: {result['items']:>7} in {result['seconds']:.3f}s{peak}")
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(report, args.compare, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Startup time of ct_pd_scraper, and of a run with nothing new to scrape
+
+Most scheduled runs find no new blotters, so their cost is startup: imports,
+loading the config, logging in, and reading the first listing page. Each is
+timed in a fresh interpreter, as a scheduled run would start: importing the
+package and the main module, and then whole runs of `python -m
+ct_pd_scraper` against the local stand-in for rep-am.com once every blotter
+on it has been scraped.
+
+Usage: python benchmarks/bench_startup.py [--repeat N] [--output FILE]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from server import StandInServer
+
+
+CONFIG = """
+[data]
+path = "{data}"
+
+[env]
+path = "{env}"
+
+[login]
+url = "{login_url}"
+logged_in_marker = "logged-in"
+
+[session]
+base_url = "{listing_url}"
+base_pages = 1
+
+[fetching]
+rate = 10000
+burst = 10000
+max_rate = 10000
+
+[database.config.sqlite]
+database = "pd.db"
+
+[metrics]
+report = ""
+"""
+
+ENV = "log=benchmark\npwd=benchmark\nsubmit=Log In\nredirect_to=/\ntestcookie=1\n"
+
+
+def run_seconds(args, cwd=None, repeat=5):
+    """Run a command in a fresh interpreter, repeat times
+
+    Returns:
+        seconds: the best wall time of the runs (float)
+
+    Raises:
+        subprocess.CalledProcessError: the command failed
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            cwd=cwd,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def slowest_imports(module, count=10):
+    """Get the imports taking longest, including their own imports, when
+    importing module in a fresh interpreter
+
+    Returns:
+        imports: list of (module, milliseconds) pairs, slowest first (list)
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blotters", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="startup.json")
+    args = parser.parse_args(argv)
+
+    interpreter = run_seconds(["-c", "pass"], repeat=args.repeat)
+    results = {
+        "import ct_pd_scraper": run_seconds(
+            ["-c", "import ct_pd_scraper"], repeat=args.repeat
+        ),
+        "import ct_pd_scraper.__main__": run_seconds(
+            ["-c", "import ct_pd_scraper.__main__"], repeat=args.repeat
+        ),
+    }
+    with tempfile.TemporaryDirectory() as tmp, StandInServer(
+        args.blotters, args.blotters
+    ) as server:
+        tmp = Path(tmp)
+        (tmp / "data").mkdir()
+        (tmp / ".env").write_text(ENV)
+        (tmp / "config.toml").write_text(
+            CONFIG.format(
+                data=(tmp / "data").as_posix(),
+                env=tmp.as_posix(),
+                login_url=server.login_url,
+                listing_url=server.listing_url,
+            )
+        )
+        # Scrape everything once, so the timed runs find nothing new
+        run_seconds(["-m", "ct_pd_scraper"], cwd=tmp, repeat=1)
+        requests_before = server.requests + server.logins
+        results["run with nothing new"] = run_seconds(
+            ["-m", "ct_pd_scraper"], cwd=tmp, repeat=args.repeat
+        )
+        requests_after = server.requests + server.logins
+        requests_per_run = (requests_after - requests_before) / args.repeat
+
+    report = {
+        "python": sys.version.split()[0],
+        "interpreter_ms": round(interpreter * 1000, 1),
+        "startup_ms": {
+            name: round((seconds - interpreter) * 1000, 1)
+            for name, seconds in results.items()
+        },
+        "requests_per_run": requests_per_run,
+        "slowest_imports_ms": dict(slowest_imports("ct_pd_scraper.__main__")),
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    print(f"{'interpreter':>32}: {report['interpreter_ms']:8.1f}ms")
+    for name, ms in report["startup_ms"].items():
+        print(f"{name:>32}: {ms:8.1f}ms over the interpreter")
+    print(f"{'requests per run':>32}: {requests_per_run:8.1f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Local stand-in for rep-am.com, for benchmarking ct_pd_scraper offline
+
+Serves the endpoints main uses: the login form, the police listing pages,
+and the blotters, from a synthetic site. Pages carry an ETag, so conditional
+requests from the response cache are answered with 304 as the real site
+would. As on a WordPress site, logging in sets a cookie carrying its own
+expiry, and pages served with it are marked with the "logged-in" body class.
+
+Usage: python benchmarks/server.py [--port N] [--blotters N] [--latency MS]
+"""
+import argparse
+import hashlib
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from synthetic import LISTING_PATH, site
+
+
+LOGIN_COOKIE = "wordpress_logged_in_benchmark"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer requests from the server's site"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Keep request logging off the benchmark's output"""
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        time.sleep(self.server.latency)
+        if self.path.rstrip("/") != "/login":
+            self._respond(404)
+            return
+        self.server.logins += 1
+        if not self.server.accept_logins:
+            self._respond(200, b"Login failed", {"Content-Type": "text/plain"})
+            return
+        # As WordPress's, the cookie's value is "user|expiration|token|hmac"
+        expiration = int(time.time() + self.server.login_seconds)
+        self._respond(
+            302,
+            headers={
+                "Location": "/",
+                "Set-Cookie": f"{LOGIN_COOKIE}=benchmark%7C{expiration}"
+                "%7Ctoken%7Chmac; Path=/; HttpOnly",
+            },
+        )
+
+    def logged_in(self):
+        """Check the request carries a logged in cookie which has not expired"""
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        if LOGIN_COOKIE not in cookies:
+            return False
+        fields = unquote(cookies[LOGIN_COOKIE].value).split("|")
+        return len(fields) == 4 and int(fields[1]) > time.time()
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        page = self.server.pages.get(self.path)
+        if page is None:
+            self._respond(404, b"Not Found", {"Content-Type": "text/plain"})
+            return
+        etag = self.server.etags[self.path]
+        if self.logged_in():
+            page = self.server.logged_in_pages[self.path]
+            etag = etag[:-1] + '-logged-in"'
+        if self.headers.get("If-None-Match") == etag:
+            self._respond(304, headers={"ETag": etag})
+            return
+        self._respond(
+            200, page, {"Content-Type": "text/html; charset=UTF-8", "ETag": etag}
+        )
+
+    do_HEAD = do_GET
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server for a synthetic site
+
+    Use as a context manager to serve in a background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, blotters=200, per_page=20, seed=2020, port=0, latency=0.0, arrests=None
+    ):
+        """Bind the server and make the site it serves
+
+        Args:
+            blotters, per_page, seed, arrests: size and seed of the site, as
+                for synthetic.site
+            port: port to listen on, or 0 for any free port (int)
+            latency: seconds to wait before answering each request (float)
+        """
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.listing_url = self.base_url + LISTING_PATH
+        self.login_url = self.base_url + "/login"
+        self.pages = site(self.base_url, blotters, per_page, seed, arrests)
+        self.listing_pages = -(-blotters // per_page) or 1
+        self.etags = {
+            path: f'"{hashlib.sha1(page).hexdigest()}"'
+            for path, page in self.pages.items()
+        }
+        # As WordPress themes do, pages served to logged in visitors are
+        # marked; made up front, so serving a page never copies it
+        self.logged_in_pages = {
+            path: page.replace(b'<body class="', b'<body class="logged-in ', 1)
+            for path, page in self.pages.items()
+        }
+        self.latency = latency
+        self.requests = 0
+        self.logins = 0
+        self.accept_logins = True
+        self.login_seconds = 2 * 86400
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--blotters", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds")
+    args = parser.parse_args(argv)
+
+    with StandInServer(
+        args.blotters, args.per_page, port=args.port, latency=args.latency / 1000
+    ) as server:
+        print(f"Serving {len(server.pages)} pages; listing at {server.listing_url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
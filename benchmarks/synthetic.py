@@ -0,0 +1,224 @@
+"""Synthetic police blotters for benchmarking ct_pd_scraper
+
+Everything here is generated from a seeded random.Random, so the same seed
+always gives the same corpus and results are comparable between runs.
+Pages are laid out like rep-am.com's: a WordPress theme with navigation,
+scripts, and sidebars around the article, which the parser has to get
+through.
+"""
+import html
+import random
+
+
+FIRST_NAMES = [
+    "JOHN",
+    "MARY",
+    "JOSE",
+    "ASHLEY",
+    "MICHAEL",
+    "JESSICA",
+    "DAVID",
+    "MARIA",
+    "CHRISTOPHER",
+    "AMANDA",
+    "ANTHONY",
+    "KAYLA",
+    "JAMES",
+    "NICOLE",
+    "ROBERT",
+]
+MIDDLE_INITIALS = ["", "", "A. ", "J. ", "M. ", "R. "]
+LAST_NAMES = [
+    "SMITH",
+    "RODRIGUEZ",
+    "JOHNSON",
+    "RIVERA",
+    "WILLIAMS",
+    "SANTIAGO",
+    "BROWN",
+    "DAVIS",
+    "MARTINEZ",
+    "MILLER",
+    "LOPEZ",
+    "WILSON",
+    "COLON",
+    "MOORE",
+    "TAYLOR",
+]
+TOWNS = [
+    "Waterbury",
+    "Naugatuck",
+    "Wolcott",
+    "Prospect",
+    "Watertown",
+    "Cheshire",
+    "Thomaston",
+    "Torrington",
+    "Southbury",
+    "Middlebury",
+    "Oxford",
+    "Beacon Falls",
+]
+STREETS = ["Main St.", "Elm St.", "North Main St.", "Baldwin St.", "Wolcott Road"]
+CHARGES = [
+    "breach of peace",
+    "third-degree larceny",
+    "failure to appear",
+    "driving under the influence",
+    "possession of narcotics",
+    "interfering with an officer",
+    "violation of a protective order",
+    "second-degree criminal mischief",
+]
+MONTHS = ["March", "April", "May", "June"]
+FILLER = [
+    "The following people were arrested, according to police.",
+    "Police say the information below is from public records.",
+    "Subscribe today for full access.",
+    "POLICE BLOTTER",
+]
+
+
+def arrest_record(rng):
+    """Make the text of one arrest record"""
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(MIDDLE_INITIALS)}"
+    name += rng.choice(LAST_NAMES)
+    town = rng.choice(TOWNS)
+    if rng.random() < 0.5:
+        residence = f"{rng.randint(1, 999)} {rng.choice(STREETS)}, {town}"
+    else:
+        residence = town
+    charges = " and ".join(rng.sample(CHARGES, rng.randint(1, 3)))
+    verb = rng.choice(["charged with", "was charged with", "charged Monday with"])
+    record = f"{name}, {rng.randint(18, 70)}, of {residence}, {verb} {charges}."
+    if rng.random() < 0.6:
+        record += f" Court date: {rng.choice(MONTHS)} {rng.randint(1, 28)}."
+    return record
+
+
+def blotter_paragraphs(rng, arrests=None):
+    """Make the paragraphs of one blotter: filler around arrest records"""
+    if arrests is None:
+        arrests = rng.randint(5, 40)
+    paragraphs = [rng.choice(FILLER)]
+    paragraphs.extend(arrest_record(rng) for _ in range(arrests))
+    paragraphs.append(rng.choice(FILLER))
+    return paragraphs
+
+
+def corpus(blotters=500, seed=2020, arrests=None):
+    """Make a fixed corpus of blotters
+
+    Args:
+        arrests: arrest records in every blotter, rather than 5 to 40 (int)
+
+    Returns:
+        blotters: list of (paragraphs, date, pdcity) tuples, as from
+            scrape_police.parse_blotter (list)
+    """
+    rng = random.Random(seed)
+    return [
+        (
+            blotter_paragraphs(rng, arrests),
+            f"{rng.choice(MONTHS)} {rng.randint(1, 28)}, 2020",
+            rng.choice(TOWNS).split()[0],
+        )
+        for _ in range(blotters)
+    ]
+
+
+LISTING_PATH = "/category/local/records/police/"
+PAGE_HEAD = """<!DOCTYPE html>
+<html lang="en-US"><head><meta charset="UTF-8"><title>{title}</title>
+<link rel="stylesheet" href="/wp-content/themes/rep-am/style.css">
+<script>window.dataLayer = window.dataLayer || [];
+function gtag(){{dataLayer.push(arguments);}} gtag("js", new Date());</script>
+</head><body class="wordpress"><header class="site-header"><nav><ul>
+<li><a href="/">Home</a></li><li><a href="/category/local/">Local</a></li>
+<li><a href="/category/sports/">Sports</a></li>
+<li><a href="/category/obituaries/">Obituaries</a></li>
+</ul></nav></header><main>
+"""
+PAGE_FOOT = """</main><aside class="sidebar"><div class="widget"><h3>Most Read</h3>
+<ul><li><a href="/local/most-read-1/">Most read story</a></li></ul></div></aside>
+<footer><p class="copyright">Copyright Republican-American</p></footer>
+<script src="/wp-content/themes/rep-am/app.js"></script></body></html>
+"""
+
+
+def blotter_slug(number, pdcity):
+    """Make the path of a blotter, as rep-am.com names them"""
+    return f"/local/records/police/{pdcity.lower()}-police-blotter-{number}/"
+
+
+def blotter_html(paragraphs, date, pdcity):
+    """Make the html of a blotter page
+
+    Returns:
+        page: html of the page, which scrape_police.parse_blotter parses back
+            to (paragraphs, date, pdcity) (bytes)
+    """
+    title = f"{pdcity} police blotter"
+    body = "".join(f"<p>{html.escape(p)}</p>\n" for p in paragraphs)
+    page = PAGE_HEAD.format(title=title)
+    page += f"""<article class="post"><h1 class="entry-title">{title}</h1>
+<div class="entry-meta"><time datetime="2020">{date}</time></div>
+<div class="entry-content">
+{body}</div></article>
+"""
+    return (page + PAGE_FOOT).encode("utf-8")
+
+
+def listing_html(urls, page, pages):
+    """Make the html of one page of the police listing
+
+    Args:
+        urls: absolute urls of the blotters listed on this page, as
+            rep-am.com links them (list)
+        page: number of this page, starting at 1 (int)
+        pages: number of pages in the listing (int)
+
+    Returns:
+        page: html of the page (bytes)
+    """
+    items = "".join(
+        f'<article class="teaser"><h2><a href="{url}">'
+        f"{url.strip('/').rsplit('/', 1)[-1].replace('-', ' ')}</a></h2>"
+        "<p>The following people were arrested.</p></article>\n"
+        for url in urls
+    )
+    nav = ""
+    if page < pages:
+        nav = f'<a class="next" href="{LISTING_PATH}page/{page + 1}/">Older</a>'
+    listing = PAGE_HEAD.format(title="Police") + items + nav + PAGE_FOOT
+    return listing.encode("utf-8")
+
+
+def site(base_url, blotters=200, per_page=20, seed=2020, arrests=None):
+    """Make a fixed site of blotters and the listing pages linking to them
+
+    Blotters are listed newest first, per_page to a listing page, as on
+    rep-am.com.
+
+    Args:
+        base_url: scheme and host the site is served from, e.g.
+            "http://127.0.0.1:8000" (str)
+        arrests: arrest records in every blotter, as for corpus (int)
+
+    Returns:
+        pages: html of every page (bytes), keyed by path (dict)
+    """
+    pages = {}
+    paths = []
+    blotter_corpus = corpus(blotters, seed, arrests)
+    for number, (paragraphs, date, pdcity) in enumerate(blotter_corpus):
+        path = blotter_slug(number, pdcity)
+        pages[path] = blotter_html(paragraphs, date, pdcity)
+        paths.append(base_url + path)
+    paths.reverse()
+    count = max(1, -(-len(paths) // per_page))
+    for page in range(1, count + 1):
+        listed = paths[(page - 1) * per_page : page * per_page]
+        path = LISTING_PATH if page == 1 else f"{LISTING_PATH}page/{page}/"
+        pages[path] = listing_html(listed, page, count)
+    return pages
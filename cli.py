@@ -7,4 +7,4 @@ if __name__ == "__main__":
     except BaseException as e:
         print(f"Exception found: {str(e)}")
         traceback.print_exc()
-        input("Press enter to exit")
\ No newline at end of file
+        input("Press enter to exit")
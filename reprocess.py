@@ -0,0 +1,10 @@
+from ct_pd_scraper.reprocess import main
+import traceback
+
+if __name__ == "__main__":
+    try:
+        main()
+    except BaseException as e:
+        print(f"Exception found: {str(e)}")
+        traceback.print_exc()
+        input("Press enter to exit")
@@ -1,4 +1,5 @@
 """Adapter module for MySQLdb to provide more pythonic interface"""
+import threading
 
 import MySQLdb as mysqldb
 
@@ -22,3 +23,48 @@ class ConnectionAdapter(mysqldb.connections.Connection):
 def connect(*args, **kwargs):
     """Replacement connect method to use ConnectionAdapter"""
     return ConnectionAdapter(*args, **kwargs)
+
+
+class ConnectionPool:
+    """Small pool of ConnectionAdapters sharing the same connect arguments
+
+    Idle connections are pinged before being handed out again, and replaced
+    if the server has dropped them. At most size idle connections are kept.
+    """
+
+    def __init__(self, size=2, *args, **kwargs):
+        self.size = size
+        self.args = args
+        self.kwargs = kwargs
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Get an idle connection, or a new one if none are usable"""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn = self.idle.pop()
+            try:
+                conn.ping()
+            except mysqldb.Error:
+                conn.close()
+            else:
+                return conn
+        return connect(*self.args, **self.kwargs)
+
+    def put(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close every idle connection"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
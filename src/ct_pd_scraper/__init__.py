@@ -1,9 +1,33 @@
-from ct_pd_scraper import (
-    cleaner,
-    inserter,
-    scrape_police,
-    exceptions,
-    settings,
-)
+import importlib
 
 __version__ = "0.3.0"
+
+# Submodules are imported when first used (e.g. ct_pd_scraper.inserter), so
+# importing the package costs nothing, and a run imports only what it needs
+__all__ = [
+    "archive",
+    "atomicfile",
+    "backfill",
+    "cleaner",
+    "export",
+    "httpcache",
+    "inserter",
+    "linkstore",
+    "metrics",
+    "pipeline",
+    "reprocess",
+    "retryqueue",
+    "scheduler",
+    "schema",
+    "scrape_police",
+    "search",
+    "watch",
+    "exceptions",
+    "settings",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
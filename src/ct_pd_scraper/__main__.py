@@ -1,45 +1,297 @@
 """Main worker of script"""
-import json
-import re
-from time import sleep
-import traceback
+import logging
+import time
+from html.parser import HTMLParser
 
 import requests
-from tqdm import tqdm
-from bs4 import BeautifulSoup, SoupStrainer
 
-from .scrape_police import login, scrape
-from . import cleaner
+from .archive import BlotterArchive
+from .pipeline import run_pipeline
+from .scrape_police import (
+    load_cookies,
+    login,
+    login_expiry,
+    require_login,
+    save_cookies,
+)
+from .scheduler import FetchScheduler
+from . import httpcache
 from . import inserter
+from . import linkstore
+from . import metrics
+from . import retryqueue
 from . import settings
 from . import exceptions
 
 
-def get_links(session, config):
-    """Get links to blotters from the base page
+logger = logging.getLogger(__name__)
+
+
+def page_url(base_url, page):
+    """Get the url of a page of the listing at base_url
+
+    Listing pages on rep-am.com follow the WordPress convention of
+    {base_url}/page/{page}/, with the first page being base_url itself.
+
+    Args:
+        base_url: url of the first listing page (str)
+        page: page number, starting at 1 (int)
+
+    Returns:
+        url: url of the given listing page (str)
+    """
+    if page <= 1:
+        return base_url
+    return f"{base_url.rstrip('/')}/page/{page}/"
+
+
+class BlotterLinkParser(HTMLParser):
+    """Collect the <a> tags of a listing page whose href and text both
+    contain "blotter"
+
+    Matches what a BeautifulSoup findAll(href=..., string=...) search found:
+    as with a tag's .string, the text must be the tag's only text, not split
+    around other tags. Only the standard library is used, so a run with
+    nothing new to scrape never imports BeautifulSoup.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.attrs = None
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self.attrs = dict(attrs)
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag != "a" or self.attrs is None:
+            return
+        href = self.attrs.get("href") or ""
+        if "blotter" in href and len(self.text) == 1 and "blotter" in self.text[0]:
+            self.links.append(self.attrs)
+        self.attrs = None
+
+    def handle_data(self, data):
+        if self.attrs is not None:
+            self.text.append(data)
+
+
+def get_page_links(session, url, headers=None):
+    """Get links to blotters from a single listing page
+
+    Links are found by searching every <a> tag for links which contain
+    "blotter" in both their href and their text (see BlotterLinkParser). A
+    page that does not exist (e.g. past the end of the listing) has no
+    links.
+
+    Args:
+        session: requests.Session or FetchScheduler to fetch with
+        url: url of the listing page (str)
+        headers: headers to mimic a human web browser (dict)
+
+    Returns:
+        links: list of the attributes of each <a> tag linking to a blotter,
+            e.g. link["href"] (list)
+    """
+    info = session.get(url, headers=headers)
+    if info.status_code == 404:
+        return []
+    metrics.count("listing_pages_fetched")
+    metrics.count("bytes_fetched", len(info.content))
+    parser = BlotterLinkParser()
+    parser.feed(info.content.decode("utf-8", errors="replace"))
+    parser.close()
+    return parser.links
+
+
+def get_links(session, config, seen=(), queued=()):
+    """Get links to blotters from the listing pages
 
     Get links to police blotters on rep-am.com from the base page (default
-    value https://www.rep-am.com/category/local/records/police/). Links are
-    found using a BeautifulSoup search on every <a> tag for links which
-    contain "blotter" in their href.
+    value https://www.rep-am.com/category/local/records/police/) and the
+    following pages of the listing, up to config.base_pages pages. The first
+    page is fetched on its own; later pages are fetched concurrently, as many
+    at a time as the session allows. The crawl stops at the first page whose
+    links have all been seen before or queued for retry, so a run with
+    nothing to catch up on costs a single request, even while a link which
+    failed is still listed.
 
     Args:
-        session: the current requests.Session (Session)
+        session: the current requests.Session, or a FetchScheduler wrapping
+            it (Session or FetchScheduler)
         config: a SettingsObj, usually generated off config.toml (SettingsObj)
             Properties:
             base_url: url to scrape links to blotters from
+            base_pages: most listing pages to scrape links from
             session_headers: headers to mimic a human web browser
+        seen: previously scraped links (container of str)
+        queued: links queued for retry, which the retry queue schedules
+            itself (container of str)
+
+    Returns:
+        links: list of links to blotters, without duplicates, in listing
+            order (list)
+    """
+    window = 1
+    links = {}
+    page = 1
+    while page <= config.base_pages:
+        pages = range(page, min(page + window, config.base_pages + 1))
+        urls = [page_url(config.base_url, number) for number in pages]
+        logger.info("Getting links to blotters from %s...", ", ".join(urls))
+        found = dict(map_pages(session, urls, config.session_headers))
+        for url in urls:
+            page_links = found[url]
+            fresh = [
+                link
+                for link in page_links
+                if link["href"] not in seen and link["href"] not in queued
+            ]
+            for link in page_links:
+                links.setdefault(link["href"], link)
+            if not fresh:
+                return list(links.values())
+        page += len(urls)
+        window = getattr(session, "concurrency", 1)
+    return list(links.values())
+
+
+def map_pages(session, urls, headers):
+    """Fetch links from listing pages, concurrently if the session allows
+
+    Yields:
+        (url, links): pairs of listing page url and its links to blotters
+    """
+    if len(urls) == 1 or not hasattr(session, "map"):
+        for url in urls:
+            yield url, get_page_links(session, url, headers)
+        return
+    fetches = session.map(lambda url: get_page_links(session, url, headers), urls)
+    for url, future in fetches:
+        yield url, future.result()
+
+
+def sign_in(session, config, reuse=True):
+    """Log session in, reusing the login saved by an earlier run while it
+    lasts
+
+    The login saved in config.login_cookie_file (in the data folder) is
+    reused, without a round trip, while its expiry (see
+    scrape_police.login_expiry, limited to config.login_max_age from when it
+    was saved) is more than config.login_renew_before away. Otherwise the
+    session logs in, and the new login is saved. If config.logged_in_marker
+    is set, every page fetched afterwards is checked for it (see
+    scrape_police.require_login).
+
+    Args:
+        session: the requests.Session to log in (Session)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+        reuse: whether a saved login may be reused (bool)
+
+    Returns:
+        reused: whether the saved login was reused (bool)
+
+    Raises:
+        ct_pd_scraper.exceptions.LoginError: logging in failed
+    """
+    cookie_file = None
+    if config.login_cookie_file:
+        cookie_file = config.data_path / config.login_cookie_file
+    reused = False
+    if reuse and cookie_file and (saved := load_cookies(session, cookie_file)):
+        expiry = login_expiry(session.cookies)
+        if expiry is not None:
+            expiry = min(expiry, saved + config.login_max_age)
+            reused = expiry - time.time() > config.login_renew_before
+    if reused:
+        logger.info("Reusing the saved login")
+        metrics.count("logins_reused")
+    else:
+        session.cookies.clear()
+        logger.info("Signing into %s...", config.login_url)
+        login(config.login_url, session, config.login_headers, config.log_info)
+        if cookie_file:
+            save_cookies(session, cookie_file)
+    # Checked once per session, though it may be signed in again
+    if config.logged_in_marker and not session.hooks["response"]:
+        require_login(session, config.logged_in_marker)
+    return reused
+
+
+def forget_login(config):
+    """Delete the saved login, e.g. once the site no longer accepts it"""
+    if config.login_cookie_file:
+        (config.data_path / config.login_cookie_file).unlink(missing_ok=True)
+
+
+def get_fetcher(session, config):
+    """Wrap session for fetching pages, as set up in config
+
+    Args:
+        session: the logged in requests.Session (Session)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+
+    Returns:
+        fetcher: a FetchScheduler rate limiting session, wrapped in a
+            CachedFetcher if the cache is enabled
+    """
+    fetcher = FetchScheduler(session, **config.fetch_config)
+    if config.cache_enabled:
+        cache = httpcache.ResponseCache(
+            config.data_path / config.cache_dir,
+            max_bytes=config.cache_max_bytes,
+            max_age=config.cache_max_age,
+        )
+        fetcher = httpcache.CachedFetcher(fetcher, cache)
+    return fetcher
+
+
+def evict_cache(fetcher):
+    """Trim the response cache fetcher reads through, if it has one
+
+    Done once blotters have been scraped, rather than at startup, so that a
+    run with nothing new to scrape does not scan the whole cache.
+    """
+    if isinstance(fetcher, httpcache.CachedFetcher):
+        fetcher.cache.evict()
+
+
+def scrape_links(fetcher, links, config, prev_links):
+    """Scrape, clean, and insert the blotters at links
+
+    Blotters are run through the streaming pipeline: fetched concurrently
+    through fetcher, parsed and cleaned in a second thread, and inserted in
+    batches over a single connection. If the archive is enabled, every
+    fetched page is archived. Failures are noted and continued around.
+
+    Args:
+        fetcher: FetchScheduler wrapping the logged in session, possibly
+            wrapped in turn by a CachedFetcher
+        links: urls of blotters to scrape (list)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+        prev_links: store of previously scraped links, which successfully
+            inserted links are added to (SQLiteLinkStore or JSONLinkStore)
 
     Returns:
-        links: list of links to blotters (list)
+        failed_scrapes: list of (link, exception) pairs for links which
+            failed (list)
     """
-    print(f"Getting links to blotters from {config.base_url}...")
-    info = session.get(config.base_url, headers=config.session_headers)
-    link_strainer = SoupStrainer("a")
-    soup = BeautifulSoup(info.content, "html.parser", parse_only=link_strainer)
-    blotter = re.compile("blotter")
-    links = soup.findAll(href=blotter, string=blotter)
-    return links
+    insert = inserter.get_inserter(config.inserter_type, config=config.connconfig)
+    archive = None
+    if config.archive_enabled:
+        archive = BlotterArchive(
+            config.data_path / config.archive_dir, config.archive_segment_bytes
+        )
+    try:
+        return run_pipeline(links, fetcher, insert, prev_links, config, archive)
+    finally:
+        insert.close()
+        evict_cache(fetcher)
+        if archive is not None:
+            archive.close()
 
 
 def main():
@@ -48,18 +300,25 @@ def main():
     This is the main method of this script. All input and modification can
     be done through a config.toml file located in the current working
     directory. This method creates and maintains a Session which is logged
-    into rep-am.com. Links to blotters are scraped from the main page of the
-    police news, and each blotter is then scraped for arrest records. These
-    arrest records are cleaned of junk and inserted into the given database.
-    Any errors in scraping, cleaning, or inserting are noted, and then
-    continued around. Finally, all successfully scraped links urls are saved to
-    the prev_links file to not be scraped again in the future. If no errors are
-    raised, the program then quits. If there were errors during the process,
-    the prompt remains open waiting for confirmation to close.
+    into rep-am.com, reusing the login saved by an earlier run until it
+    expires. Links to blotters are scraped from the listing pages of
+    the police news, and each blotter is then scraped for arrest records.
+    Blotters are fetched concurrently through a FetchScheduler, which keeps to
+    a per host rate that backs off when the site struggles. These arrest records
+    are cleaned of junk and inserted into the given database in batches, one
+    transaction per batch, over a single connection, with fetching, cleaning,
+    and inserting overlapping in a streaming pipeline. Any errors in
+    scraping, cleaning, or inserting are noted, and then continued around.
+    As each batch is committed, its links are saved to the prev_links store
+    to not be scraped again in the future. If no errors are raised, the
+    program then quits. If there were errors during the process,
+    the prompt remains open waiting for confirmation to close. Each stage is
+    timed and counted, and the metrics are written to the run report files
+    given in config.toml, whether or not the run succeeds.
 
     Returns:
         None
-        prints multiple times during the process
+        logs progress during the process
 
     Raises:
         ct_pd_scraper.exceptions.ScraperException: an exception occurred during
@@ -68,57 +327,94 @@ def main():
     """
 
     config = settings.SettingsObj("config.toml")
+    settings.configure_logging(config)
+    metrics.REGISTRY.reset()
+    try:
+        scrape_new_links(config)
+    finally:
+        write_metrics(config)
+
 
+def scrape_new_links(config):
+    """Log in, then scrape every blotter not scraped before (see main)"""
     with requests.Session() as session:
-        print(f"Signing into {config.login_url}...")
-        login(config.login_url, session, config.login_headers, config.log_info)
+        reused = sign_in(session, config)
 
-        links = get_links(session, config)
+        fetcher = get_fetcher(session, config)
 
         link_file = config.data_path / config.link_file
-        prev_links = settings.get_prev_links(link_file)
+        link_store = linkstore.get_link_store(
+            config.link_store, config.data_path / config.link_db, link_file
+        )
+        retry_queue = retryqueue.RetryQueue(
+            config.data_path / config.retry_db, **config.retry_config
+        )
+        with link_store as prev_links, retry_queue as retries:
+            with metrics.timer("get_links"):
+                try:
+                    links = get_links(fetcher, config, seen=prev_links, queued=retries)
+                except exceptions.LoginError:
+                    if not reused:
+                        raise
+                    logger.warning("The saved login has lapsed, signing in again")
+                    sign_in(session, config, reuse=False)
+                    links = get_links(fetcher, config, seen=prev_links, queued=retries)
 
-        new_links = [link["href"] for link in links if link["href"] not in prev_links]
+            new_links = [
+                link["href"] for link in links if link["href"] not in prev_links
+            ]
 
-        if new_links:
-            print("New links available, scraping...")
-        else:
-            print("No new links available, exiting...")
-            return
+            metrics.count("links_new", len(new_links))
+            links = retries.select(new_links)
+            metrics.count("links_retried", sum(link in retries for link in links))
+            if links:
+                logger.info("New links available, scraping...")
+            else:
+                logger.info("No new links available, exiting...")
+                return
 
-        insert = inserter.get_inserter(config.inserter_type, config=config.connconfig)
-        failed_scrapes = []
-        try:
-            for link in tqdm(new_links, ascii=True):
-                try:
-                    print("\nsleeping")
-                    sleep(31)
+            failed_scrapes = scrape_links(fetcher, links, config, prev_links)
+            retries.settle(links, failed_scrapes, prev_links)
+        if failed_scrapes:
+            report_failures(failed_scrapes)
+            raise exceptions.ScraperException
+        logger.info("COMPLETE")
 
-                    print(f"Current link: {link}")
 
-                    blot, date, pdcity = scrape(link, session, config.session_headers)
+def report_failures(failed_scrapes):
+    """Log the links which failed, and whether the run was cut short"""
+    logger.error("Scrapes failed: %d", len(failed_scrapes))
+    for link, error in failed_scrapes:
+        logger.error("%s due to %s,", link, error)
+    if any(isinstance(error, exceptions.SiteDownError) for _, error in failed_scrapes):
+        logger.error("The site is not answering; links not scraped are queued")
+    logger.info("Failed links are retried by later runs, with backoff")
 
-                    clean = cleaner.get_cleaner(config.cleaner_type)
-                    clean_record = clean.clean_incidents(blot)
-                    with insert:
-                        insert.insert(clean_record, date=date, pdcity=pdcity)
 
-                    prev_links.append(link)
+def write_metrics(config):
+    """Write the run's metrics to the report files given in config
 
-                    print("Finished link")
-                except Exception as e:
-                    print(f"Scraping link {link} failed, due to:", str(e))
-                    print(traceback.print_tb(e.__traceback__))
-                    failed_scrapes.append((link, e))
-        finally:
-            with open(link_file, "w") as f:
-                json.dump(prev_links, f)
-        if failed_scrapes:
-            print(f"Scrapes failed: {len(failed_scrapes)}")
-            for pair in failed_scrapes:
-                print(f"{pair[0]} due to {str(pair[1])},")
-            raise exceptions.ScraperException
-        print("COMPLETE")
+    A summary of time spent in each stage is logged as well. Failing to
+    write the reports is logged, rather than raised over the run's result.
+    """
+    report = metrics.REGISTRY.report()
+    for stage, summary in report["stages"].items():
+        logger.info(
+            "%s: %d calls in %.2fs (p50 %.1fms, p95 %.1fms, %d errors)",
+            stage,
+            summary["calls"],
+            summary["seconds"],
+            summary["p50"] * 1000,
+            summary["p95"] * 1000,
+            summary["errors"],
+        )
+    try:
+        metrics.REGISTRY.write(
+            config.metrics_report and config.data_path / config.metrics_report,
+            config.metrics_prometheus and config.data_path / config.metrics_prometheus,
+        )
+    except OSError as e:
+        logger.error("Writing the run report failed: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+"""Append-only archive of fetched blotter pages for ct_pd_scraper"""
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+
+ArchivedBlotter = namedtuple(
+    "ArchivedBlotter", ["id", "url", "date", "pdcity", "fetched", "html"]
+)
+
+
+class BlotterArchive:
+    """Append-only, compressed archive of raw blotter pages
+
+    Pages are appended to segment files as separate gzip members, and an
+    SQLite index records the url, date, pdcity, and fetch time of each page
+    along with where it is stored. A page is written and synced before it is
+    indexed, so a crash can at most leave unindexed bytes at the end of a
+    segment, which are ignored. Segments are plain concatenated gzip, so they
+    can also be read with zcat.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        """Open (creating if needed) the archive
+
+        Args:
+            directory: folder holding the segments and index (str or Path)
+            segment_bytes: size after which a new segment is started (int)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            self.directory / "index.db", check_same_thread=False
+        )
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blotter (
+                    id INTEGER PRIMARY KEY, url TEXT, date TEXT, pdcity TEXT,
+                    fetched TEXT, segment TEXT, offset INTEGER, length INTEGER)
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS blotter_url ON blotter (url)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM blotter").fetchone()[0]
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM blotter WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None
+
+    def _segment(self):
+        """Get the segment to append to, starting a new one if it is full"""
+        segments = sorted(self.directory.glob("blotters-*.gz"))
+        if segments and segments[-1].stat().st_size < self.segment_bytes:
+            return segments[-1]
+        number = int(segments[-1].stem.split("-")[1]) + 1 if segments else 1
+        return self.directory / f"blotters-{number:05d}.gz"
+
+    def append(self, url, html, date=None, pdcity=None):
+        """Add a fetched page to the archive
+
+        Args:
+            url: url the page was fetched from (str)
+            html: raw page content (bytes or str)
+            date: date the blotter was posted, as written on the page (str)
+            pdcity: police department the blotter is from (str)
+        """
+        if isinstance(html, str):
+            html = html.encode("utf-8")
+        self.append_compressed(url, gzip.compress(html), date, pdcity)
+
+    def append_compressed(self, url, data, date=None, pdcity=None):
+        """Add a fetched page, already compressed as a gzip member, to the
+        archive, as append does
+
+        Args:
+            url: url the page was fetched from (str)
+            data: the page as a complete gzip member (bytes), or a file
+                holding it, which is copied from its start (file)
+            date, pdcity: as for append
+        """
+        fetched = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            segment = self._segment()
+            with open(segment, "ab") as f:
+                offset = f.tell()
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, f)
+                length = f.tell() - offset
+                f.flush()
+                os.fsync(f.fileno())
+            with self.conn:
+                self.conn.execute(
+                    """
+                    INSERT INTO blotter
+                    (url, date, pdcity, fetched, segment, offset, length)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (url, date, pdcity, fetched, segment.name, offset, length),
+                )
+
+    def records(self, pdcity=None):
+        """Stream archived pages in the order they were archived
+
+        Args:
+            pdcity: only yield pages from this police department (str)
+
+        Yields:
+            ArchivedBlotter tuples of id, url, date, pdcity, fetched, and the
+                raw html (bytes)
+        """
+        sql = "SELECT id, url, date, pdcity, fetched, segment, offset, length "
+        sql += "FROM blotter WHERE id > ?"
+        params = []
+        if pdcity is not None:
+            sql += " AND pdcity = ?"
+            params.append(pdcity)
+        sql += " ORDER BY id LIMIT 100"
+        last_id = 0
+        files = {}
+        try:
+            while True:
+                with self.lock:
+                    rows = self.conn.execute(sql, [last_id, *params]).fetchall()
+                if not rows:
+                    return
+                for row in rows:
+                    last_id, url, date, city, fetched, segment, offset, length = row
+                    if segment not in files:
+                        files[segment] = open(self.directory / segment, "rb")
+                    files[segment].seek(offset)
+                    html = gzip.decompress(files[segment].read(length))
+                    yield ArchivedBlotter(last_id, url, date, city, fetched, html)
+        finally:
+            for f in files.values():
+                f.close()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,52 @@
+"""Atomic file writes for ct_pd_scraper
+
+State kept between runs (seen links, checkpoints, watermarks, schedules,
+saved logins, run reports, and cached pages) is written to a temporary file
+in the same folder, which then replaces the original, so a run which is
+killed part way through leaves the last complete version rather than half a
+file.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+
+# Read once, as os.umask can only be read by setting it, which is not safe
+# once other threads may be creating files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def replace(path, data, sync=True, mode=None):
+    """Atomically replace the file at path with data
+
+    Each write has its own temporary file, so threads or processes writing
+    the same file at once never write into each other's; the last to finish
+    wins. The temporary file is removed if the write fails.
+
+    Args:
+        path: file to replace (Path or str)
+        data: new contents of the file (str or bytes)
+        sync: whether to flush the new file to disk before it replaces the
+            old one, so a power cut cannot leave it empty (bool)
+        mode: permissions of the new file, defaulting to those of any new
+            file (int)
+    """
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    fd, temp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp makes files readable only by the user
+        os.chmod(temp_path, 0o666 & ~_UMASK if mode is None else mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
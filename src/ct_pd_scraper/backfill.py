@@ -0,0 +1,379 @@
+"""Resumable backfill of older blotters for ct_pd_scraper
+
+A normal run stops at the first listing page it has seen before. A backfill
+instead walks the listing back through time, page after page, until it runs
+out of pages, scraping every blotter not scraped before. Progress is kept in
+a checkpoint file in the data folder, which holds only the frontier: the
+next listing page to read, links found but not yet committed, and links
+which failed. Committed links are in the link store, and their records carry
+their url, so the checkpoint only needs saving every few seconds (and when
+the backfill stops): after a crash or Ctrl-C, the next backfill picks up
+from the last checkpoint, and finds the links committed since then (see
+reconcile).
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from itertools import chain
+from pathlib import Path
+
+import requests
+
+from .__main__ import (
+    evict_cache,
+    forget_login,
+    get_fetcher,
+    map_pages,
+    page_url,
+    sign_in,
+    write_metrics,
+)
+from .archive import BlotterArchive
+from .pipeline import run_pipeline
+from . import atomicfile
+from . import inserter
+from . import linkstore
+from . import metrics
+from . import settings
+from . import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Durable progress of a backfill
+
+    Links are pending from the time their listing page is read until the
+    batch holding them is committed, when they are dropped (the link store
+    records them from then on). Changes are saved at most every interval
+    seconds, and whenever save is called; the file is written with
+    atomicfile.
+    """
+
+    def __init__(self, path, base_url, next_page=1, interval=30):
+        self.path = Path(path)
+        self.base_url = base_url
+        self.next_page = next_page
+        self.interval = float(interval)
+        self.finished = False
+        self.pending = []
+        self.failed = []
+        # Links committed by this backfill
+        self.completed = 0
+        self.saved = time.monotonic()
+
+    @classmethod
+    def load(cls, path, base_url, next_page=1, interval=30):
+        """Load the checkpoint at path, or start a new one if there is none
+
+        Links which failed in an earlier backfill are pending again, to be
+        retried.
+
+        Raises:
+            ValueError: the checkpoint is of a backfill of another listing
+        """
+        checkpoint = cls(path, base_url, next_page, interval)
+        if not checkpoint.path.is_file():
+            return checkpoint
+        state = json.loads(checkpoint.path.read_text())
+        if state["base_url"] != base_url:
+            raise ValueError(
+                f"{path} is a backfill of {state['base_url']}; pass --restart "
+                "to start a backfill of the configured listing instead"
+            )
+        checkpoint.next_page = state["next_page"]
+        checkpoint.finished = state["finished"]
+        checkpoint.pending = state["pending"] + [
+            url for url in state["failed"] if url not in state["pending"]
+        ]
+        return checkpoint
+
+    def save(self):
+        """Write the checkpoint to its file"""
+        state = {
+            "base_url": self.base_url,
+            "next_page": self.next_page,
+            "finished": self.finished,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "pending": self.pending,
+            "failed": self.failed,
+        }
+        atomicfile.replace(self.path, json.dumps(state, indent=1))
+        self.saved = time.monotonic()
+
+    def _changed(self):
+        """Save the checkpoint if interval seconds have passed since the last
+        save"""
+        if time.monotonic() - self.saved >= self.interval:
+            self.save()
+
+    def add_pending(self, urls, next_page, finished=False):
+        """Record the links found on listing pages read, up to next_page"""
+        known = set(self.pending)
+        self.pending.extend(url for url in urls if url not in known)
+        self.next_page = next_page
+        self.finished = finished
+        self._changed()
+
+    def complete(self, urls):
+        """Drop links whose batch has been committed"""
+        urls = set(urls)
+        before = len(self.pending) + len(self.failed)
+        self.pending = [url for url in self.pending if url not in urls]
+        self.failed = [url for url in self.failed if url not in urls]
+        self.completed += before - len(self.pending) - len(self.failed)
+        self._changed()
+
+    def fail(self, urls):
+        """Record links which failed, to retry in the next backfill"""
+        urls = set(urls)
+        self.pending = [url for url in self.pending if url not in urls]
+        failed = set(self.failed)
+        self.failed.extend(url for url in urls if url not in failed)
+        self._changed()
+
+
+class _CheckpointedLinks:
+    """Link store handed to run_pipeline, which also checkpoints the links
+    of each batch as it is committed"""
+
+    def __init__(self, prev_links, checkpoint):
+        self.prev_links = prev_links
+        self.checkpoint = checkpoint
+
+    def __contains__(self, url):
+        return url in self.prev_links
+
+    def add_many(self, urls):
+        urls = list(urls)
+        self.prev_links.add_many(urls)
+        self.checkpoint.complete(urls)
+
+
+def reconcile(checkpoint, insert, prev_links):
+    """Complete pending links which were committed after the checkpoint was
+    last saved
+
+    A crash after a batch is committed, but before the checkpoint is next
+    saved, leaves its links pending. They are found either in the link
+    store, or by the url recorded with their records, and are not scraped
+    again.
+
+    Returns:
+        count: number of pending links found to be committed (int)
+    """
+    committed = {url for url in checkpoint.pending if url in prev_links}
+    with insert:
+        committed.update(insert.inserted_urls(checkpoint.pending))
+    if committed:
+        prev_links.add_many(committed)
+        checkpoint.complete(committed)
+    return len(committed)
+
+
+def read_listing(fetcher, checkpoint, config, prev_links, want, max_pages=0):
+    """Read listing pages from the checkpoint's next page on
+
+    Pages are read as many at a time as the fetcher allows, until want
+    links are pending, max_pages pages have been read, or the listing ends
+    (a page with no blotters). Links already scraped are skipped.
+
+    Returns:
+        pages: number of listing pages read (int)
+    """
+    window = getattr(fetcher, "concurrency", 1)
+    read = 0
+    while len(checkpoint.pending) < want and not checkpoint.finished:
+        if max_pages:
+            window = min(window, max_pages - read)
+            if window <= 0:
+                break
+        pages = range(checkpoint.next_page, checkpoint.next_page + window)
+        urls = [page_url(config.base_url, page) for page in pages]
+        logger.info("Getting links to blotters from %s...", ", ".join(urls))
+        found = dict(map_pages(fetcher, urls, config.session_headers))
+        links = []
+        finished = False
+        for url in urls:
+            if not found[url]:
+                finished = True
+                break
+            links.append(link["href"] for link in found[url])
+        read += len(links)
+        fresh = [
+            url
+            for url in dict.fromkeys(chain.from_iterable(links))
+            if url not in prev_links
+        ]
+        checkpoint.add_pending(fresh, checkpoint.next_page + len(links), finished)
+        metrics.count("links_new", len(fresh))
+        if finished:
+            logger.info("Reached the end of the listing")
+    return read
+
+
+def backfill(
+    fetcher, insert, prev_links, checkpoint, config, archive=None, max_pages=0
+):
+    """Scrape every blotter of the listing not scraped before
+
+    Listing pages are read until config.batch_size links are pending, then
+    those blotters are run through the streaming pipeline, and so on until
+    the listing ends, or max_pages listing pages have been read. As the site
+    adds blotters, older ones move to later pages, so none are skipped;
+    any seen again are not scraped twice.
+
+    Args:
+        fetcher: FetchScheduler (or CachedFetcher) to fetch through
+        insert: inserter to insert records with (AbstractInserter)
+        prev_links: store of previously scraped links (SQLiteLinkStore or
+            JSONLinkStore)
+        checkpoint: progress to resume from, saved as it advances and when
+            the backfill stops (Checkpoint)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+        archive: archive to add fetched pages to (BlotterArchive)
+        max_pages: most listing pages to read, or 0 for no limit (int)
+
+    Returns:
+        failed_scrapes: list of (link, exception) pairs for links which
+            failed (list)
+    """
+    if resumed := reconcile(checkpoint, insert, prev_links):
+        logger.info("Found %d pending links already inserted", resumed)
+    committed = _CheckpointedLinks(prev_links, checkpoint)
+    failed_scrapes = []
+    pages_read = 0
+    try:
+        while True:
+            if not checkpoint.finished and (not max_pages or pages_read < max_pages):
+                pages_read += read_listing(
+                    fetcher,
+                    checkpoint,
+                    config,
+                    prev_links,
+                    config.batch_size,
+                    max_pages and max_pages - pages_read,
+                )
+            if not checkpoint.pending:
+                break
+            logger.info(
+                "Scraping %d blotters, up to listing page %d...",
+                len(checkpoint.pending),
+                checkpoint.next_page - 1,
+            )
+            failed = run_pipeline(
+                list(checkpoint.pending), fetcher, insert, committed, config, archive
+            )
+            checkpoint.fail(link for link, _ in failed if link is not None)
+            failed_scrapes.extend(failed)
+            if checkpoint.pending:
+                # The pipeline was cut short without failing its links
+                break
+    finally:
+        checkpoint.save()
+    return failed_scrapes
+
+
+def main(argv=None):
+    """Backfill older blotters from the listing given by config.toml
+
+    Args:
+        argv: command line arguments, defaulting to sys.argv (list)
+
+    Raises:
+        ct_pd_scraper.exceptions.ScraperException: some blotters failed; they
+            are retried by the next backfill
+    """
+    parser = argparse.ArgumentParser(
+        description="Scrape older blotters, resuming from the last checkpoint"
+    )
+    parser.add_argument(
+        "--pages", type=int, help="most listing pages to read in this run"
+    )
+    parser.add_argument(
+        "--start-page", type=int, default=1, help="listing page to start from"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="discard the checkpoint and start again from --start-page",
+    )
+    args = parser.parse_args(argv)
+
+    config = settings.SettingsObj("config.toml")
+    settings.configure_logging(config)
+    config.batch_size = config.backfill_batch_size
+    config.flush_seconds = config.backfill_flush_seconds
+    checkpoint_file = config.data_path / config.backfill_checkpoint
+    if args.restart and checkpoint_file.is_file():
+        checkpoint_file.unlink()
+    checkpoint = Checkpoint.load(
+        checkpoint_file,
+        config.base_url,
+        args.start_page,
+        config.backfill_checkpoint_seconds,
+    )
+    if checkpoint.finished and not checkpoint.pending:
+        logger.info("Backfill already complete; pass --restart to run it again")
+        return
+    logger.info("Backfilling from listing page %d...", checkpoint.next_page)
+    metrics.REGISTRY.reset()
+    try:
+        failed = run_backfill(
+            config, checkpoint, args.pages or config.backfill_max_pages
+        )
+    except KeyboardInterrupt:
+        logger.info(
+            "Stopped; %d links pending. Run again to resume from listing page %d",
+            len(checkpoint.pending),
+            checkpoint.next_page,
+        )
+        return
+    finally:
+        write_metrics(config)
+    logger.info("Links completed: %d", checkpoint.completed)
+    if failed:
+        logger.error("Scrapes failed: %d", len(failed))
+        for link, error in failed:
+            logger.error("%s due to %s,", link, error)
+        raise exceptions.ScraperException
+    logger.info("COMPLETE" if checkpoint.finished else "Stopped at the page limit")
+
+
+def run_backfill(config, checkpoint, max_pages=0):
+    """Log in, then backfill from checkpoint (see backfill)"""
+    with requests.Session() as session:
+        sign_in(session, config)
+        fetcher = get_fetcher(session, config)
+        link_store = linkstore.get_link_store(
+            config.link_store,
+            config.data_path / config.link_db,
+            config.data_path / config.link_file,
+        )
+        insert = inserter.get_inserter(config.inserter_type, config=config.connconfig)
+        archive = None
+        if config.archive_enabled:
+            archive = BlotterArchive(
+                config.data_path / config.archive_dir, config.archive_segment_bytes
+            )
+        try:
+            with link_store as prev_links:
+                return backfill(
+                    fetcher, insert, prev_links, checkpoint, config, archive, max_pages
+                )
+        except exceptions.LoginError:
+            # The next backfill logs in afresh, rather than reusing the login
+            forget_login(config)
+            raise
+        finally:
+            insert.close()
+            evict_cache(fetcher)
+            if archive is not None:
+                archive.close()
+
+
+if __name__ == "__main__":
+    main()
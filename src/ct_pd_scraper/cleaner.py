@@ -1,7 +1,9 @@
 """Data cleaner for ct_pd_scraper"""
-
-import ast
-import json
+import hashlib
+import logging
+import re
+from datetime import date
+from functools import lru_cache
 
 
 MONTHS = [
@@ -18,37 +20,48 @@ MONTHS = [
     "November",
     "December",
 ]
+MONTH_NUMBERS = {month: number for number, month in enumerate(MONTHS, 1)}
+
+
+# Fields of an arrest record after the name, e.g. "34, of 5 Main St.,
+# Naugatuck, charged with breach of peace. Court date: April 2."
+RECORD_FIELDS = re.compile(
+    r"""
+    ^(?:(?P<age>\d{1,3}),\s*)?
+    (?:of\s+(?P<residence>[^,]+
+        (?:,\s+(?-i:[A-Z0-9])(?!(?:was|were|is|charged|arrested)\b)[^,]+)*)
+        ,?\s*)?
+    (?:(?:(?:was|were|is)\s+)?(?:charged|arrested)\b(?:\s+\w+)??\s+(?:with|on)\s+
+        (?P<charges>[^.;]+))?
+    (?:[.;,]?\s*(?:next\s+)?court\s+date(?:\s+is)?[:\s]\s*(?P<court_date>[^.]+))?
+    (?:\.?\s*|[.,;]?\s+.*)$
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+RECORD_AGE = re.compile(r"^(\d{1,3}),")
+
+logger = logging.getLogger(__name__)
 
 
 def get_cleaner(variety, **kwargs):
     """Factory method for returning appropriate cleaner
 
     Args:
-        variety: currently nothing - intended as selecter flag (str)
+        variety: key of the cleaner in CLEANERS, e.g. "basic" or
+            "structured" (str)
         **kwargs: any further arguments for the cleaner
 
     Returns:
         The cleaner specified
+
+    Raises:
+        TypeError: variety is not a known cleaner
     """
-    # if (variety.lower()) == "basic":
-    #     return Basic_Cleaner(**kwargs)
-    # elif cased == "testing":
-    #     return Cleaner(**kwargs)
-    return BasicCleaner(**kwargs)
-
-
-def get_dirty_incident(file_name):
-    """Method of getting police blotters from either text or json file"""
-    if file_name.endswith(".json"):
-        with open(file_name, "r") as f:
-            dirty_incident = json.load(f)
-    elif file_name.endswith(".txt"):
-        with open(file_name, "r") as f:
-            dirty_incident = f.read()
-            dirty_incident = ast.literal_eval(dirty_incident)
-    else:
-        raise IOError("Expected .json or .txt")
-    return dirty_incident
+    try:
+        cleaner_class = CLEANERS[variety.lower()]
+    except KeyError:
+        raise TypeError("Please choose an appropriate cleaner type") from None
+    return cleaner_class(**kwargs)
 
 
 def get_arrests(dirty_incidents):
@@ -65,39 +78,53 @@ def get_arrests(dirty_incidents):
         arrests: list of non-junk records. May still contain certain
             non-content records. (list)
     """
-    arrests = []
+    return list(iter_arrests(dirty_incidents))
+
+
+def iter_arrests(dirty_incidents):
+    """Yield the arrest records of a scraped blotter one at a time, as
+    get_arrests finds them, so dirty_incidents may be a generator (e.g. a
+    scrape_police.StreamedBlotter) without being held in memory"""
     for phrase in dirty_incidents:
         try:
             if phrase.split(", ")[0].isupper():
-                arrests.append(phrase)
+                yield phrase
         except Exception:
             continue
-    return arrests
 
 
+@lru_cache(maxsize=1024)
 def clean_date(natural_date):
     """Transform a natural language date into an isoformat date
 
-    Transform a date ("March 27, 2020") into an isoformat date ("2020-3-27").
+    Transform a date ("March 7, 2020") into a zero-padded isoformat date
+    ("2020-03-07"), which sorts and compares correctly as text. ISO dates
+    without padding ("2020-3-7", as stored by older versions) are padded.
+    Parsed dates are cached, as every record of a blotter shares its date.
 
     Args:
         natural_date: a naturally written date with only cardinal numbers, not
             ordinal numbers
-                Yes: "March 27, 2020"
-                No: "March 27th, 2020"
+                Yes: "March 7, 2020"
+                No: "March 7th, 2020"
 
     Returns:
         isodate: date formatted to ISO specifications in the format
-            YYYY-MM-DD. Returns "0000-00-00" if something is wrong.
+            YYYY-MM-DD, or None if it is missing or not a real date (str)
     """
+    if not natural_date:
+        return None
     try:
-        *rest, year = natural_date.rsplit(", ")
-        month_str, day = rest[0].split()
-        month = str(MONTHS.index(month_str) + 1)
-        isodate = "-".join([year, month, day])
+        if natural_date[:1].isdigit():
+            year, month, day = natural_date.split("-")
+        else:
+            month_day, year = natural_date.rsplit(", ", 1)
+            month_str, day = month_day.split()
+            month = MONTH_NUMBERS[month_str]
+        isodate = date(int(year), int(month), int(day)).isoformat()
     except Exception as e:
-        print("Date failed due to:", e)
-        isodate = "0000-00-00"
+        logger.warning("Date %r failed due to: %r", natural_date, e)
+        isodate = None
     return isodate
 
 
@@ -117,14 +144,14 @@ class BasicCleaner:
         and the non-name content of the arrest record.
 
         Args:
-            dirty_incident: list of records from scrape_police.scrape() (list)
+            dirty_incident: records from scrape_police.scrape(), or a
+                StreamedBlotter yielding them as they are read (iterable)
 
         Returns:
             self.incidents: a dictionary of cleaned records -- any malformed
                 records are removed as well.
         """
-        arrests = get_arrests(dirty_incident)
-        for index, phrase in enumerate(arrests):
+        for index, phrase in enumerate(iter_arrests(dirty_incident)):
             current_arrest = phrase.split(", ", 1)
             self.incidents[index] = {}
             try:
@@ -134,3 +161,148 @@ class BasicCleaner:
                 self.incidents.pop(index, None)
                 continue
         return self.incidents
+
+    def clean_records(self, dirty_incident):
+        """Clean given blotter as clean_incidents does, yielding records one
+        at a time rather than keeping them
+
+        Yields:
+            record: dictionary with the keys name and content
+        """
+        for phrase in iter_arrests(dirty_incident):
+            name, sep, content = phrase.partition(", ")
+            if sep:
+                yield {"name": name, "content": content}
+
+
+def split_residence(residence):
+    """Split a residence into street address and town
+
+    Args:
+        residence: residence as written, e.g. "5 Main St., Naugatuck" (str)
+
+    Returns:
+        (address, town): either may be None if not given
+    """
+    if not residence:
+        return None, None
+    address, _, town = residence.rpartition(", ")
+    if not address and town[:1].isdigit():
+        return town, None
+    return address or None, town
+
+
+def record_fields(content):
+    """Extract the structured fields of an arrest record
+
+    Args:
+        content: the record after the name, e.g. "34, of 5 Main St.,
+            Naugatuck, charged with breach of peace." (str)
+
+    Returns:
+        fields: dictionary with the keys age (int), address, town, charges,
+            and court_date, each None if it cannot be found (dict)
+    """
+    fields = RECORD_FIELDS.match(content)
+    if fields:
+        age, residence, charges, court_date = fields.groups()
+    else:
+        age = RECORD_AGE.match(content)
+        age = age.group(1) if age else None
+        residence = charges = court_date = None
+    address, town = split_residence(residence)
+    return {
+        "age": int(age) if age else None,
+        "address": address,
+        "town": town,
+        "charges": charges,
+        "court_date": court_date,
+    }
+
+
+def record_hash(url, name, content, date):
+    """Hash identifying an arrest record, however many times it is scraped
+
+    The name is normalized as for de-duplicating persons (case, periods, and
+    extra whitespace ignored) and the content's whitespace is collapsed, so
+    the same record scraped or reprocessed again hashes the same.
+
+    Args:
+        url: url of the blotter the record is from, or None (str)
+        name: name of the arrested person, as written or as first and last
+            names joined by a space (str)
+        content: the record after the name (str)
+        date: ISO date of the blotter, or None (str)
+
+    Returns:
+        digest: 32 character hex digest (str)
+    """
+    name = " ".join(name.replace(".", " ").upper().split())
+    key = "\x1f".join((url or "", name, " ".join(content.split()), date or ""))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class StructuredCleaner:
+    """Clean blotters into name, content, and structured fields
+
+    Gives the same name and content as BasicCleaner, and adds age, town,
+    address, charges, and court_date fields extracted from the content in a
+    single pass of a precompiled pattern (see record_fields). Fields which
+    cannot be found are None.
+    """
+
+    def clean_incidents(self, dirty_incident):
+        """Clean given blotter
+
+        Args:
+            dirty_incident: records from scrape_police.scrape(), or a
+                StreamedBlotter yielding them as they are read (iterable)
+
+        Returns:
+            incidents: a dictionary of cleaned records, keyed by index. Each
+                record is a dictionary with the keys name, content, age,
+                town, address, charges, and court_date.
+        """
+        return dict(enumerate(self.clean_records(dirty_incident)))
+
+    def clean_records(self, dirty_incident):
+        """Clean given blotter, yielding records one at a time
+
+        A record is an arrest if the text before its first ", " is all caps
+        and there is text after it, as with BasicCleaner.
+
+        Yields:
+            record: dictionary with the keys name, content, age, town,
+                address, charges, and court_date
+        """
+        for phrase in dirty_incident:
+            if not isinstance(phrase, str):
+                continue
+            name, sep, content = phrase.partition(", ")
+            if not sep or not name.isupper():
+                continue
+            record = {"name": name, "content": content}
+            record.update(record_fields(content))
+            yield record
+
+    def clean_blotters(self, blotters):
+        """Clean many blotters as a batch
+
+        Args:
+            blotters: iterable of (dirty_incident, date, pdcity) tuples, as
+                from scrape_police.scrape() (iterable)
+
+        Returns:
+            cleaned: list of (incidents, date, pdcity) tuples, ready for
+                AbstractInserter.insert_many (list)
+        """
+        return [
+            (self.clean_incidents(dirty_incident), date, pdcity)
+            for dirty_incident, date, pdcity in blotters
+        ]
+
+
+CLEANERS = {
+    "basic": BasicCleaner,
+    "structured": StructuredCleaner,
+}
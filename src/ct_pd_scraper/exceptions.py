@@ -1,2 +1,14 @@
 class ScraperException(Exception):
     pass
+
+
+class LoginError(ScraperException):
+    pass
+
+
+class SiteDownError(ScraperException):
+    pass
+
+
+class SearchUnavailableError(ScraperException):
+    pass
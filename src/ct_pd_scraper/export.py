@@ -0,0 +1,329 @@
+"""Streaming export of the database for ct_pd_scraper
+
+Every arrest record, joined with its person, is written to CSV, Parquet, or
+Arrow files for analysis elsewhere. Rows are streamed from the database a
+chunk at a time (through a server-side cursor for MySQL), and written as
+they arrive, so memory use stays the same however large the database grows.
+
+Files can be partitioned by police department and month, in directories
+named in the Hive style (e.g. pdcity=Naugatuck/month=2020-03/) which most
+tools read as columns. After each export, the highest content id exported is
+saved as a watermark in the output directory, so an incremental export
+writes only the records inserted since. Files are written under temporary
+names and renamed only once the export is complete, so an export which fails
+leaves neither partial files nor a watermark past what was written.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+from itertools import groupby
+from pathlib import Path
+
+from .inserter import EXPORT_COLUMNS
+from . import atomicfile
+from . import inserter
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+SUFFIXES = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+WATERMARK_FILE = "_export_watermark.json"  # Dataset readers skip files starting with _
+
+
+class CSVWriter:
+    """Writes rows to a CSV file, with a header of EXPORT_COLUMNS"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+    """Writes rows to a Parquet or Arrow (IPC file) file with pyarrow
+
+    Rows are buffered until batch_rows have been written, then converted to
+    columns and written as one row group (or record batch), so files are
+    read efficiently however small the writes to them are.
+    """
+
+    def __init__(self, path, variety, batch_rows=5000):
+        # Imported here, as only columnar exports need pyarrow installed
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(
+                f'Exporting to "{variety}" requires pyarrow to be installed'
+            ) from None
+
+        self.pa = pyarrow
+        self.schema = arrow_schema(pyarrow)
+        if variety == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(str(path), self.schema)
+        self.batch_rows = batch_rows
+        self.pending = []
+
+    def write(self, rows):
+        self.pending.extend(rows)
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        columns = zip(*self.pending)
+        arrays = [
+            self.pa.array(
+                [as_date(value) for value in values]
+                if field.name == "date"
+                else values,
+                type=field.type,
+            )
+            for values, field in zip(columns, self.schema)
+        ]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(self.pa.Table.from_batches([batch]))
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def arrow_schema(pa):
+    """Get the pyarrow schema of exported rows"""
+    types = {"id": pa.int64(), "date": pa.date32(), "age": pa.int32()}
+    return pa.schema(
+        [(column, types.get(column, pa.string())) for column in EXPORT_COLUMNS]
+    )
+
+
+def get_writer(variety, path, batch_rows=5000):
+    """Factory method for returning a writer of export files
+
+    Args:
+        variety: "csv", "parquet", or "arrow" (str)
+        path: file to write (Path)
+        batch_rows: rows per row group of columnar files (int)
+    """
+    if (cased := variety.lower()) == "csv":
+        return CSVWriter(path)
+    if cased in ("parquet", "arrow"):
+        return ArrowWriter(path, cased, batch_rows)
+    raise TypeError("Please choose an appropriate export format")
+
+
+def as_date(value):
+    """Convert a date read from the database (an ISO date string in SQLite)
+    to a date, or None if it is missing or unreadable"""
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _path_part(value):
+    """Make a value safe to use in a directory name"""
+    return re.sub(r"[^\w.-]+", "_", str(value)) if value else "unknown"
+
+
+def partition_key(row):
+    """Get the (pdcity, month) partition of an exported row"""
+    pdcity = row[EXPORT_COLUMNS.index("pdcity")]
+    record_date = as_date(row[EXPORT_COLUMNS.index("date")])
+    month = record_date.strftime("%Y-%m") if record_date else None
+    return _path_part(pdcity), _path_part(month)
+
+
+def _temp_path(path):
+    return path.with_name(path.name + ".tmp")
+
+
+def read_watermark(directory, pdcity=None):
+    """Get the highest content id exported to directory before, or 0
+
+    Watermarks are kept apart for exports of a single police department
+    (pdcity) and of every department (None).
+    """
+    path = Path(directory) / WATERMARK_FILE
+    try:
+        state = json.loads(path.read_text())
+    except FileNotFoundError:
+        return 0
+    return int(state["last_id"].get(pdcity or "", 0))
+
+
+def save_watermark(directory, last_id, pdcity=None):
+    """Record last_id as the highest content id exported to directory"""
+    path = Path(directory) / WATERMARK_FILE
+    try:
+        state = json.loads(path.read_text())
+    except FileNotFoundError:
+        state = {"last_id": {}}
+    state["last_id"][pdcity or ""] = last_id
+    state["updated"] = datetime.now().isoformat(timespec="seconds")
+    atomicfile.replace(path, json.dumps(state, indent=1))
+
+
+def export(
+    insert,
+    directory,
+    variety="csv",
+    partition=False,
+    after_id=0,
+    pdcity=None,
+    chunk=5000,
+    stamp=None,
+):
+    """Write records from the database to export files in directory
+
+    Each export writes new files, named for when it started, so incremental
+    exports add to the files of earlier ones rather than replacing them.
+    Partitioned, rows are read ordered by police department and date, so
+    only one file is open at a time.
+
+    Args:
+        insert: connected inserter to read records with (AbstractInserter)
+        directory: directory to write files in (Path)
+        variety: "csv", "parquet", or "arrow" (str)
+        partition: write a file per police department and month (bool)
+        after_id: only export records with a content id above this (int)
+        pdcity: only export records from this police department (str)
+        chunk: rows read from the database at a time (int)
+        stamp: name of this export's files, defaulting to the time (str)
+
+    Returns:
+        exported: number of records exported (int)
+        last_id: highest content id exported, or after_id if none were (int)
+
+    Raises:
+        TypeError: variety is not a known format
+        ImportError: variety needs pyarrow, which is not installed
+    """
+    if variety.lower() not in SUFFIXES:
+        raise TypeError("Please choose an appropriate export format")
+    directory = Path(directory)
+    stamp = stamp or datetime.now().strftime("%Y%m%dT%H%M%S")
+    name = f"records-{stamp}{SUFFIXES[variety.lower()]}"
+    written = []
+    writer = current = None
+    exported = 0
+    last_id = after_id
+    try:
+        for rows in insert.export_rows(after_id, pdcity, partition, chunk):
+            groups = groupby(rows, partition_key) if partition else [(None, rows)]
+            for key, group in groups:
+                if writer is None or key != current:
+                    if writer is not None:
+                        writer.close()
+                    folder = directory
+                    if partition:
+                        folder = directory / f"pdcity={key[0]}" / f"month={key[1]}"
+                    folder.mkdir(parents=True, exist_ok=True)
+                    path = folder / name
+                    if path in written:
+                        # Two partitions with the same directory name
+                        path = folder / f"{len(written)}-{name}"
+                    written.append(path)
+                    writer = get_writer(variety, _temp_path(path), chunk)
+                    current = key
+                writer.write(list(group))
+            exported += len(rows)
+            last_id = max(last_id, max(row[0] for row in rows))
+            logger.debug("Exported %d records", exported)
+        if writer is not None:
+            writer.close()
+            writer = None
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        for path in written:
+            _temp_path(path).unlink(missing_ok=True)
+        raise
+    for path in written:
+        os.replace(_temp_path(path), path)
+    return exported, last_id
+
+
+def main(argv=None):
+    """Export the database given by config.toml
+
+    Args:
+        argv: command line arguments, defaulting to sys.argv (list)
+    """
+    parser = argparse.ArgumentParser(
+        description="Export arrest records from the database to CSV, Parquet, "
+        "or Arrow files"
+    )
+    parser.add_argument(
+        "--format", choices=sorted(SUFFIXES), help="format of the export files"
+    )
+    parser.add_argument("--output", help="directory to write the export files in")
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        default=None,
+        help="write a file per police department and month",
+    )
+    parser.add_argument(
+        "--since-last",
+        action="store_true",
+        help="only export records inserted since the last export to --output",
+    )
+    parser.add_argument(
+        "--pdcity", help="only export records from this police department"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, help="records read from the database at a time"
+    )
+    args = parser.parse_args(argv)
+
+    config = settings.SettingsObj("config.toml", need_login=False)
+    settings.configure_logging(config)
+    directory = Path(args.output or config.data_path / config.export_dir)
+    variety = args.format or config.export_format
+    partition = config.export_partition if args.partition is None else True
+    after_id = read_watermark(directory, args.pdcity) if args.since_last else 0
+    directory.mkdir(parents=True, exist_ok=True)
+    insert = inserter.get_inserter(
+        config.inserter_type, config=config.connconfig, search_index=False
+    )
+    try:
+        with insert:
+            start = time.perf_counter()
+            exported, last_id = export(
+                insert,
+                directory,
+                variety,
+                partition,
+                after_id,
+                args.pdcity,
+                args.chunk_size or config.export_chunk_size,
+            )
+            elapsed = time.perf_counter() - start
+    finally:
+        insert.close()
+    save_watermark(directory, last_id, args.pdcity)
+    logger.info("Exported %d records to %s in %.1fs", exported, directory, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""On-disk cache of responses from rep-am.com, revalidated with conditional
+requests"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import atomicfile
+from . import metrics
+
+
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class ResponseCache:
+    """Compressed on-disk cache of responses, keyed by url
+
+    Each url has a gzipped body file and a small json file holding its
+    validators (ETag and Last-Modified), both written with atomicfile.
+    Entries older than max_age are dropped, and the least recently
+    used entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, max_age=14 * 86400):
+        """Open (creating if needed) the cache directory
+
+        Args:
+            directory: folder to keep cached responses in (str or Path)
+            max_bytes: most bytes of compressed bodies to keep (int)
+            max_age: seconds an entry may go without being revalidated (int)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.directory / f"{key}.json", self.directory / f"{key}.gz"
+
+    def load(self, url):
+        """Get the cached validators and body for url
+
+        Returns:
+            (meta, body): dictionary of the url, status, and kept headers,
+                and the uncompressed body (bytes), or None if url is not
+                cached or its entry has expired
+        """
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            if time.time() - meta["stored"] > self.max_age:
+                self._remove(url)
+                return None
+            with gzip.open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return meta, body
+
+    def _meta(self, url, response):
+        """Get the entry of a response's validators, or None if it has none
+        to revalidate with"""
+        headers = {
+            name: response.headers[name]
+            for name in KEPT_HEADERS
+            if name in response.headers
+        }
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return None
+        return {"url": url, "stored": time.time(), "headers": headers}
+
+    def store(self, url, response):
+        """Cache a response, if it carries a validator to revalidate with"""
+        if (meta := self._meta(url, response)) is None:
+            return
+        meta_path, body_path = self._paths(url)
+        atomicfile.replace(body_path, gzip.compress(response.content), sync=False)
+        atomicfile.replace(meta_path, json.dumps(meta), sync=False)
+
+    def entry(self, url, response):
+        """Start caching a streamed response, whose body is written to the
+        cache as it is read, rather than read whole to store it
+
+        Returns:
+            entry: the CacheEntry to write the body to, or None if the
+                response carries no validator to revalidate with
+        """
+        if (meta := self._meta(url, response)) is None:
+            return None
+        return CacheEntry(meta, *self._paths(url))
+
+    def touch(self, url):
+        """Mark the entry for url as revalidated just now"""
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            meta["stored"] = time.time()
+            atomicfile.replace(meta_path, json.dumps(meta), sync=False)
+            os.utime(body_path)
+        except (OSError, ValueError):
+            pass
+
+    def _remove(self, url):
+        for path in self._paths(url):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over max_bytes
+
+        Returns:
+            count: number of entries removed (int)
+        """
+        now = time.time()
+        entries = []
+        for body_path in self.directory.glob("*.gz"):
+            try:
+                stat = body_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, body_path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, body_path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                continue
+            for path in (body_path, body_path.with_suffix(".json")):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+class CacheEntry:
+    """Body of a streamed response, cached as it is read
+
+    Chunks are compressed into a temporary file as they are written. commit
+    moves it into place, along with the validators; discard drops it, so a
+    page read only in part is never cached. Nothing is written until the
+    first chunk is.
+    """
+
+    def __init__(self, meta, meta_path, body_path):
+        self.meta = meta
+        self.meta_path = meta_path
+        self.body_path = body_path
+        self.temp_path = None
+        self.file = None
+
+    def write(self, chunk):
+        if self.file is None:
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.body_path.parent,
+                prefix=f"{self.body_path.name}.",
+                suffix=".tmp",
+            )
+            os.close(fd)
+            self.temp_path = Path(temp_path)
+            self.file = gzip.open(self.temp_path, "wb")
+        self.file.write(chunk)
+
+    def commit(self):
+        if self.file is None:
+            self.write(b"")
+        self.file.close()
+        self.file = None
+        os.replace(self.temp_path, self.body_path)
+        atomicfile.replace(self.meta_path, json.dumps(self.meta), sync=False)
+
+    def discard(self):
+        """Drop the body written so far; does nothing once committed"""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.temp_path.unlink(missing_ok=True)
+
+
+def cached_response(url, meta, body):
+    """Build a requests.Response from a cached entry"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(meta.get("headers", {}))
+    response._content = body
+    # So iter_content gives the body, as for a response already read
+    response._content_consumed = True
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+class CachedFetcher:
+    """Wrapper around a session or FetchScheduler which revalidates cached
+    pages with conditional requests
+
+    Provides the same get method, so it can be passed anywhere a session is
+    expected for fetching. Any other attribute (e.g. map or concurrency) is
+    passed through to the wrapped session.
+    """
+
+    def __init__(self, session, cache):
+        self.session = session
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url, headers=None, **kwargs):
+        """GET url, answering from the cache if the page has not changed
+
+        With stream=True, the body of a 200 response is not read here, but
+        cached as it is read, through the CacheEntry set as the response's
+        cache_entry attribute (see scrape_police.StreamedBlotter).
+
+        Returns:
+            response: the requests.Response for url. Its from_cache
+                attribute is True when the body came from the cache after a
+                304 Not Modified. (Response)
+        """
+        headers = dict(headers or {})
+        cached = self.cache.load(url)
+        if cached:
+            meta, body = cached
+            if "ETag" in meta["headers"]:
+                headers["If-None-Match"] = meta["headers"]["ETag"]
+            if "Last-Modified" in meta["headers"]:
+                headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        response = self.session.get(url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached:
+            response.close()
+            metrics.count("cache_hits")
+            self.cache.touch(url)
+            return cached_response(url, meta, body)
+        if response.status_code == 200 and kwargs.get("stream"):
+            response.cache_entry = self.cache.entry(url, response)
+        elif response.status_code == 200:
+            self.cache.store(url, response)
+        response.from_cache = False
+        return response
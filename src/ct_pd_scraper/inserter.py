@@ -1,35 +1,118 @@
 """Module for inserting data into databases"""
 import sqlite3
-import ast
-import json
-import re
+import collections
+import logging
 
 from pathlib import Path
 from abc import abstractmethod
+from itertools import repeat
 
-from ct_pd_scraper import MySQLdbAdapter as mysqldb
-from ct_pd_scraper.cleaner import clean_date
+from ct_pd_scraper import exceptions
+from ct_pd_scraper import schema
+from ct_pd_scraper.cleaner import clean_date, record_fields, record_hash
 
 
-def get_date(file_name):
-    """Obsolete method of getting date from a well-formed file-name"""
-    pattern = r"[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}"
-    date = re.search(pattern, file_name).group()
-    return date
+logger = logging.getLogger(__name__)
 
+SQLITE_JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+SQLITE_SYNCHRONOUS = {"off", "normal", "full", "extra"}
 
-def extract_data(data_file):
-    """Obsolete method of getting data from file"""
-    if not Path(data_file).is_file():
-        raise IOError("File does not exist")
-    if data_file.endswith(".txt"):
-        text = data_file.read_text()
-        data = ast.literal_eval(text)
-    elif data_file.endswith(".json"):
-        data = json.loads(data_file.read_text())
-    else:
-        raise TypeError("Expected file of type .txt or .json")
-    return data
+SearchResult = collections.namedtuple(
+    "SearchResult",
+    ["id", "first_name", "last_name", "pdcity", "date", "content", "score"],
+)
+
+# Columns of each row export_rows yields, in order
+EXPORT_COLUMNS = [
+    "id",
+    "first_name",
+    "last_name",
+    "pdcity",
+    "date",
+    *schema.FIELDS,
+    "content",
+    "url",
+    "record_hash",
+]
+
+
+def split_name(full_name):
+    """Split a full name into first names and last name
+
+    Args:
+        full_name: name as written in the blotter, e.g. "JOHN A. SMITH" (str)
+
+    Returns:
+        (first_name, last_name): all but the last word, and the last word
+    """
+    names = full_name.split()
+    return " ".join(names[:-1]), names[-1]
+
+
+def name_key(first_name, last_name):
+    """Normalize a name into the key used to recognize repeat persons
+
+    Case, periods, and extra whitespace are ignored, so "John A. Smith" and
+    "JOHN A SMITH" share a key.
+
+    Args:
+        first_name, last_name: first and last name as inserted (str)
+
+    Returns:
+        key: normalized "FIRST NAMES|LAST" key (str)
+    """
+    first = " ".join(first_name.replace(".", " ").upper().split())
+    last = " ".join(last_name.replace(".", " ").upper().split())
+    return f"{first}|{last}"
+
+
+def search_date(date):
+    """Pad a date to search from or until (e.g. "2020-3-7" to "2020-03-07")
+
+    Raises:
+        ValueError: date is given but is not a YYYY-MM-DD date
+    """
+    if date is None:
+        return None
+    isodate = clean_date(str(date)) if str(date)[:1].isdigit() else None
+    if isodate is None:
+        raise ValueError(f"Not a YYYY-MM-DD date: {date}")
+    return isodate
+
+
+def arrest_fields(arrest):
+    """Get the structured fields of a cleaned arrest record, extracting them
+    from its content if the cleaner did not (e.g. BasicCleaner)
+
+    Returns:
+        fields: value of each column in schema.FIELDS (dict)
+    """
+    if all(field in arrest for field in schema.FIELDS):
+        return {field: arrest[field] for field in schema.FIELDS}
+    return record_fields(arrest["content"])
+
+
+class PersonCache:
+    """Bounded least-recently-used mapping of name keys to person ids"""
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.ids = collections.OrderedDict()
+
+    def get(self, key):
+        p_id = self.ids.get(key)
+        if p_id is not None:
+            self.ids.move_to_end(key)
+        return p_id
+
+    def put(self, key, p_id):
+        self.ids[key] = p_id
+        self.ids.move_to_end(key)
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+
+    def clear(self):
+        self.ids.clear()
 
 
 def get_inserter(variety, config, **kwargs):
@@ -42,6 +125,10 @@ def get_inserter(variety, config, **kwargs):
     any necessary keyword parameters for the MySQLdb connection. Options are
     listed in mysqlclient documentation at:
         (https://mysqlclient.readthedocs.io/user_guide.html)
+
+    For either, "dedupe_persons" (bool) turns on reuse of person rows for
+    repeat names, with up to "person_cache_size" (int) ids cached in memory,
+    and "search_index" (bool) keeps a full-text index over content for search.
     """
     if (cased := variety.lower()) == "sqlite":
         return SQLiteInserter(config, **kwargs)
@@ -57,7 +144,16 @@ class AbstractInserter:
     closing a connection and methods for inserting into a given database
     according to python's database interface.
 
-    To subclass: override __init__ and database_connect.
+    The connection is opened when the context is first entered. When the
+    outermost context exits, it is closed, unless self.keep_alive is set, in
+    which case it stays open for the next use until close is called.
+
+    The schema of the database is brought up to date (see the schema
+    module) the first time an inserter connects.
+
+    To subclass: override __init__ (calling self._init_options and setting
+    self.dialect), database_connect (calling self._prepare_database), and
+    _search_sql.
     """
 
     @abstractmethod
@@ -65,13 +161,45 @@ class AbstractInserter:
         self.config = config
         self.param_query_start = ""
         self.param_query_end = ""
+        self.max_person_id_sql = "SELECT COALESCE(MAX(id), 0) FROM person"
+        self.insert_ignore = "INSERT"
+        self.dialect = None
+        self._init_options(config, kwargs)
+
+    def _init_options(self, config, kwargs):
+        """Set up connection reuse and person de-duplication from config,
+        removing their keys from kwargs so they are not mistaken for
+        connection arguments."""
+        self.conn = None
+        self.depth = 0
+        self.schema_version = None
+        self.keep_alive = bool(kwargs.pop("keep_alive", config.get("keep_alive", True)))
+        self.dedupe_persons = bool(
+            kwargs.pop("dedupe_persons", config.get("dedupe_persons", False))
+        )
+        cache_size = kwargs.pop(
+            "person_cache_size", config.get("person_cache_size", 4096)
+        )
+        self.person_cache = PersonCache(int(cache_size))
+        self.search_index = bool(
+            kwargs.pop("search_index", config.get("search_index", True))
+        )
 
     def __enter__(self):
-        self.database_connect()
+        if self.conn is None:
+            self.database_connect()
+        self.depth += 1
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.database_close()
+        self.depth -= 1
+        if self.depth == 0 and not self.keep_alive:
+            self.database_close()
+
+    def close(self):
+        """Close the connection, even if it is being kept alive"""
+        if self.conn is not None:
+            self.database_close()
 
     @abstractmethod
     def database_connect(self):
@@ -79,6 +207,170 @@ class AbstractInserter:
 
     def database_close(self):
         self.conn.close()
+        self.conn = None
+
+    def _prepare_database(self):
+        """Migrate the schema on first connecting, then set up the name keys
+        and search index as configured"""
+        if self.schema_version is None:
+            self.schema_version = schema.migrate(self.conn, self.dialect)
+        if self.dedupe_persons:
+            self._ensure_name_key()
+        if self.search_index:
+            self._ensure_search_index()
+
+    def _ensure_name_key(self):
+        """Prepare the person table for de-duplication
+
+        Fills in keys for persons inserted without one (the name_key column
+        and its unique index are added by the schema migrations). Where
+        several persons already share a name, only the first gets the key,
+        and later arrests of that name reuse it.
+        """
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute("SELECT name_key FROM person WHERE name_key IS NOT NULL")
+            taken = {row[0] for row in cur.fetchall()}
+            cur.execute(
+                "SELECT id, first_name, last_name FROM person "
+                "WHERE name_key IS NULL ORDER BY id"
+            )
+            keys = []
+            for p_id, first_name, last_name in cur.fetchall():
+                key = name_key(first_name or "", last_name or "")
+                if key not in taken:
+                    taken.add(key)
+                    keys.append({"id": p_id, "name_key": key})
+            start, end = self.param_query_start, self.param_query_end
+            cur.executemany(
+                f"UPDATE person SET name_key = {start}name_key{end} "
+                f"WHERE id = {start}id{end}",
+                keys,
+            )
+
+    def _ensure_search_index(self):
+        """Add the full-text index over content if it is missing
+
+        Once added, the index is kept up to date by the database as records
+        are inserted, however they are inserted.
+        """
+        with self.conn:
+            cur = self.conn.cursor()
+            if not schema.has_search_index(cur, self.dialect):
+                logger.info("Building the search index over existing records...")
+                schema.add_search_index(cur, self.dialect)
+
+    @abstractmethod
+    def _search_sql(self, filters, raw, newest):
+        """Build the full-text query, with filters added to its WHERE, ordered
+        by score, or by newest record first if newest is set"""
+
+    def _search_query(self, query, raw):
+        """Convert a search into the database's full-text query syntax"""
+        return query
+
+    def search(
+        self,
+        query,
+        pdcity=None,
+        since=None,
+        until=None,
+        page=1,
+        per_page=20,
+        raw=False,
+        newest=False,
+    ):
+        """Search the content of arrest records, best matches first
+
+        Args:
+            query: words to search for. Records containing all of them rank
+                highest. (str)
+            pdcity: only search records from this police department (str)
+            since, until: only search records dated within this range,
+                inclusive, as ISO dates, e.g. "2020-03-27" (str)
+            page: page of results to return, starting at 1 (int)
+            per_page: results per page (int)
+            raw: pass query to the database's full-text search as is, so its
+                operators (e.g. FTS5's OR, NEAR, and prefix*) can be used
+                (bool)
+            newest: order results newest first, rather than by score. Ranking
+                must score every match, so for very common words this is
+                much faster. (bool)
+
+        Returns:
+            results: list of SearchResult tuples of content id, first_name,
+                last_name, pdcity, date, content, and score, where a higher
+                score is a better match (list)
+
+        Raises:
+            ct_pd_scraper.exceptions.SearchUnavailableError: the inserter
+                keeps no search index, as search_index is off or SQLite was
+                built without FTS5
+            ValueError: since or until is not a YYYY-MM-DD date
+        """
+        if not self.conn:
+            raise Exception("Connect to a database")
+        if not self.search_index:
+            raise exceptions.SearchUnavailableError(
+                "Full-text search unavailable: there is no search index "
+                "(search_index is off, or SQLite was built without FTS5)"
+            )
+        start, end = self.param_query_start, self.param_query_end
+        filters = []
+        if pdcity is not None:
+            filters.append(f"content.pdcity = {start}pdcity{end}")
+        if since is not None:
+            filters.append(f"content.date >= {start}since{end}")
+        if until is not None:
+            filters.append(f"content.date <= {start}until{end}")
+        values = {
+            "query": self._search_query(query, raw),
+            "pdcity": pdcity,
+            "since": search_date(since),
+            "until": search_date(until),
+            "limit": int(per_page),
+            "offset": (max(1, int(page)) - 1) * int(per_page),
+        }
+        cur = self.conn.cursor()
+        cur.execute(self._search_sql(filters, raw, newest), values)
+        return [SearchResult(*row) for row in cur.fetchall()]
+
+    def _resolve_name(self, cur, key, first_name, last_name):
+        """Get the id of the person with name_key key, inserting if needed"""
+        start, end = self.param_query_start, self.param_query_end
+        cur.execute(
+            f"""
+            {self.insert_ignore} INTO person (first_name, last_name, name_key)
+            VALUES ({start}first_name{end}, {start}last_name{end},
+            {start}name_key{end})
+            """,
+            {"first_name": first_name, "last_name": last_name, "name_key": key},
+        )
+        if cur.rowcount == 1:
+            return cur.lastrowid
+        cur.execute(
+            f"SELECT id FROM person WHERE name_key = {start}name_key{end}",
+            {"name_key": key},
+        )
+        return cur.fetchone()[0]
+
+    def _select_person_ids(self, cur, keys):
+        """Look up the ids of existing persons by name_key, in chunks
+
+        Returns:
+            found: dictionary of name_key to person id, for keys that exist
+        """
+        start, end = self.param_query_start, self.param_query_end
+        found = {}
+        for index in range(0, len(keys), 500):
+            chunk = keys[index : index + 500]
+            marks = ", ".join(f"{start}k{n}{end}" for n in range(len(chunk)))
+            cur.execute(
+                f"SELECT name_key, id FROM person WHERE name_key IN ({marks})",
+                {f"k{n}": key for n, key in enumerate(chunk)},
+            )
+            found.update(cur.fetchall())
+        return found
 
     def _insert_name(self, first_name, last_name):
         """Insert given first_ and last_ name into database.
@@ -95,21 +387,38 @@ class AbstractInserter:
 
         Returns:
             None
-            Prints values (first_name, last_name) to stdout
+            Logs values (first_name, last_name) at debug level
             Sets self.p_id to the row id of the inserted name, for use in
-            _insert_content
+            _insert_content. With self.dedupe_persons, this is the id of the
+            existing person of the same name, if there is one.
         """
         cur = self.conn.cursor()
+        if self.dedupe_persons:
+            key = name_key(first_name, last_name)
+            p_id = self.person_cache.get(key)
+            if p_id is None:
+                p_id = self._resolve_name(cur, key, first_name, last_name)
+                self.person_cache.put(key, p_id)
+            self.p_id = p_id
+            return
         sql = """
         INSERT INTO person (first_name, last_name)
         VALUES ({0}first_name{1}, {0}last_name{1})
         """
         values = {"first_name": first_name, "last_name": last_name}
-        print(values)
+        logger.debug("Inserting person %s", values)
         cur.execute(sql.format(self.param_query_start, self.param_query_end), values)
         self.p_id = cur.lastrowid
 
-    def _insert_content(self, content, pdcity="Unknown", date="Unknown"):
+    def _insert_content(
+        self,
+        content,
+        pdcity="Unknown",
+        date="Unknown",
+        fields=None,
+        url=None,
+        record_hash=None,
+    ):
         """Insert content of blotters into database
 
         Insert content, pdcity, and date into self.database using
@@ -122,26 +431,31 @@ class AbstractInserter:
             content: content of blotter to be inserted (str)
             pdcity: police department which made the arrests (str)
             date: date police blotter was posted (ISO date formatted str)
+            fields: structured fields of the record, as from
+                arrest_fields (dict)
+            url: url of the blotter the record is from (str)
+            record_hash: hash identifying the record, as from
+                cleaner.record_hash. A record whose hash is already in the
+                database is not inserted. (str)
 
         Returns:
             None
-            Prints values (self.p_id, content, date, pdcity) to stdout
+            Logs values (self.p_id, content, date, pdcity) at debug level
         """
         cur = self.conn.cursor()
-        sql = """
-        INSERT INTO content (person_id, content, date, pdcity)
-        VALUES ({0}person_id{1}, {0}content{1}, {0}date{1}, {0}pdcity{1})
-        """
         values = {
             "person_id": self.p_id,
             "content": content,
             "date": date,
             "pdcity": pdcity,
+            "url": url,
+            "record_hash": record_hash,
+            **(fields or record_fields(content)),
         }
-        print(values)
-        cur.execute(sql.format(self.param_query_start, self.param_query_end), values)
+        logger.debug("Inserting content %s", values)
+        cur.execute(self._content_sql(), values)
 
-    def insert(self, data, date=None, pdcity=None):
+    def insert(self, data, date=None, pdcity=None, url=None):
         """Governer for inserting values into database
 
         Master method for final cleaning of data and inserting into database.
@@ -149,6 +463,9 @@ class AbstractInserter:
         Ensures that data and pdcity were passed, either as arguments or
         as keys in data, and if not, populates them with default values. Cleans
         the date from the expected natural language format before inserting.
+        Records already in the database (by their record hash, see
+        cleaner.record_hash) are skipped, so inserting a blotter again is
+        harmless.
 
         Args:
             data: dictionary containing dictionaries as values for arbitrary
@@ -159,28 +476,331 @@ class AbstractInserter:
                 "March 27, 2020". Day should be cardinal (27), not ordinal
                 (27th).
             pdcity: Name of city where arrests happened
+            url: url of the blotter, recorded with each record
 
         Returns:
             None
-            _insert_name and _insert_content print values to stdout
+            _insert_name and _insert_content log values at debug level
         """
         if not self.conn:
             raise Exception("Connect to a database")
         if not date:
-            date = data.get("date", "0000-00-00")
+            date = data.get("date")
             data.pop("date", None)
         date = clean_date(date)
         if not pdcity:
             pdcity = data.get("pd_city", "Unknown")
             data.pop("pd_city", None)
-        with self.conn:
-            for _, arrest in data.items():
-                full_name = arrest["name"].split()
-                first_name = " ".join(full_name[:-1])
-                last_name = full_name[-1]
-                content = arrest["content"]
-                self._insert_name(first_name, last_name)
-                self._insert_content(content, pdcity, date)
+        try:
+            with self.conn:
+                cur = self.conn.cursor()
+                arrests = {}
+                for _, arrest in data.items():
+                    first_name, last_name = split_name(arrest["name"])
+                    content = arrest["content"]
+                    digest = record_hash(
+                        url, f"{first_name} {last_name}", content, date
+                    )
+                    arrests.setdefault(digest, (first_name, last_name, arrest))
+                existing = self._existing_hashes(cur, list(arrests))
+                for digest, (first_name, last_name, arrest) in arrests.items():
+                    if digest in existing:
+                        logger.debug("Skipping record already inserted %s", digest)
+                        continue
+                    self._insert_name(first_name, last_name)
+                    self._insert_content(
+                        arrest["content"],
+                        pdcity,
+                        date,
+                        arrest_fields(arrest),
+                        url,
+                        digest,
+                    )
+        except Exception:
+            # Cached ids may belong to persons that were just rolled back
+            self.person_cache.clear()
+            raise
+
+    def _content_sql(self):
+        """Get the statement inserting a record into content, taking every
+        column as a named parameter, and ignoring records whose record_hash
+        is already in the database"""
+        start, end = self.param_query_start, self.param_query_end
+        columns = [
+            "person_id",
+            "content",
+            "date",
+            "pdcity",
+            "url",
+            "record_hash",
+            *schema.FIELDS,
+        ]
+        params = ", ".join(f"{start}{column}{end}" for column in columns)
+        return self.insert_content_sql.format(columns=", ".join(columns), params=params)
+
+    def _existing_hashes(self, cur, hashes):
+        """Find which of hashes are of records already in the database
+
+        Returns:
+            found: record hashes in the database (set)
+        """
+        start, end = self.param_query_start, self.param_query_end
+        found = set()
+        for first in range(0, len(hashes), 500):
+            chunk = hashes[first : first + 500]
+            params = ", ".join(f"{start}h{i}{end}" for i in range(len(chunk)))
+            cur.execute(
+                f"SELECT record_hash FROM content WHERE record_hash IN ({params})",
+                {f"h{i}": digest for i, digest in enumerate(chunk)},
+            )
+            found.update(row[0] for row in cur.fetchall())
+        return found
+
+    def inserted_urls(self, urls):
+        """Find which of urls have records in the database
+
+        Records carry the url of their blotter and are committed in the same
+        transaction, so this tells whether a blotter's insert was committed
+        (blotters without arrests insert nothing, so are never found).
+
+        Args:
+            urls: urls of blotters (iterable)
+
+        Returns:
+            found: urls with at least one record (set)
+        """
+        if not self.conn:
+            raise Exception("Connect to a database")
+        urls = list(urls)
+        found = set()
+        start, end = self.param_query_start, self.param_query_end
+        cur = self.conn.cursor()
+        for first in range(0, len(urls), 500):
+            chunk = urls[first : first + 500]
+            params = ", ".join(f"{start}u{i}{end}" for i in range(len(chunk)))
+            cur.execute(
+                f"SELECT DISTINCT url FROM content WHERE url IN ({params})",
+                {f"u{i}": url for i, url in enumerate(chunk)},
+            )
+            found.update(row[0] for row in cur.fetchall())
+        return found
+
+    def _stream_cursor(self):
+        """Get a cursor which reads rows from the database as they are
+        fetched, rather than all at once when the query is executed"""
+        return self.conn.cursor()
+
+    def export_rows(self, after_id=0, pdcity=None, partitioned=False, chunk=5000):
+        """Read every record (joined with its person) in chunks
+
+        Rows are streamed from the database, so at most chunk rows are held
+        in memory at a time, however many records there are.
+
+        Args:
+            after_id: only read records with a content id above this, e.g.
+                the last id of a previous export (int)
+            pdcity: only read records from this police department (str)
+            partitioned: order by police department, then date, so the rows
+                of each department and month come together, rather than by
+                id (bool)
+            chunk: rows fetched at a time (int)
+
+        Yields:
+            rows: list of up to chunk tuples of the values of EXPORT_COLUMNS
+                (list)
+        """
+        if not self.conn:
+            raise Exception("Connect to a database")
+        start, end = self.param_query_start, self.param_query_end
+        where = f"content.id > {start}after_id{end}"
+        if pdcity is not None:
+            where += f" AND content.pdcity = {start}pdcity{end}"
+        order = "content.id"
+        if partitioned:
+            order = "content.pdcity, content.date, content.id"
+        columns = ", ".join(
+            f"person.{column}"
+            if column in ("first_name", "last_name")
+            else f"content.{column}"
+            for column in EXPORT_COLUMNS
+        )
+        cur = self._stream_cursor()
+        try:
+            cur.execute(
+                f"SELECT {columns} FROM content "
+                "LEFT JOIN person ON person.id = content.person_id "
+                f"WHERE {where} ORDER BY {order}",
+                {"after_id": int(after_id), "pdcity": pdcity},
+            )
+            while rows := cur.fetchmany(chunk):
+                yield rows
+        finally:
+            cur.close()
+
+    def _begin_batch(self, cur):
+        """Start the transaction for insert_many. Override if a database needs
+        an explicit lock before person ids are reserved."""
+
+    def _reserve_person_ids(self, cur, count):
+        """Reserve count consecutive person ids, returning the first one
+
+        Must be called inside the batch transaction, after _begin_batch, so
+        that no other writer can take the same ids before they are inserted.
+        """
+        cur.execute(self.max_person_id_sql)
+        return cur.fetchone()[0] + 1
+
+    def _assign_person_ids(self, cur, names):
+        """Give every name in a batch a person id
+
+        Without de-duplication, every name gets a newly reserved id. With it,
+        names are looked up in the cache, then in bulk in the database, and
+        only names not found get newly reserved ids.
+
+        Args:
+            cur: cursor inside the batch transaction
+            names: list of (first_name, last_name) tuples (list)
+
+        Returns:
+            (ids, persons): list of person ids, one per name, and list of
+                value dictionaries for the persons to be inserted
+        """
+        if not self.dedupe_persons:
+            first_id = self._reserve_person_ids(cur, len(names))
+            ids = list(range(first_id, first_id + len(names)))
+            persons = [
+                {"id": p_id, "first_name": first_name, "last_name": last_name}
+                for p_id, (first_name, last_name) in zip(ids, names)
+            ]
+            return ids, persons
+        keys = [name_key(first_name, last_name) for first_name, last_name in names]
+        named = dict(zip(keys, names))
+        found = {}
+        missing = []
+        for key in named:
+            p_id = self.person_cache.get(key)
+            if p_id is None:
+                missing.append(key)
+            else:
+                found[key] = p_id
+        found.update(self._select_person_ids(cur, missing))
+        new = [key for key in missing if key not in found]
+        persons = []
+        if new:
+            first_id = self._reserve_person_ids(cur, len(new))
+            for p_id, key in enumerate(new, first_id):
+                first_name, last_name = named[key]
+                found[key] = p_id
+                persons.append(
+                    {
+                        "id": p_id,
+                        "first_name": first_name,
+                        "last_name": last_name,
+                        "name_key": key,
+                    }
+                )
+        for key in missing:
+            self.person_cache.put(key, found[key])
+        return [found[key] for key in keys], persons
+
+    def insert_many(self, blotters, urls=None):
+        """Insert many cleaned blotters in a single transaction
+
+        Bulk counterpart of insert: person ids are resolved or reserved for
+        the whole batch up front, so persons and contents can each be written
+        with one executemany, and the batch is committed once. Nothing is
+        logged per row. As with insert, records already in the database are
+        skipped, so retrying a batch, or reprocessing blotters, inserts
+        nothing twice.
+
+        Args:
+            blotters: iterable of (data, date, pdcity) tuples, each as would
+                be passed to insert (iterable)
+            urls: url of each blotter, in the same order, to record with its
+                records (iterable)
+
+        Returns:
+            count: number of arrest records inserted, not counting those
+                skipped as already inserted (int)
+        """
+        if not self.conn:
+            raise Exception("Connect to a database")
+        records = {}
+        for (data, date, pdcity), url in zip(blotters, urls or repeat(None)):
+            if not data:
+                continue
+            date = clean_date(date)
+            pdcity = pdcity or "Unknown"
+            for arrest in data.values():
+                first_name, last_name = split_name(arrest["name"])
+                digest = record_hash(
+                    url, f"{first_name} {last_name}", arrest["content"], date
+                )
+                records.setdefault(
+                    digest,
+                    (
+                        (first_name, last_name),
+                        {
+                            "content": arrest["content"],
+                            "date": date,
+                            "pdcity": pdcity,
+                            "url": url,
+                            "record_hash": digest,
+                            **arrest_fields(arrest),
+                        },
+                    ),
+                )
+        if not records:
+            return 0
+        start, end = self.param_query_start, self.param_query_end
+        if self.dedupe_persons:
+            person_sql = f"""
+            INSERT INTO person (id, first_name, last_name, name_key)
+            VALUES ({start}id{end}, {start}first_name{end}, {start}last_name{end},
+            {start}name_key{end})
+            """
+        else:
+            person_sql = f"""
+            INSERT INTO person (id, first_name, last_name)
+            VALUES ({start}id{end}, {start}first_name{end}, {start}last_name{end})
+            """
+        try:
+            with self.conn:
+                cur = self.conn.cursor()
+                self._begin_batch(cur)
+                existing = self._existing_hashes(cur, list(records))
+                new = [pair for key, pair in records.items() if key not in existing]
+                if not new:
+                    return 0
+                names = [name for name, _ in new]
+                ids, persons = self._assign_person_ids(cur, names)
+                contents = [
+                    {"person_id": p_id, **row} for p_id, (_, row) in zip(ids, new)
+                ]
+                cur.executemany(person_sql, persons)
+                cur.executemany(self._content_sql(), contents)
+                inserted = cur.rowcount
+                if 0 <= inserted < len(contents):
+                    # Another writer inserted some of the records meanwhile
+                    self._delete_unused_persons(cur, persons)
+                else:
+                    inserted = len(contents)
+        except Exception:
+            # Cached ids may belong to persons that were just rolled back
+            self.person_cache.clear()
+            raise
+        return inserted
+
+    def _delete_unused_persons(self, cur, persons):
+        """Delete any of the persons just inserted which no record refers
+        to, as their records were ignored as duplicates"""
+        start, end = self.param_query_start, self.param_query_end
+        cur.executemany(
+            f"DELETE FROM person WHERE id = {start}id{end} AND NOT EXISTS "
+            f"(SELECT 1 FROM content WHERE content.person_id = {start}id{end})",
+            [{"id": person["id"]} for person in persons],
+        )
+        self.person_cache.clear()
 
 
 class SQLiteInserter(AbstractInserter):
@@ -202,31 +822,122 @@ class SQLiteInserter(AbstractInserter):
                         SQLite database. (dict)
                             Keys:
                             "database": database filename (str or Path)
+                            "journal_mode": journal mode, e.g. "wal" (str)
+                            "synchronous": synchronous setting, e.g.
+                                "normal" (str)
+                            "cache_size": page cache size, in pages if
+                                positive or KiB if negative (int)
+                            "cached_statements": number of prepared
+                                statements kept for reuse (int)
+                            "busy_timeout": seconds to wait for a lock held
+                                by another connection (float)
             **kwargs: provided to override config. Provide any keyname to use
                 **kwargs value instead
         """
+        self._init_options(config, kwargs)
         self.data_path = kwargs.get("data_path", config.get("data_path"))
         self.config = config.get("sqlite", {}).copy()  # Avoid contaminating config
         self.config.update(kwargs)
         self.database = self.config.get("database")
+        self.journal_mode = self.config.get("journal_mode")
+        self.synchronous = self.config.get("synchronous")
+        self.cache_size = self.config.get("cache_size")
+        self.cached_statements = int(self.config.get("cached_statements", 128))
+        self.busy_timeout = float(self.config.get("busy_timeout", 5.0))
         self.param_query_start = ":"
         self.param_query_end = ""
+        self.max_person_id_sql = "SELECT COALESCE(MAX(id), 0) FROM person"
+        self.insert_ignore = "INSERT OR IGNORE"
+        self.insert_content_sql = (
+            "INSERT OR IGNORE INTO content ({columns}) VALUES ({params})"
+        )
+        self.dialect = "sqlite"
+
+    def _begin_batch(self, cur):
+        """Take the database write lock before person ids are reserved"""
+        cur.execute("BEGIN IMMEDIATE")
+
+    def _search_sql(self, filters, raw, newest):
+        where = "".join(f" AND {condition}" for condition in filters)
+        # FTS5 walks its index in rowid order, so newest first stops early
+        order = "content_fts.rowid DESC" if newest else "score DESC, content.id DESC"
+        return f"""
+        SELECT content.id, person.first_name, person.last_name, content.pdcity,
+        content.date, content.content, -bm25(content_fts) AS score
+        FROM content_fts
+        JOIN content ON content.id = content_fts.rowid
+        LEFT JOIN person ON person.id = content.person_id
+        WHERE content_fts MATCH :query{where}
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset
+        """
+
+    def _search_query(self, query, raw):
+        """Quote every word, so punctuation (e.g. "St.") is not read as FTS5
+        syntax, unless raw is set"""
+        if raw:
+            return query
+        return " ".join(f'"{word}"' for word in query.replace('"', '""').split())
+
+    def _apply_profile(self):
+        """Apply the configured journal, synchronous, and cache settings
+
+        Raises:
+            ValueError: a setting has a value SQLite does not accept
+        """
+        pragmas = []
+        if self.journal_mode:
+            journal_mode = str(self.journal_mode).lower()
+            if journal_mode not in SQLITE_JOURNAL_MODES:
+                raise ValueError(f"Unknown SQLite journal_mode: {self.journal_mode}")
+            pragmas.append(f"PRAGMA journal_mode = {journal_mode}")
+        if self.synchronous:
+            synchronous = str(self.synchronous).lower()
+            if synchronous not in SQLITE_SYNCHRONOUS:
+                raise ValueError(f"Unknown SQLite synchronous: {self.synchronous}")
+            pragmas.append(f"PRAGMA synchronous = {synchronous}")
+        if self.cache_size is not None:
+            pragmas.append(f"PRAGMA cache_size = {int(self.cache_size)}")
+        for pragma in pragmas:
+            self.conn.execute(pragma)
 
     def database_connect(self):
-        """Connects to database given by configuration. Errors if file DNE
+        """Connects to database given by configuration, creating it if needed
+
+        Foreign keys are enforced, and the schema is brought up to date.
 
         Raises:
-            IOError: The database given does not exist
+            IOError: The folder for the database does not exist
+            sqlite3.Error: The database could not be opened
         """
         database_path = Path(self.data_path) / Path(self.database)
-        if Path(database_path).is_file():
-            try:
-                conn = sqlite3.connect(database_path)
-                self.conn = conn
-            except sqlite3.Error as e:
-                print(e)
-        else:
-            raise IOError("Database not found")
+        if not database_path.parent.is_dir():
+            raise IOError(f"Database folder not found: {database_path.parent}")
+        if not database_path.is_file():
+            logger.info("Database not found, creating %s", database_path)
+        try:
+            conn = sqlite3.connect(
+                database_path,
+                timeout=self.busy_timeout,
+                cached_statements=self.cached_statements,
+            )
+            self.conn = conn
+            self._apply_profile()
+            conn.execute("PRAGMA foreign_keys = ON")
+        except sqlite3.Error as e:
+            logger.error("Connecting to %s failed: %s", database_path, e)
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            raise
+        try:
+            self._prepare_database()
+        except sqlite3.OperationalError as e:
+            if not self.search_index or "fts5" not in str(e):
+                raise
+            # This build of SQLite was compiled without FTS5
+            logger.warning("Search index not available: %s", e)
+            self.search_index = False
 
 
 class MySQLInserter(AbstractInserter):
@@ -250,15 +961,66 @@ class MySQLInserter(AbstractInserter):
                         "unix_socket", "conv", "compress", "connect_timeout",
                         "named_pipe", "init_command", "read_default_group",
                         "cursorclass", "use_unicode", "charset", "sql_mode",
-                        "ssl"
+                        "ssl",
+                        "pool_size": idle connections kept for reuse (int)
             **kwargs: Override any key-value in config["mysql"]
         """
+        # Imported here, so SQLite users need not have MySQLdb installed
+        from ct_pd_scraper import MySQLdbAdapter as mysqldb
+
+        self._init_options(config, kwargs)
         self.config = config.get(
             "mysql", {}
         ).copy()  # Don't contaminate original config
         self.config.update(kwargs)
+        self.pool = mysqldb.ConnectionPool(
+            int(self.config.pop("pool_size", 2)), **self.config
+        )
         self.param_query_start = "%("
         self.param_query_end = ")s"
+        self.max_person_id_sql = "SELECT COALESCE(MAX(id), 0) FROM person FOR UPDATE"
+        self.insert_ignore = "INSERT IGNORE"
+        # Unlike INSERT IGNORE, this ignores only duplicates, not bad values
+        self.insert_content_sql = (
+            "INSERT INTO content ({columns}) VALUES ({params}) "
+            "ON DUPLICATE KEY UPDATE id = id"
+        )
+        self.dialect = "mysql"
+
+    def _search_sql(self, filters, raw, newest):
+        """Search in natural language mode, or in boolean mode if raw is
+        set, so its operators (e.g. +word, -word, and prefix*) can be used"""
+        where = "".join(f" AND {condition}" for condition in filters)
+        mode = "BOOLEAN" if raw else "NATURAL LANGUAGE"
+        match = f"MATCH (content.content) AGAINST (%(query)s IN {mode} MODE)"
+        order = "content.id DESC" if newest else "score DESC, content.id DESC"
+        return f"""
+        SELECT content.id, person.first_name, person.last_name, content.pdcity,
+        content.date, content.content, {match} AS score
+        FROM content
+        LEFT JOIN person ON person.id = content.person_id
+        WHERE {match}{where}
+        ORDER BY {order}
+        LIMIT %(limit)s OFFSET %(offset)s
+        """
+
+    def _stream_cursor(self):
+        """Get a server-side cursor, so rows are sent as they are fetched
+        rather than all buffered in the client when the query is executed"""
+        from MySQLdb.cursors import SSCursor
+
+        return self.conn.cursor(SSCursor)
 
     def database_connect(self):
-        self.conn = mysqldb.connect(**self.config)
+        self.conn = self.pool.get()
+        self._prepare_database()
+
+    def database_close(self):
+        """Return the connection to the pool for the next use"""
+        self.pool.put(self.conn)
+        self.conn = None
+
+    def close(self):
+        """Close the connection and every pooled connection"""
+        super().close()
+        self.pool.close()
@@ -0,0 +1,166 @@
+"""Stores of previously scraped links for ct_pd_scraper"""
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from ct_pd_scraper import atomicfile
+from ct_pd_scraper.settings import get_prev_links
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_link_store(variety, path, legacy_file=None):
+    """Factory method for returning a store of previously scraped links
+
+    Args:
+        variety: "sqlite" for an indexed SQLite table, or "json" for the
+            original json list (str)
+        path: path to the SQLite database holding the links. Unused for the
+            json store (str or Path)
+        legacy_file: path to the json link file. The json store reads and
+            writes it; the SQLite store imports it once (str or Path)
+
+    Returns:
+        The link store specified
+    """
+    if (cased := variety.lower()) == "sqlite":
+        return SQLiteLinkStore(path, legacy_file)
+    if cased == "json":
+        return JSONLinkStore(legacy_file)
+    raise TypeError("Please choose an appropriate link store type")
+
+
+class SQLiteLinkStore:
+    """Store of previously scraped links in an indexed SQLite table
+
+    Membership checks are primary key lookups, and links are committed as
+    they are added, so a crash loses at most the links being added at the
+    time.
+    """
+
+    def __init__(self, path, legacy_file=None):
+        """Open (creating if needed) the link database
+
+        Args:
+            path: path to the SQLite database file (str or Path)
+            legacy_file: json link file to import, if it has not been
+                imported already (str or Path)
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode = wal")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_link "
+                "(url TEXT PRIMARY KEY, added TEXT) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS store_meta "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+        if legacy_file is not None:
+            self.import_json(legacy_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM seen_link WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen_link").fetchone()[0]
+
+    def add(self, url):
+        """Record a single link as scraped"""
+        self.add_many([url])
+
+    def add_many(self, urls):
+        """Record links as scraped, in a single transaction"""
+        added = datetime.now().isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_link (url, added) VALUES (?, ?)",
+                ((url, added) for url in urls),
+            )
+
+    def import_json(self, legacy_file):
+        """Import links from a json link file, once
+
+        The import is recorded in the database, so later runs skip the file
+        even though it is left in place.
+
+        Returns:
+            count: number of links imported (int)
+        """
+        key = f"imported:{Path(legacy_file).resolve()}"
+        with self.lock:
+            done = self.conn.execute(
+                "SELECT 1 FROM store_meta WHERE key = ?", (key,)
+            ).fetchone()
+        if done or not Path(legacy_file).is_file():
+            return 0
+        links = get_prev_links(legacy_file)
+        self.add_many(links)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES (?, ?)",
+                (key, str(len(links))),
+            )
+        logger.info("Imported %d links from %s", len(links), legacy_file)
+        return len(links)
+
+    def close(self):
+        self.conn.close()
+
+
+class JSONLinkStore:
+    """Store of previously scraped links in the original json list file
+
+    Links are held in a set for membership checks. The file is rewritten
+    (see atomicfile) whenever links are added.
+    """
+
+    def __init__(self, link_file):
+        self.link_file = Path(link_file)
+        self.links = get_prev_links(self.link_file)
+        self.seen = set(self.links)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __contains__(self, url):
+        return url in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, url):
+        """Record a single link as scraped"""
+        self.add_many([url])
+
+    def add_many(self, urls):
+        """Record links as scraped, then save the file"""
+        for url in urls:
+            if url not in self.seen:
+                self.seen.add(url)
+                self.links.append(url)
+        atomicfile.replace(self.link_file, json.dumps(self.links))
+
+    def close(self):
+        pass
@@ -0,0 +1,218 @@
+"""Run metrics for ct_pd_scraper
+
+Stages of a run (logging in, getting links, fetching, parsing, cleaning, and
+inserting) are timed into latency histograms, and counters are kept of
+records, bytes, and errors. At the end of a run the metrics can be written as
+a JSON run report, and in the Prometheus text format (e.g. for the node
+exporter's textfile collector).
+
+Instrumented code records into the module's REGISTRY through the module
+level timer, count, and observe functions.
+"""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import atomicfile
+
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+PROMETHEUS_PREFIX = "ct_pd_scraper_"
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, as Prometheus keeps them"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket, narrowed
+        to the smallest and largest values observed
+
+        Args:
+            q: quantile to estimate, between 0 and 1 (float)
+
+        Returns:
+            value: estimated value of the quantile, or None if nothing has
+                been observed (float)
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for bound, count in zip(self.bounds, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = max(bound, self.min)
+        return self.max
+
+    def cumulative(self):
+        """Get (upper bound, observations at or under it) for every bucket"""
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """Thread safe registry of counters and latency histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded, starting a new run"""
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def count(self, name, amount=1):
+        """Add amount to the counter name"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        """Record a latency for the stage name"""
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Time the enclosed block as one call of the stage name
+
+        Calls which raise are timed as well, and counted in the counter
+        {name}_errors.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(f"{name}_errors")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def report(self):
+        """Summarize the run
+
+        Returns:
+            report: start and finish times, duration, every counter, and for
+                every stage its calls, errors, total, mean, p50, p95, and max
+                seconds (dict)
+        """
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+            started = self.started
+        stages = {}
+        for name, histogram in sorted(histograms.items()):
+            stages[name] = {
+                "calls": histogram.count,
+                "errors": counters.get(f"{name}_errors", 0),
+                "seconds": round(histogram.sum, 6),
+                "mean": round(histogram.sum / histogram.count, 6),
+                "p50": round(histogram.quantile(0.5), 6),
+                "p95": round(histogram.quantile(0.95), 6),
+                "max": round(histogram.max, 6),
+            }
+        return {
+            "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            "finished": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "duration_seconds": round(now - started, 3),
+            "counters": dict(sorted(counters.items())),
+            "stages": stages,
+        }
+
+    def prometheus(self):
+        """Render every metric in the Prometheus text exposition format
+
+        Returns:
+            text: counters as {prefix}{name}_total, stage latencies as
+                {prefix}{name}_seconds histograms, and the run's duration
+                (str)
+        """
+        now = time.time()
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {total}')
+                lines.append(f"{metric}_sum {histogram.sum:.6f}")
+                lines.append(f"{metric}_count {histogram.count}")
+            metric = f"{PROMETHEUS_PREFIX}run_duration_seconds"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {now - self.started:.3f}")
+            metric = f"{PROMETHEUS_PREFIX}run_finished_timestamp_seconds"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {now:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_file=None, prometheus_file=None):
+        """Write the run report and Prometheus metrics (with atomicfile, so a
+        collector never reads half a file), if given paths
+
+        Args:
+            report_file: path to write the JSON run report to (str or Path)
+            prometheus_file: path to write the Prometheus metrics to (str or
+                Path)
+        """
+        if report_file:
+            atomicfile.replace(report_file, json.dumps(self.report(), indent=2) + "\n")
+        if prometheus_file:
+            atomicfile.replace(prometheus_file, self.prometheus())
+
+
+REGISTRY = Metrics()
+count = REGISTRY.count
+observe = REGISTRY.observe
+timer = REGISTRY.timer
@@ -0,0 +1,313 @@
+"""Streaming fetch, clean, and insert pipeline for ct_pd_scraper
+
+The run is split into three stages connected by bounded queues, so the
+network, the parser, and the database are busy at the same time, and no more
+than a few pages are held in memory however many links are pending:
+
+    fetcher (thread) -> parser/cleaner (thread) -> writer (calling thread)
+
+Every link passes through every stage as a (link, payload, error) item. Once
+a stage fails on a link, later stages pass the error along, so the writer
+sees every link exactly once.
+
+With the "stream" parser, pages are fetched with stream=True and read by the
+parser/cleaner a chunk at a time (see scrape_police.StreamedBlotter), records
+going to the cleaner as they are parsed, and on to the writer in parts of
+PART_RECORDS records, so not even a whole page's records are held. A link is
+only recorded as scraped once its last part is committed; if it fails part
+way, the records already inserted are skipped when it is retried, as records
+are keyed on their content (see cleaner.record_hash).
+"""
+import logging
+import queue
+import threading
+import time
+
+from tqdm import tqdm
+
+from .scrape_police import StreamedBlotter, fetch, read_blotter
+from . import cleaner
+from . import exceptions
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+DONE = object()
+
+# Records of a streamed page sent to the writer at a time
+PART_RECORDS = 200
+
+
+def _put(items, item, stop):
+    """Put item on a bounded queue, giving up if the run is stopped"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _fetch_stage(links, fetcher, headers, fetched, stop, halt, stream=False):
+    """Fetch every link concurrently, queueing the responses
+
+    Fetching stops early once halt is set (e.g. the login has lapsed); links
+    not yet fetched are not reported.
+    """
+    try:
+        fetches = fetcher.map(lambda link: fetch(link, fetcher, headers, stream), links)
+        for link, future in fetches:
+            if stop.is_set() or halt.is_set():
+                if future.exception() is None:
+                    # Free its concurrency slot for the fetches still running
+                    future.result().close()
+                return
+            try:
+                _put(fetched, (link, future.result(), None), stop)
+            except (exceptions.LoginError, exceptions.SiteDownError):
+                # Every later page would be fetched logged out, or not at all
+                raise
+            except Exception as e:
+                _put(fetched, (link, None, e), stop)
+    except Exception as e:
+        # The fetcher itself failed; links not yet fetched are not reported
+        _put(fetched, (None, None, e), stop)
+    finally:
+        _put(fetched, DONE, stop)
+
+
+def _clean_stage(fetched, cleaned, stop, halt, archive, parser, article, cleaner_type):
+    """Parse, archive, and clean fetched pages, queueing the records
+
+    A page found to be served logged out sets halt, and pages fetched after
+    it are dropped unread, as every later page would be logged out too.
+    """
+    while not stop.is_set():
+        try:
+            item = fetched.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if item is DONE:
+            break
+        link, info, error = item
+        if halt.is_set():
+            if info is not None:
+                info.close()
+            continue
+        if error is None:
+            try:
+                clean = cleaner.get_cleaner(cleaner_type)
+                if parser == "stream":
+                    blot = StreamedBlotter(link, info, archive, article)
+                    incidents = _stream_parts(link, blot, clean, cleaned, stop)
+                    date, pdcity = blot.date, blot.pdcity
+                else:
+                    blot, date, pdcity = read_blotter(
+                        link, info, archive, parser, article
+                    )
+                    with metrics.timer("clean"):
+                        incidents = clean.clean_incidents(blot)
+                metrics.count("records_cleaned", len(incidents))
+                item = (link, (incidents, date, pdcity, True), None)
+            except exceptions.LoginError as e:
+                halt.set()
+                item = (link, None, e)
+            except Exception as e:
+                item = (link, None, e)
+        _put(cleaned, item, stop)
+    if stop.is_set():
+        _close_fetched(fetched)
+    _put(cleaned, DONE, stop)
+
+
+def _close_fetched(fetched):
+    """Close the responses left on the fetched queue when the run is stopped,
+    freeing the concurrency slots streamed responses hold"""
+    while True:
+        try:
+            item = fetched.get_nowait()
+        except queue.Empty:
+            return
+        if item is not DONE and item[1] is not None:
+            item[1].close()
+
+
+def _stream_parts(link, blot, clean, cleaned, stop):
+    """Parse and clean a StreamedBlotter a record at a time, queueing every
+    full part of its records for the writer
+
+    Records are held until the blotter is ready (its date and police
+    department, which key the records, have been read, and it has been found
+    logged in), which on rep-am.com is before the first record.
+
+    Returns:
+        incidents: the last, partial, part of the records (dict)
+    """
+    part = {}
+    elapsed = 0
+    started = time.perf_counter()
+    for record in clean.clean_records(blot):
+        part[len(part)] = record
+        if len(part) >= PART_RECORDS and blot.ready:
+            elapsed += time.perf_counter() - started
+            metrics.count("records_cleaned", len(part))
+            _put(cleaned, (link, (part, blot.date, blot.pdcity, False), None), stop)
+            part = {}
+            started = time.perf_counter()
+    # Timed as one call, without the waits for the writer to take each part
+    metrics.observe("parse", elapsed + time.perf_counter() - started)
+    return part
+
+
+def run_pipeline(links, fetcher, insert, prev_links, config, archive=None):
+    """Scrape, clean, and insert the blotters at links as a streaming pipeline
+
+    Fetching and cleaning run in background threads; the calling thread
+    writes to the database, committing a batch once it holds
+    config.batch_size blotters or config.flush_seconds have passed since its
+    first blotter arrived. Links are added to prev_links once their batch is
+    committed.
+
+    Args:
+        links: urls of blotters to scrape (list)
+        fetcher: FetchScheduler (or CachedFetcher) to fetch through
+        insert: inserter to insert records with (AbstractInserter)
+        prev_links: store of previously scraped links (SQLiteLinkStore or
+            JSONLinkStore)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+        archive: archive to add fetched pages to (BlotterArchive)
+
+    Returns:
+        failed_scrapes: list of (link, exception) pairs for links which
+            failed (list)
+    """
+    fetched = queue.Queue(maxsize=config.queue_size)
+    cleaned = queue.Queue(maxsize=config.queue_size)
+    stop = threading.Event()
+    halt = threading.Event()
+    stages = [
+        threading.Thread(
+            target=_fetch_stage,
+            args=(
+                links,
+                fetcher,
+                config.session_headers,
+                fetched,
+                stop,
+                halt,
+                config.parser == "stream",
+            ),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_clean_stage,
+            args=(
+                fetched,
+                cleaned,
+                stop,
+                halt,
+                archive,
+                config.parser,
+                config.article_selector,
+                config.cleaner_type,
+            ),
+            daemon=True,
+        ),
+    ]
+    for stage in stages:
+        stage.start()
+
+    failed_scrapes = []
+    # Links of streamed pages with a part which failed to insert
+    failed_links = set()
+    batch = []
+    batch_started = None
+    progress = tqdm(total=len(links), ascii=True)
+    try:
+        with insert:
+            while True:
+                timeout = None
+                if batch:
+                    timeout = max(0, batch_started + config.flush_seconds - time.time())
+                try:
+                    item = cleaned.get(timeout=timeout)
+                except queue.Empty:
+                    _write_batch(
+                        insert, batch, prev_links, failed_scrapes, failed_links
+                    )
+                    continue
+                if item is DONE:
+                    break
+                link, record, error = item
+                if error is not None or record[-1]:
+                    progress.update()
+                if link in failed_links:
+                    # A part of it already failed to insert
+                    continue
+                if error is not None:
+                    logger.error(
+                        "Scraping link %s failed, due to: %s",
+                        link,
+                        error,
+                        exc_info=error,
+                    )
+                    metrics.count("blotters_failed")
+                    failed_scrapes.append((link, error))
+                    continue
+                if not batch:
+                    batch_started = time.time()
+                batch.append((link, *record))
+                if len(batch) >= config.batch_size:
+                    _write_batch(
+                        insert, batch, prev_links, failed_scrapes, failed_links
+                    )
+            _write_batch(insert, batch, prev_links, failed_scrapes, failed_links)
+    finally:
+        stop.set()
+        progress.close()
+        for stage in stages:
+            stage.join()
+    return failed_scrapes
+
+
+def _write_batch(insert, batch, prev_links, failed_scrapes, failed_links):
+    """Insert a batch of cleaned blotters (or parts of streamed ones) in one
+    transaction
+
+    Links in the batch are added to the prev_links store only once the batch
+    holding their last part is committed. If the insert fails, every link in
+    the batch is marked as failed instead, and added to failed_links so any
+    later parts are dropped. The batch is emptied either way.
+
+    Args:
+        insert: a connected inserter (AbstractInserter)
+        batch: list of (link, clean_record, date, pdcity, last) tuples, last
+            being whether it is the blotter's last part (list)
+        prev_links: store of previously scraped links (SQLiteLinkStore or
+            JSONLinkStore)
+        failed_scrapes: list of (link, exception) pairs (list)
+        failed_links: links which failed part way (set)
+    """
+    if not batch:
+        return
+    finished = [link for link, *_, last in batch if last]
+    try:
+        with metrics.timer("insert"):
+            count = insert.insert_many(
+                [(record, date, pdcity) for _, record, date, pdcity, _ in batch],
+                [link for link, *_ in batch],
+            )
+    except Exception as e:
+        links = list(dict.fromkeys(link for link, *_ in batch))
+        logger.error("Inserting %d blotters failed, due to: %s", len(links), e)
+        metrics.count("blotters_failed", len(links))
+        failed_scrapes.extend((link, e) for link in links)
+        failed_links.update(links)
+    else:
+        logger.debug("Inserted %d records from %d blotters", count, len(finished))
+        metrics.count("records_inserted", count)
+        metrics.count("blotters_inserted", len(finished))
+        prev_links.add_many(finished)
+    batch.clear()
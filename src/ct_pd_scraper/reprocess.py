@@ -0,0 +1,293 @@
+"""Offline reprocessing of archived blotters
+
+Streams every page in the blotter archive through the parser, cleaner, and
+inserter again, without going online. Useful after improving cleaning, to
+rebuild the database from the raw pages. Parsing and cleaning can be spread
+over several processes, with a single writer inserting their results in
+archive order.
+"""
+import argparse
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from tqdm import tqdm
+
+from .archive import BlotterArchive
+from .scrape_police import parse_blotter
+from . import cleaner
+from . import inserter
+from . import settings
+from . import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+def clean_chunk(chunk, parser="html.parser", article=None, cleaner_type="basic"):
+    """Parse and clean a chunk of archived pages
+
+    Runs in a worker process when reprocessing in parallel, so it takes and
+    returns only what must cross between processes: the raw pages in, and
+    the cleaned records (much smaller than the pages) out.
+
+    Args:
+        chunk: list of (url, html) pairs (list)
+        parser, article: parser and article selector for parse_blotter
+        cleaner_type: variety of cleaner to clean with (str)
+
+    Returns:
+        results: list of (url, (incidents, date, pdcity), error) tuples, in
+            the order of chunk, where error is None or the reason the page
+            failed (str)
+    """
+    results = []
+    for url, html in chunk:
+        try:
+            incidents, date, pdcity = parse_blotter(html, parser, article)
+            clean = cleaner.get_cleaner(cleaner_type)
+            record = (clean.clean_incidents(incidents), date, pdcity)
+            results.append((url, record, None))
+        except Exception as e:
+            results.append((url, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def clean_blotters(blotters, workers=1, chunk_size=16, **options):
+    """Parse and clean archived blotters, in parallel if workers > 1
+
+    Blotters are sent to a pool of worker processes chunk_size at a time,
+    with at most two chunks per worker in flight, so pages are read from the
+    archive only as fast as they are cleaned. Results are yielded in the
+    order of blotters however the chunks finish.
+
+    Args:
+        blotters: iterable of ArchivedBlotter tuples (iterable)
+        workers: processes to parse and clean in; 1 cleans in this process
+            (int)
+        chunk_size: blotters sent to a worker at a time (int)
+        **options: parser, article, and cleaner_type, as for clean_chunk
+
+    Yields:
+        (url, (incidents, date, pdcity), error) tuples, as from clean_chunk
+    """
+    pages = ((blotter.url, blotter.html) for blotter in blotters)
+    chunks = iter(lambda: list(islice(pages, chunk_size)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from clean_chunk(chunk, **options)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(clean_chunk, chunk, **options))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def reprocess(
+    blotters,
+    insert,
+    cleaner_type="basic",
+    batch_size=50,
+    parser="html.parser",
+    article=None,
+    workers=1,
+    chunk_size=16,
+):
+    """Parse, clean, and insert archived blotters
+
+    Args:
+        blotters: iterable of ArchivedBlotter tuples, e.g. from
+            BlotterArchive.records (iterable)
+        insert: inserter to insert the records with (AbstractInserter)
+        cleaner_type: variety of cleaner to clean with (str)
+        batch_size: blotters inserted per transaction (int)
+        parser, article: parser and article selector for parse_blotter
+        workers, chunk_size: processes to parse and clean in, and blotters
+            sent to each at a time, as for clean_blotters (int)
+
+    Returns:
+        (count, failed): number of records inserted (int), and list of
+            (url, exception) pairs for blotters which could not be
+            reprocessed (list)
+    """
+    count = 0
+    failed = []
+    batch = []
+    urls = []
+    cleaned = clean_blotters(
+        blotters,
+        workers,
+        chunk_size,
+        parser=parser,
+        article=article,
+        cleaner_type=cleaner_type,
+    )
+    with insert:
+        for url, record, error in cleaned:
+            if error is None:
+                batch.append(record)
+                urls.append(url)
+            else:
+                logger.error("Reprocessing %s failed, due to: %s", url, error)
+                failed.append((url, error))
+            if len(batch) >= batch_size:
+                count += insert.insert_many(batch, urls)
+                batch.clear()
+                urls.clear()
+        count += insert.insert_many(batch, urls)
+    return count, failed
+
+
+def check_parser(blotters, parser, article=None, cleaner_type="basic"):
+    """Compare a parser's records against those of the original parser
+
+    Each blotter is parsed both with the given parser and article selector,
+    and with the original whole-page html.parser parse. The date, police
+    department, and cleaned records must be identical. Blotters which the
+    original parse fails on are skipped.
+
+    Args:
+        blotters: iterable of ArchivedBlotter tuples (iterable)
+        parser, article: parser and article selector for parse_blotter
+        cleaner_type: variety of cleaner to clean the records with (str)
+
+    Returns:
+        (checked, mismatches): number of blotters compared (int), and list
+            of (url, reason) pairs for blotters which differ (list)
+    """
+    checked = 0
+    mismatches = []
+    for blotter in blotters:
+        try:
+            incidents, date, pdcity = parse_blotter(blotter.html, strain=False)
+        except Exception:
+            continue
+        checked += 1
+        try:
+            fast_incidents, fast_date, fast_pdcity = parse_blotter(
+                blotter.html, parser, article
+            )
+        except Exception as e:
+            mismatches.append((blotter.url, f"failed: {e}"))
+            continue
+        expected = cleaner.get_cleaner(cleaner_type).clean_incidents(incidents)
+        actual = cleaner.get_cleaner(cleaner_type).clean_incidents(fast_incidents)
+        if (fast_date, fast_pdcity) != (date, pdcity):
+            mismatches.append((blotter.url, "date or police department differs"))
+        elif list(actual.values()) != list(expected.values()):
+            mismatches.append((blotter.url, "records differ"))
+    return checked, mismatches
+
+
+def main(argv=None):
+    """Reprocess the blotter archive given by config.toml
+
+    Args:
+        argv: command line arguments, defaulting to sys.argv (list)
+
+    Raises:
+        ct_pd_scraper.exceptions.ScraperException: some blotters could not be
+            reprocessed
+    """
+    parser = argparse.ArgumentParser(
+        description="Reprocess archived blotters into the database, offline"
+    )
+    parser.add_argument(
+        "--database",
+        help="database to insert into instead of the one in config.toml",
+    )
+    parser.add_argument(
+        "--pdcity", help="only reprocess blotters from this police department"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, help="blotters inserted per transaction"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes to parse and clean in; 0 for one per CPU core",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=16,
+        help="blotters sent to a process at a time",
+    )
+    parser.add_argument(
+        "--check-parser",
+        action="store_true",
+        help="insert nothing; compare the configured parser with the original",
+    )
+    args = parser.parse_args(argv)
+
+    config = settings.SettingsObj("config.toml", need_login=False)
+    settings.configure_logging(config)
+    if args.check_parser:
+        return main_check_parser(config, args.pdcity)
+    overrides = {"database": args.database} if args.database else {}
+    insert = inserter.get_inserter(
+        config.inserter_type, config=config.connconfig, **overrides
+    )
+    archive = BlotterArchive(
+        config.data_path / config.archive_dir, config.archive_segment_bytes
+    )
+    with archive:
+        logger.info("Reprocessing %d archived blotters...", len(archive))
+        blotters = tqdm(archive.records(pdcity=args.pdcity), ascii=True)
+        try:
+            count, failed = reprocess(
+                blotters,
+                insert,
+                cleaner_type=config.cleaner_type,
+                batch_size=args.batch_size or config.batch_size,
+                parser=config.parser,
+                article=config.article_selector,
+                workers=args.workers or os.cpu_count() or 1,
+                chunk_size=args.chunk_size,
+            )
+        finally:
+            insert.close()
+    logger.info("Inserted %d records", count)
+    if failed:
+        logger.error("Blotters failed: %d", len(failed))
+        for url, error in failed:
+            logger.error("%s due to %s,", url, error)
+        raise exceptions.ScraperException
+    logger.info("COMPLETE")
+
+
+def main_check_parser(config, pdcity=None):
+    """Run check_parser over the archive, reporting any mismatches
+
+    Raises:
+        ct_pd_scraper.exceptions.ScraperException: some blotters differ
+    """
+    archive = BlotterArchive(
+        config.data_path / config.archive_dir, config.archive_segment_bytes
+    )
+    with archive:
+        logger.info("Checking parser %s on %d blotters...", config.parser, len(archive))
+        checked, mismatches = check_parser(
+            tqdm(archive.records(pdcity=pdcity), ascii=True),
+            config.parser,
+            config.article_selector,
+            config.cleaner_type,
+        )
+    logger.info("Blotters checked: %d", checked)
+    if mismatches:
+        logger.error("Blotters differing: %d", len(mismatches))
+        for url, reason in mismatches:
+            logger.error("%s: %s", url, reason)
+        raise exceptions.ScraperException
+    logger.info("COMPLETE")
+
+
+if __name__ == "__main__":
+    main()
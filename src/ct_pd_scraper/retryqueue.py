@@ -0,0 +1,213 @@
+"""Persistent queue of links to retry for ct_pd_scraper
+
+A link whose scrape fails is not added to the store of previously scraped
+links, so without this queue it is only tried again if it is still on the
+listing pages a later run reads. The queue keeps every failed link with its
+attempts, the class and message of its last error, and when it may next be
+tried, backing off exponentially (with jitter, so links which failed
+together are not all retried together) from one attempt to the next. After
+max_attempts failures a link is parked: kept, but no longer retried.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryQueue:
+    """Queue of failed links in a SQLite table, with exponential backoff"""
+
+    def __init__(
+        self, path, base_delay=1800, max_delay=86400, max_attempts=6, jitter=0.5
+    ):
+        """Open (creating if needed) the queue's database
+
+        Args:
+            path: path to the SQLite database file (str or Path)
+            base_delay: seconds to wait before the first retry (float)
+            max_delay: most seconds to wait before any retry (float)
+            max_attempts: failures after which a link is parked (int)
+            jitter: fraction of each delay which is random, between 0 and 1
+                (float)
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.max_attempts = max(1, int(max_attempts))
+        self.jitter = min(1.0, max(0.0, float(jitter)))
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode = wal")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS retry_link (url TEXT PRIMARY KEY, "
+                "attempts INTEGER NOT NULL, error TEXT, message TEXT, "
+                "first_failed TEXT, last_failed TEXT, next_attempt REAL, "
+                "parked INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM retry_link WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM retry_link").fetchone()[0]
+
+    def delay(self, attempts):
+        """Get the seconds to wait before retrying a link which has failed
+        attempts times: base_delay doubled for each failure after the first,
+        up to max_delay, of which the jitter fraction is random"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def fail(self, url, error, now=None):
+        """Record a failed attempt at url, scheduling its next attempt or
+        parking it
+
+        Args:
+            url: the link which failed (str)
+            error: the exception it failed with (Exception)
+            now: Unix time of the failure, defaulting to now (float)
+
+        Returns:
+            parked: whether the link has now been parked (bool)
+        """
+        now = time.time() if now is None else now
+        failed = datetime.fromtimestamp(now).isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT attempts, first_failed FROM retry_link WHERE url = ?", (url,)
+            ).fetchone()
+            attempts, first_failed = row if row else (0, None)
+            attempts += 1
+            parked = attempts >= self.max_attempts
+            self.conn.execute(
+                "INSERT OR REPLACE INTO retry_link (url, attempts, error, message, "
+                "first_failed, last_failed, next_attempt, parked) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    attempts,
+                    type(error).__name__,
+                    str(error),
+                    first_failed or failed,
+                    failed,
+                    None if parked else now + self.delay(attempts),
+                    int(parked),
+                ),
+            )
+        return parked
+
+    def defer(self, urls, now=None):
+        """Queue links which were not attempted (e.g. as the run was cut
+        short), to be tried after about base_delay without counting an
+        attempt"""
+        now = time.time() if now is None else now
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO retry_link (url, attempts, next_attempt) "
+                "VALUES (?, 0, ?)",
+                ((url, now + self.delay(1)) for url in urls),
+            )
+
+    def remove(self, urls):
+        """Drop links from the queue, e.g. once they have been scraped"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM retry_link WHERE url = ?", ((url,) for url in urls)
+            )
+
+    def due(self, now=None):
+        """Get the links whose next attempt is due, longest waiting first
+
+        Returns:
+            urls: links to retry (list)
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT url FROM retry_link WHERE NOT parked AND next_attempt <= ? "
+                "ORDER BY next_attempt",
+                (now,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def parked(self):
+        """Get the parked links
+
+        Returns:
+            parked: list of (url, attempts, error, message, last_failed)
+                tuples (list)
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT url, attempts, error, message, last_failed FROM retry_link "
+                "WHERE parked ORDER BY last_failed"
+            ).fetchall()
+
+    def select(self, new_links, now=None):
+        """Choose the links to scrape in a run
+
+        Links new on the listing are scraped unless they are already queued
+        (so a failed link still on the listing waits out its backoff, and a
+        parked one is left alone), followed by the queued links now due.
+
+        Args:
+            new_links: links on the listing not scraped before (list)
+            now: Unix time of the run, defaulting to now (float)
+
+        Returns:
+            links: links to scrape, without duplicates (list)
+        """
+        due = self.due(now)
+        links = [link for link in new_links if link not in self]
+        return list(dict.fromkeys(links + due))
+
+    def settle(self, links, failed_scrapes, prev_links, now=None):
+        """Update the queue after scraping links
+
+        Links which failed are recorded as failed attempts, links which were
+        scraped (now in prev_links) are dropped, and links which were neither
+        (the run stopped before reaching them) are deferred.
+
+        Args:
+            links: links the run set out to scrape (list)
+            failed_scrapes: list of (link, exception) pairs (list)
+            prev_links: store of previously scraped links (container of str)
+            now: Unix time of the run, defaulting to now (float)
+
+        Returns:
+            parked: links parked by this run (list)
+        """
+        failed = {link: error for link, error in failed_scrapes if link is not None}
+        parked = [link for link, error in failed.items() if self.fail(link, error, now)]
+        for link in parked:
+            logger.warning(
+                "%s failed %d times and will not be retried", link, self.max_attempts
+            )
+        scraped = [link for link in links if link not in failed and link in prev_links]
+        self.remove(scraped)
+        self.defer(
+            (link for link in links if link not in failed and link not in prev_links),
+            now,
+        )
+        return parked
+
+    def close(self):
+        self.conn.close()
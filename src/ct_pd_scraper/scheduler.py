@@ -0,0 +1,313 @@
+"""Politeness scheduler for fetching pages from rep-am.com"""
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import requests
+
+from . import exceptions
+from . import metrics
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket with an adjustable refill rate"""
+
+    def __init__(self, rate, burst=1):
+        """Initialize a full bucket
+
+        Args:
+            rate: tokens added per second (float)
+            burst: maximum number of tokens held at once (int)
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def set_rate(self, rate):
+        """Change the refill rate, crediting tokens earned at the old rate"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        """Empty the bucket so that no token is available for seconds"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class HostLimiter:
+    """Adaptive rate limiter for a single host
+
+    The rate is cut multiplicatively when the host answers with 429 or 5xx
+    and raised additively after a streak of healthy responses, keeping it
+    between min_rate and max_rate.
+    """
+
+    def __init__(
+        self,
+        rate=0.5,
+        burst=1,
+        min_rate=0.032,
+        max_rate=2.0,
+        backoff=0.5,
+        increase=0.05,
+        recover_after=5,
+    ):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.backoff = float(backoff)
+        self.increase = float(increase)
+        self.recover_after = int(recover_after)
+        self.bucket = TokenBucket(self._bound(rate), burst)
+        self.healthy = 0
+        self.lock = threading.Lock()
+
+    def _bound(self, rate):
+        return min(self.max_rate, max(self.min_rate, float(rate)))
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self):
+        self.bucket.acquire()
+
+    def record(self, response):
+        """Adjust the rate based on a response (None for a transport error)"""
+        with self.lock:
+            if response is None or response.status_code in RETRY_STATUSES:
+                self.healthy = 0
+                self.bucket.set_rate(self._bound(self.rate * self.backoff))
+                retry_after = _retry_after(response)
+                if retry_after:
+                    self.bucket.pause(retry_after)
+                return
+            self.healthy += 1
+            if self.healthy >= self.recover_after:
+                self.healthy = 0
+                self.bucket.set_rate(self._bound(self.rate + self.increase))
+
+
+def _retry_after(response):
+    """Get the number of seconds asked for in a Retry-After header, if any"""
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def _hold_slot(response, slots):
+    """Release a slot of slots once response is closed, rather than now, so a
+    streamed response counts against the concurrency until its body has been
+    read (or, should it never be closed, once it is garbage collected)"""
+    close = response.close
+    lock = threading.Lock()
+    held = [True]
+
+    def release():
+        with lock:
+            if not held[0]:
+                return
+            held[0] = False
+        slots.release()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+
+    response.close = close_and_release
+    weakref.finalize(response, release)
+
+
+class CircuitBreaker:
+    """Stop sending requests to a site which is clearly down
+
+    After threshold failed requests in a row (transport errors, or 429 or
+    5xx responses), the circuit opens, and requests fail at once rather than
+    waiting on a site which will not answer. After reset seconds, one trial
+    request is let through: if it succeeds the circuit closes, and if it
+    fails the circuit stays open for another reset seconds.
+    """
+
+    def __init__(self, threshold=6, reset=300):
+        self.threshold = int(threshold)
+        self.reset = float(reset)
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        """Raise if the circuit is open, unless it is time for a trial
+
+        Raises:
+            ct_pd_scraper.exceptions.SiteDownError: the circuit is open
+        """
+        with self.lock:
+            if self.opened is None:
+                return
+            if time.monotonic() - self.opened < self.reset:
+                raise exceptions.SiteDownError(
+                    f"The site failed {self.failures} requests in a row"
+                )
+            # Let this request through as the trial, and hold back the rest
+            self.opened = time.monotonic()
+
+    def record(self, response):
+        """Count a response (None for a transport error) as a success or
+        failure"""
+        with self.lock:
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.failures = 0
+                self.opened = None
+                return
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                if self.opened is None:
+                    metrics.count("circuit_opened")
+                self.opened = time.monotonic()
+
+
+class FetchScheduler:
+    """Rate limited, concurrent wrapper around a requests.Session
+
+    Provides a get method compatible with requests.Session.get, so it can be
+    passed anywhere a session is expected for fetching (e.g. get_links and
+    scrape). Every request waits for a token from its host's bucket and for
+    one of the concurrency slots.
+    """
+
+    def __init__(
+        self,
+        session,
+        concurrency=2,
+        retries=2,
+        circuit_failures=6,
+        circuit_reset=300,
+        **limits,
+    ):
+        """Initialize the scheduler
+
+        Args:
+            session: a requests.Session, usually already logged in (Session)
+            concurrency: maximum number of requests in flight at once (int)
+            retries: extra attempts for a request answered with 429 or 5xx
+                (int)
+            circuit_failures: failed requests in a row after which no more
+                are sent (see CircuitBreaker), or 0 to keep sending (int)
+            circuit_reset: seconds before a request is tried again once the
+                circuit has opened (float)
+            **limits: keyword arguments for each HostLimiter (rate, burst,
+                min_rate, max_rate, backoff, increase, recover_after)
+        """
+        self.session = session
+        self.concurrency = max(1, int(concurrency))
+        self.retries = int(retries)
+        self.breaker = CircuitBreaker(circuit_failures, circuit_reset)
+        self.limits = limits
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+
+    def limiter(self, url):
+        """Get the HostLimiter for the host of url, creating it if needed"""
+        host = urlsplit(url).netloc
+        with self.hosts_lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(**self.limits)
+            return self.hosts[host]
+
+    def get(self, url, **kwargs):
+        """GET url through the session once the host's rate limit allows
+
+        Requests answered with 429 or 5xx are retried (the rate having been
+        lowered in the meantime) up to self.retries times. A response fetched
+        with stream=True holds its concurrency slot until it is closed, as its
+        body is still to be read, so close it once done with it.
+
+        Returns:
+            response: the requests.Response for url (Response)
+
+        Raises:
+            requests.HTTPError: the host kept answering with 429 or 5xx
+            requests.RequestException: the request failed in transport
+            ct_pd_scraper.exceptions.SiteDownError: the site has failed too
+                many requests in a row to send it more
+        """
+        limiter = self.limiter(url)
+        for attempt in range(self.retries + 1):
+            self.breaker.check()
+            limiter.acquire()
+            self.slots.acquire()
+            held = False
+            try:
+                response = self.session.get(url, **kwargs)
+                if kwargs.get("stream"):
+                    _hold_slot(response, self.slots)
+                    held = True
+            except requests.RequestException:
+                limiter.record(None)
+                self.breaker.record(None)
+                raise
+            finally:
+                if not held:
+                    self.slots.release()
+            limiter.record(response)
+            self.breaker.record(response)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            # Release the connection (and slot), which a streamed response holds
+            response.close()
+        response.raise_for_status()
+        return response
+
+    def map(self, func, items):
+        """Call func on every item concurrently
+
+        At most self.concurrency calls run at once, and no more are queued
+        than can run, so items may be a lazy iterable.
+
+        Yields:
+            (item, future): pairs in order of completion. future.result()
+                returns func(item) or raises its exception.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            running = {}
+            for item in items:
+                running[executor.submit(func, item)] = item
+                if len(running) >= self.concurrency:
+                    break
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield running.pop(future), future
+                    for item in items:
+                        running[executor.submit(func, item)] = item
+                        break
@@ -0,0 +1,393 @@
+"""Database schema and migrations for ct_pd_scraper
+
+The person and content tables, their indexes, and later additions to them
+are made by numbered migrations, for SQLite and MySQL alike. A database's
+schema_version table records the migrations applied to it, and any newer
+ones are applied, in order, when an inserter first connects. New databases
+are built from scratch, and databases made by hand from the README (or by
+older versions of the scraper) are brought up to date.
+"""
+import logging
+from datetime import datetime
+
+from .cleaner import clean_date, record_fields, record_hash
+
+
+logger = logging.getLogger(__name__)
+
+MARKS = {"sqlite": "?", "mysql": "%s"}
+
+TABLES = {
+    "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS person (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT, last_name TEXT)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS content (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, person_id INTEGER, pdcity TEXT,
+            content TEXT, date DATE,
+            FOREIGN KEY (person_id) REFERENCES person (id) ON DELETE CASCADE)
+        """,
+    ],
+    "mysql": [
+        """
+        CREATE TABLE IF NOT EXISTS person (
+            id bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+            first_name varchar(64) DEFAULT NULL, last_name varchar(64) DEFAULT NULL,
+            UNIQUE KEY id (id))
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS content (
+            id bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+            person_id bigint(20) unsigned DEFAULT NULL,
+            pdcity varchar(16) DEFAULT NULL, content text, date date DEFAULT NULL,
+            UNIQUE KEY id (id), KEY person_id (person_id),
+            CONSTRAINT content_ibfk_1 FOREIGN KEY (person_id)
+            REFERENCES person (id) ON DELETE CASCADE)
+        """,
+    ],
+}
+
+# (table, index name, indexed columns) of every secondary index
+INDEXES = [
+    ("content", "content_person_id", ("person_id",)),
+    ("content", "content_date", ("date",)),
+    ("content", "content_pdcity_date", ("pdcity", "date")),
+    ("person", "person_last_name", ("last_name",)),
+]
+
+NAME_KEY_TYPE = {"sqlite": "TEXT", "mysql": "varchar(160) DEFAULT NULL"}
+URL_TYPE = {"sqlite": "TEXT", "mysql": "varchar(255) DEFAULT NULL"}
+HASH_TYPE = {"sqlite": "TEXT", "mysql": "char(32) DEFAULT NULL"}
+
+# Structured fields of each record, as extracted by cleaner.record_fields
+FIELD_COLUMNS = {
+    "sqlite": [
+        ("age", "INTEGER"),
+        ("address", "TEXT"),
+        ("town", "TEXT"),
+        ("charges", "TEXT"),
+        ("court_date", "TEXT"),
+    ],
+    "mysql": [
+        ("age", "smallint unsigned DEFAULT NULL"),
+        ("address", "varchar(128) DEFAULT NULL"),
+        ("town", "varchar(64) DEFAULT NULL"),
+        ("charges", "text"),
+        ("court_date", "varchar(32) DEFAULT NULL"),
+    ],
+}
+FIELDS = [column for column, _ in FIELD_COLUMNS["sqlite"]]
+
+
+def columns(cur, dialect, table):
+    """Get the names of the columns of table (set)"""
+    if dialect == "sqlite":
+        cur.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in cur.fetchall()}
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def indexes(cur, dialect, table):
+    """Get the indexes of table
+
+    Returns:
+        indexes: tuple of indexed columns, in order, keyed by index name
+            (dict)
+    """
+    found = {}
+    if dialect == "sqlite":
+        cur.execute(f"PRAGMA index_list({table})")
+        for name in [row[1] for row in cur.fetchall()]:
+            cur.execute(f"PRAGMA index_info({name})")
+            found[name] = tuple(row[2] for row in sorted(cur.fetchall()))
+        return found
+    cur.execute(
+        "SELECT index_name, column_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s "
+        "ORDER BY index_name, seq_in_index",
+        (table,),
+    )
+    for name, column in cur.fetchall():
+        found[name] = found.get(name, ()) + (column,)
+    return found
+
+
+def _create_tables(cur, dialect):
+    for statement in TABLES[dialect]:
+        cur.execute(statement)
+
+
+def _add_indexes(cur, dialect):
+    """Index the columns records are joined and filtered on, unless an
+    existing index (e.g. MySQL's person_id key) already starts with them"""
+    for table, name, indexed in INDEXES:
+        existing = indexes(cur, dialect, table).values()
+        if any(index[: len(indexed)] == indexed for index in existing):
+            continue
+        cur.execute(f"CREATE INDEX {name} ON {table} ({', '.join(indexed)})")
+
+
+def _add_name_key(cur, dialect):
+    """Add the name_key column used to de-duplicate persons, with its unique
+    index"""
+    if "name_key" not in columns(cur, dialect, "person"):
+        cur.execute(f"ALTER TABLE person ADD COLUMN name_key {NAME_KEY_TYPE[dialect]}")
+    if "person_name_key" not in indexes(cur, dialect, "person"):
+        cur.execute("CREATE UNIQUE INDEX person_name_key ON person (name_key)")
+
+
+def _add_record_fields(cur, dialect):
+    """Add columns for the structured fields of each record"""
+    existing = columns(cur, dialect, "content")
+    for column, column_type in FIELD_COLUMNS[dialect]:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE content ADD COLUMN {column} {column_type}")
+
+
+def _backfill_record_fields(cur, dialect, chunk=1000):
+    """Extract the structured fields of records inserted before they were
+    stored, a chunk of records at a time"""
+    mark = MARKS[dialect]
+    update = ", ".join(f"{column} = {mark}" for column in FIELDS)
+    last_id = 0
+    filled = 0
+    while True:
+        cur.execute(
+            f"SELECT id, content FROM content WHERE id > {mark} "
+            f"ORDER BY id LIMIT {mark}",
+            (last_id, chunk),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        updates = []
+        for c_id, content in rows:
+            fields = record_fields(content or "")
+            updates.append([fields[column] for column in FIELDS] + [c_id])
+        cur.executemany(f"UPDATE content SET {update} WHERE id = {mark}", updates)
+        last_id = rows[-1][0]
+        filled += len(rows)
+    logger.info("Filled in the fields of %d existing records", filled)
+
+
+def _pad_dates(cur, dialect):
+    """Rewrite dates stored without zero padding ("2020-3-7") as padded ISO
+    dates, and the "0000-00-00" stored for unparseable dates as NULL, so
+    dates sort correctly and date ranges can be read from the index"""
+    if dialect == "mysql":
+        # DATE columns are already padded; only zero dates need clearing
+        cur.execute("UPDATE content SET date = NULL WHERE date = '0000-00-00'")
+        return
+    cur.execute("SELECT DISTINCT date FROM content WHERE date IS NOT NULL")
+    updates = []
+    for (stored,) in cur.fetchall():
+        padded = clean_date(str(stored))
+        if padded != stored:
+            updates.append((padded, stored))
+    cur.executemany("UPDATE content SET date = ? WHERE date = ?", updates)
+    logger.info("Rewrote %d distinct dates of existing records", len(updates))
+
+
+def _add_url(cur, dialect):
+    """Add the url of the blotter each record is from, indexed, so whether a
+    blotter's records were committed can be looked up"""
+    if "url" not in columns(cur, dialect, "content"):
+        cur.execute(f"ALTER TABLE content ADD COLUMN url {URL_TYPE[dialect]}")
+    if "content_url" not in indexes(cur, dialect, "content"):
+        cur.execute("CREATE INDEX content_url ON content (url)")
+
+
+def _add_record_hash(cur, dialect, chunk=1000):
+    """Add the record_hash identifying each record (see cleaner.record_hash),
+    filled in for existing records, and enforced by a unique index, so the
+    same record is never inserted twice
+
+    Existing records which duplicate an earlier one are left without a hash,
+    and so out of the index; they are counted in the log, to be deleted by
+    hand (they are the records with a NULL record_hash).
+    """
+    if "record_hash" not in columns(cur, dialect, "content"):
+        cur.execute(f"ALTER TABLE content ADD COLUMN record_hash {HASH_TYPE[dialect]}")
+    mark = MARKS[dialect]
+    cur.execute("SELECT record_hash FROM content WHERE record_hash IS NOT NULL")
+    seen = {row[0] for row in cur.fetchall()}
+    last_id = 0
+    duplicates = 0
+    while True:
+        cur.execute(
+            "SELECT content.id, content.url, person.first_name, person.last_name, "
+            "content.content, content.date FROM content "
+            "LEFT JOIN person ON person.id = content.person_id "
+            f"WHERE content.id > {mark} AND content.record_hash IS NULL "
+            f"ORDER BY content.id LIMIT {mark}",
+            (last_id, chunk),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        updates = []
+        for c_id, url, first_name, last_name, content, date in rows:
+            digest = record_hash(
+                url,
+                f"{first_name or ''} {last_name or ''}",
+                content or "",
+                None if date is None else str(date),
+            )
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            updates.append((digest, c_id))
+        cur.executemany(
+            f"UPDATE content SET record_hash = {mark} WHERE id = {mark}", updates
+        )
+        last_id = rows[-1][0]
+    if "content_record_hash" not in indexes(cur, dialect, "content"):
+        cur.execute("CREATE UNIQUE INDEX content_record_hash ON content (record_hash)")
+    if duplicates:
+        logger.warning(
+            "%d existing records duplicate earlier ones, and were left without "
+            "a record_hash",
+            duplicates,
+        )
+
+
+# (version, description, step) of every migration, in the order applied
+MIGRATIONS = [
+    (1, "create the person and content tables", _create_tables),
+    (2, "index content and person", _add_indexes),
+    (3, "add person.name_key", _add_name_key),
+    (4, "add the structured fields of each record", _add_record_fields),
+    (5, "fill in the fields of existing records", _backfill_record_fields),
+    (6, "zero-pad the dates of existing records", _pad_dates),
+    (7, "add the blotter url of each record", _add_url),
+    (8, "add the unique record hash of each record", _add_record_hash),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(cur):
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def migrate(conn, dialect):
+    """Bring the database up to the current schema version
+
+    Each migration is applied and recorded in its own transaction. For
+    SQLite, the transaction holds the write lock from the start, so when
+    several processes connect at once only one applies each migration. For
+    MySQL, where changes to tables cannot be rolled back, a named lock is
+    held for the whole migration instead.
+
+    Args:
+        conn: an open DB-API connection (Connection)
+        dialect: "sqlite" or "mysql" (str)
+
+    Returns:
+        version: schema version of the database (int)
+    """
+    mark = MARKS[dialect]
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version "
+        "(version INTEGER NOT NULL, description TEXT, applied TEXT)"
+    )
+    conn.commit()
+    if dialect == "mysql":
+        cur.execute("SELECT GET_LOCK('ct_pd_scraper_schema', 60)")
+    try:
+        for version, description, step in MIGRATIONS:
+            if dialect == "sqlite":
+                cur.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= _current_version(cur):
+                    conn.rollback()
+                    continue
+                logger.info(
+                    "Migrating the database to version %d: %s", version, description
+                )
+                step(cur, dialect)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description, applied) "
+                    f"VALUES ({mark}, {mark}, {mark})",
+                    (
+                        version,
+                        description,
+                        datetime.now().isoformat(timespec="seconds"),
+                    ),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return _current_version(cur)
+    finally:
+        if dialect == "mysql":
+            cur.execute("SELECT RELEASE_LOCK('ct_pd_scraper_schema')")
+
+
+def has_search_index(cur, dialect):
+    """Check whether the content table has its full-text index"""
+    if dialect == "sqlite":
+        cur.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'content_fts'"
+        )
+        return cur.fetchone()[0] > 0
+    cur.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema "
+        "= DATABASE() AND table_name = 'content' AND index_type = 'FULLTEXT'"
+    )
+    return cur.fetchone()[0] > 0
+
+
+def add_search_index(cur, dialect):
+    """Add the full-text index over content, indexing existing records
+
+    In SQLite, this is an FTS5 table over content, kept in step by triggers;
+    in MySQL, a FULLTEXT index. Either way, the database keeps the index up
+    to date however records are inserted.
+    """
+    if dialect == "mysql":
+        cur.execute("ALTER TABLE content ADD FULLTEXT INDEX content_search (content)")
+        return
+    cur.execute(
+        "CREATE VIRTUAL TABLE content_fts USING fts5(content, "
+        "content='content', content_rowid='id', tokenize='porter unicode61')"
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER content_fts_insert AFTER INSERT ON content BEGIN
+            INSERT INTO content_fts (rowid, content)
+            VALUES (new.id, new.content);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER content_fts_delete AFTER DELETE ON content BEGIN
+            INSERT INTO content_fts (content_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER content_fts_update AFTER UPDATE OF content ON content
+        BEGIN
+            INSERT INTO content_fts (content_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+            INSERT INTO content_fts (rowid, content)
+            VALUES (new.id, new.content);
+        END
+        """
+    )
+    cur.execute("INSERT INTO content_fts (content_fts) VALUES ('rebuild')")
@@ -1,38 +1,549 @@
 """Provide functions necessary for scraping rep-am.com"""
+import codecs
+import collections
+import logging
+import math
+import os
+import re
+import tempfile
+import zlib
+from html.parser import HTMLParser
+from http.cookiejar import LoadError, LWPCookieJar
+from urllib.parse import unquote
+
 import requests
 
-from bs4 import BeautifulSoup
+from . import atomicfile
+from . import exceptions
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Name, up to the site's hash, of the cookie WordPress sets once logged in
+LOGIN_COOKIE = "wordpress_logged_in"
 
 
 def login(url, session, headers=None, log_info=None):
     """Log into url using POST.
 
     Logs into a site on the web given by url, using provided login information
-    and headers through POST method. The session is maintained.
+    and headers through POST method. The session is maintained. WordPress
+    sets its logged in cookie only when the login succeeds, so the login is
+    checked for it rather than trusted.
+
+    Returns:
+        response: the response to the login (Response)
+
+    Raises:
+        ct_pd_scraper.exceptions.LoginError: the request failed, or the site
+            did not log the session in
     """
     if headers is None:
         headers = {}
     if log_info is None:
         log_info = {}
     try:
-        response = session.post(url, data=log_info, headers=headers)
+        with metrics.timer("login"):
+            response = session.post(url, data=log_info, headers=headers)
     except requests.RequestException as rex:
-        print(str(rex))
-    else:
-        return response
+        logger.error("Signing in failed: %s", rex)
+        raise exceptions.LoginError(f"Signing in failed: {rex}") from rex
+    if login_expiry(session.cookies) is None:
+        raise exceptions.LoginError(
+            f"Signing into {url} failed; check the login information in .env"
+        )
+    metrics.count("logins")
+    return response
 
 
-def scrape(url, session, headers=None):
-    """Scrape a given url for content
+def login_expiry(cookies):
+    """Get when the login held in cookies expires, without asking the site
 
-    Scrape a given url (preferably from rep-am.com) for date posted, police
-    department from whom the records are sourced, and any records.
+    WordPress's logged in cookie carries its own expiry, as its value is
+    "user|expiration|token|hmac". If the value is not of that form, the
+    cookie's own expiry is used instead.
+
+    Args:
+        cookies: cookies of a session (CookieJar)
+
+    Returns:
+        expiry: Unix time the login expires at, math.inf if it cannot be
+            told, or None if there is no logged in cookie (float)
     """
-    if headers is None:
-        headers = {}
-    info = session.get(url, headers=headers)
-    soup = BeautifulSoup(info.content, "html.parser")
-    incidents = [incident.text for incident in soup.findAll("p")]
+    expiry = None
+    for cookie in cookies:
+        if not cookie.name.startswith(LOGIN_COOKIE):
+            continue
+        fields = unquote(cookie.value or "").split("|")
+        if len(fields) == 4 and fields[1].isdigit():
+            expires = float(fields[1])
+        elif cookie.expires:
+            expires = float(cookie.expires)
+        else:
+            expires = math.inf
+        expiry = expires if expiry is None else max(expiry, expires)
+    return expiry
+
+
+def load_cookies(session, cookie_file):
+    """Add the cookies saved to cookie_file by save_cookies to session
+
+    Returns:
+        saved: Unix time the cookies were saved, or None if there are no
+            saved cookies (float)
+    """
+    jar = LWPCookieJar(str(cookie_file))
+    try:
+        jar.load(ignore_discard=True)
+        saved = os.path.getmtime(cookie_file)
+    except (OSError, LoadError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning("Reading the saved login failed: %s", e)
+        return None
+    session.cookies.update(jar)
+    return saved
+
+
+def save_cookies(session, cookie_file):
+    """Save the cookies of session to cookie_file, readable only by the user
+
+    Session cookies are saved as well, as WordPress's logged in cookie is one
+    unless "remember me" is ticked. The file is written with atomicfile.
+    """
+    jar = LWPCookieJar()
+    for cookie in session.cookies:
+        jar.set_cookie(cookie)
+    # As LWPCookieJar.save writes it, but never readable by other users
+    lines = "#LWP-Cookies-2.0\n" + jar.as_lwp_str(ignore_discard=True)
+    atomicfile.replace(cookie_file, lines, mode=0o600)
+
+
+def require_login(session, marker):
+    """Fail every page session fetches which was served to a logged out
+    visitor
+
+    A response hook checks each page for marker, text found only on pages
+    for logged in visitors (e.g. WordPress's "logged-in" body class), so a
+    login which has lapsed is noticed at the first page fetched with it.
+    Pages fetched with stream=True are not read by the hook, but given a
+    login_marker attribute for StreamedBlotter to check as they are read.
+
+    Raises (from session.get):
+        ct_pd_scraper.exceptions.LoginError: a page was served logged out
+    """
+
+    def check_logged_in(response, *args, stream=False, **kwargs):
+        if response.status_code != 200:
+            return
+        if stream:
+            response.login_marker = marker
+        elif marker.encode() not in response.content:
+            raise exceptions.LoginError(f"{response.url} was served logged out")
+
+    session.hooks["response"].append(check_logged_in)
+
+
+BLOTTER_TAGS = ["p", "time", "h1"]
+
+# Parsers which close unclosed tags themselves, so give the same paragraphs
+# when strained. BeautifulSoup closes them for html.parser, at the end tag of
+# any enclosing element, so straining out those elements changes the text.
+STRAINABLE_PARSERS = {"lxml"}
+
+
+def parse_blotter(content, parser="html.parser", article=None, strain=None):
+    """Parse a blotter page for content
+
+    Parse a blotter page (preferably from rep-am.com) for date posted,
+    police department from whom the records are sourced, and any records.
+
+    With the lxml parser, a SoupStrainer limits the tree to the tags needed
+    (<p>, <time>, <h1>, and the tag the article selector starts with, if it
+    starts with one), rather than the whole page. The "selectolax"
+    parser skips BeautifulSoup for selectolax's much faster lexbor parser, if
+    it is installed, and the "stream" parser for BlotterStreamParser (see
+    StreamedBlotter).
+
+    Args:
+        content: raw html of the page (bytes or str)
+        parser: "html.parser", "lxml", "html5lib", "selectolax", or
+            "stream" (str)
+        article: CSS selector for the article body (e.g. "article" or
+            "div.entry-content"). If given and found, only paragraphs inside
+            it are records; otherwise every paragraph is. (str)
+        strain: whether to parse only the needed tags, defaulting to only
+            with parsers in STRAINABLE_PARSERS. False parses the whole page,
+            as the original scraper did. (bool)
+
+    Returns:
+        (incidents, date, pdcity): text of every paragraph (list), date as
+            written on the page (str), and police department (str)
+    """
+    if parser == "selectolax":
+        return _parse_selectolax(content, article)
+    if parser == "stream":
+        return _parse_stream(content, article)
+    # Imported here, as runs with nothing new to scrape never parse a blotter
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    if strain is None:
+        strain = parser in STRAINABLE_PARSERS
+    parse_only = None
+    if strain and not article:
+        parse_only = SoupStrainer(BLOTTER_TAGS)
+    elif strain and (article_tag := _selector_tag(article)):
+        parse_only = SoupStrainer(BLOTTER_TAGS + [article_tag])
+    soup = BeautifulSoup(content, parser, parse_only=parse_only)
+    body = (soup.select_one(article) if article else None) or soup
+    incidents = [incident.text for incident in body.find_all("p")]
     date = soup.find("time").text
     pdcity = soup.find("h1").text.split()[0]
     return incidents, date, pdcity
+
+
+def _selector_tag(selector):
+    """Get the tag name a CSS selector starts with, if it names one"""
+    tag = re.split(r"[.#\[:]", selector.split()[0])[0]
+    return tag if tag and tag != "*" else None
+
+
+def _parse_selectolax(content, article=None):
+    """Parse a blotter page as parse_blotter does, with selectolax"""
+    try:
+        from selectolax.lexbor import LexborHTMLParser as HTMLParser
+    except ImportError:
+        try:
+            from selectolax.parser import HTMLParser
+        except ImportError:
+            raise ImportError(
+                'The "selectolax" parser requires selectolax to be installed'
+            ) from None
+    tree = HTMLParser(content)
+    body = (tree.css_first(article) if article else None) or tree
+    incidents = [incident.text() for incident in body.css("p")]
+    date = tree.css_first("time").text()
+    pdcity = tree.css_first("h1").text().split()[0]
+    return incidents, date, pdcity
+
+
+def _parse_stream(content, article=None):
+    """Parse a blotter page as parse_blotter does, with BlotterStreamParser"""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    blotter = BlotterStreamParser(article)
+    blotter.feed(content)
+    blotter.close()
+    if blotter.date is None or blotter.pdcity is None:
+        raise exceptions.ScraperException("The page has no date or police department")
+    return blotter.paragraphs(), blotter.date, blotter.pdcity
+
+
+# Elements which never have content, so are never closed
+VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+SIMPLE_SELECTOR = re.compile(r"^([\w-]*)(?:([.#])([\w-]+))?$")
+
+
+class BlotterStreamParser(HTMLParser):
+    """Incremental parser of blotter pages
+
+    Fed a page a piece at a time, it keeps only the elements still open and
+    the text of those it reads (<p>, and the first <time> and <h1>), so a
+    paragraph's text is ready to take from paragraphs() as soon as it closes,
+    and only one paragraph is held at a time (a paragraph inside another is
+    held until the outer one closes, so they are given in the order they
+    start). Unclosed elements are closed by the end of their parent, or of
+    the page, as BeautifulSoup's html.parser does, so the text read is the
+    same.
+
+    Only article selectors of a tag, class, or id (e.g. "article",
+    "div.entry-content", or "#content") can be matched as the page streams
+    by. Until the article is found, paragraphs before it are held back, and
+    given only if the page ends without it.
+    """
+
+    def __init__(self, article=None):
+        super().__init__(convert_charrefs=True)
+        self.article = None
+        if article:
+            if not (selector := SIMPLE_SELECTOR.match(article.strip())):
+                raise ValueError(
+                    "The stream parser cannot match the article selector "
+                    f"{article!r}; use a tag, class, or id, e.g. "
+                    '"div.entry-content"'
+                )
+            self.article = selector.groups()
+        self.article_state = "before"
+        # Open elements, as [tag, text pieces or None (for <p>, paired with
+        # its entry in started), whether the article]
+        self.stack = []
+        # Paragraphs in the order they started, as [text, destination] once
+        # they have closed ("ready", "held", or "dropped"), or [None, None]
+        # while they are open
+        self.started = collections.deque()
+        self.held = []
+        self.ready = []
+        self.date = None
+        self.heading = None
+
+    @property
+    def pdcity(self):
+        """The police department, the first word of the heading"""
+        words = (self.heading or "").split()
+        return words[0] if words else None
+
+    def _is_article(self, tag, attrs):
+        name, kind, value = self.article
+        if name and tag != name:
+            return False
+        if kind == "#":
+            return dict(attrs).get("id") == value
+        if kind == ".":
+            return value in (dict(attrs).get("class") or "").split()
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        text = None
+        if tag == "p" or (tag == "time" and self.date is None):
+            text = []
+        elif tag == "h1" and self.heading is None:
+            text = []
+        is_article = False
+        if self.article and self.article_state == "before":
+            if is_article := self._is_article(tag, attrs):
+                self.article_state = "inside"
+                self.held = []
+        if tag == "p":
+            self.started.append([None, None])
+            text = (text, self.started[-1])
+        self.stack.append([tag, text, is_article])
+
+    def handle_data(self, data):
+        for tag, text, _ in self.stack:
+            if tag == "p":
+                text[0].append(data)
+            elif text is not None:
+                text.append(data)
+
+    def handle_endtag(self, tag):
+        if not any(entry[0] == tag for entry in self.stack):
+            return
+        while self.stack:
+            entry = self.stack.pop()
+            self._close(*entry)
+            if entry[0] == tag:
+                return
+
+    def _close(self, tag, text, is_article):
+        if is_article:
+            self.article_state = "after"
+        if tag == "p":
+            text, slot = text
+            if not self.article or self.article_state == "inside":
+                slot[:] = ["".join(text), "ready"]
+            elif self.article_state == "before":
+                slot[:] = ["".join(text), "held"]
+            else:
+                slot[:] = [None, "dropped"]
+            while self.started and self.started[0][1] is not None:
+                text, destination = self.started.popleft()
+                if destination != "dropped":
+                    getattr(self, destination).append(text)
+        elif text is None:
+            return
+        elif tag == "time" and self.date is None:
+            self.date = "".join(text)
+        elif tag == "h1" and self.heading is None:
+            self.heading = "".join(text)
+
+    def close(self):
+        """Finish the page, closing every element still open"""
+        super().close()
+        while self.stack:
+            self._close(*self.stack.pop())
+        if self.article_state == "before":
+            # The article was not found, so every paragraph is a record
+            self.ready.extend(self.held)
+            self.held = []
+
+    def paragraphs(self):
+        """Take the text of the paragraphs closed since the last call"""
+        ready, self.ready = self.ready, []
+        return ready
+
+
+class StreamedBlotter:
+    """A fetched blotter page, parsed as it is read from the response
+
+    Iterating over it reads the response a chunk at a time (fetch it with
+    stream=True, so the body is not read until then), feeding each chunk to
+    a BlotterStreamParser and yielding the text of each paragraph as it
+    closes. Neither the whole page nor every paragraph is held in memory at
+    once: only a chunk and the paragraph being read. If the page is to be
+    archived, it is compressed into a temporary file in the archive's folder
+    as it is read, and if the response has a cache_entry (see
+    httpcache.CachedFetcher), written to the response cache. date and pdcity
+    are set as soon as they are read, and ready once they and the logged in
+    marker have been. Once iterated, the page has been added to the archive
+    (unless it was answered from the response cache, and so is already
+    archived), and the response is closed. It can only be iterated once.
+
+    Args:
+        url: url the page was fetched from (str)
+        info: the fetched page (Response)
+        archive: archive to add the raw page to (BlotterArchive)
+        article: article selector, as for parse_blotter (str)
+        chunk_size: bytes read from the response at a time (int)
+    """
+
+    def __init__(self, url, info, archive=None, article=None, chunk_size=16384):
+        self.url = url
+        self.info = info
+        self.archive = archive
+        self.article = article
+        self.chunk_size = chunk_size
+        self.parser = BlotterStreamParser(article)
+        self.seen = False
+
+    @property
+    def date(self):
+        return self.parser.date
+
+    @property
+    def pdcity(self):
+        return self.parser.pdcity
+
+    @property
+    def ready(self):
+        """Whether the date, police department, and (if checked for) the
+        logged in marker have been read"""
+        return self.seen and self.date is not None and self.pdcity is not None
+
+    def __iter__(self):
+        info = self.info
+        parser = self.parser
+        content_type = info.headers.get("Content-Type", "")
+        charset = re.search(r"charset=([\w-]+)", content_type)
+        decoder = codecs.getincrementaldecoder(charset[1] if charset else "utf-8")
+        decoder = decoder("replace")
+        compressor = spool = None
+        if self.archive is not None and not getattr(info, "from_cache", False):
+            # A gzip member, as BlotterArchive.append writes, spooled to disk
+            # beside the archive rather than to a temporary folder in memory
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            spool = tempfile.TemporaryFile(dir=self.archive.directory)
+        marker = getattr(info, "login_marker", None)
+        marker = marker.encode() if marker else None
+        self.seen = marker is None
+        tail = b""
+        entry = getattr(info, "cache_entry", None)
+        try:
+            for chunk in info.iter_content(self.chunk_size):
+                metrics.count("bytes_fetched", len(chunk))
+                if not self.seen:
+                    self.seen = marker in tail + chunk
+                    tail = (tail + chunk)[-len(marker) :]
+                if compressor is not None:
+                    spool.write(compressor.compress(chunk))
+                if entry is not None:
+                    entry.write(chunk)
+                parser.feed(decoder.decode(chunk))
+                yield from parser.paragraphs()
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+            yield from parser.paragraphs()
+            if not self.seen:
+                raise exceptions.LoginError(f"{info.url} was served logged out")
+            if parser.date is None or parser.pdcity is None:
+                raise exceptions.ScraperException(
+                    f"{self.url} has no date or police department"
+                )
+            if entry is not None:
+                entry.commit()
+            if compressor is not None:
+                spool.write(compressor.flush())
+                with metrics.timer("archive"):
+                    self.archive.append_compressed(
+                        self.url, spool, self.date, self.pdcity
+                    )
+        finally:
+            info.close()
+            if entry is not None:
+                # Only a page read whole, and logged in, is cached
+                entry.discard()
+            if spool is not None:
+                spool.close()
+
+
+def fetch(url, session, headers=None, stream=False):
+    """Fetch a page through session, counting the pages and bytes fetched
+
+    With stream set, the body is left to be read from the response (e.g. by
+    StreamedBlotter), which counts its bytes as they are read.
+
+    Returns:
+        info: the requests.Response for url (Response)
+    """
+    if headers is None:
+        headers = {}
+    with metrics.timer("fetch"):
+        info = session.get(url, headers=headers, stream=stream)
+    metrics.count("pages_fetched")
+    if not stream:
+        metrics.count("bytes_fetched", len(info.content))
+    return info
+
+
+def read_blotter(url, info, archive=None, parser="html.parser", article=None):
+    """Read a fetched blotter page for content
+
+    The page is parsed with parse_blotter, using the given parser and article
+    selector. If an archive is given, the raw page is added to it once it has
+    been parsed (unless it was answered from the response cache, and so is
+    already archived).
+
+    Args:
+        url: url the page was fetched from (str)
+        info: the fetched page (Response)
+        archive: archive to add the raw page to (BlotterArchive)
+        parser, article: parser and article selector for parse_blotter
+
+    Returns:
+        (incidents, date, pdcity): as from parse_blotter
+    """
+    with metrics.timer("parse"):
+        incidents, date, pdcity = parse_blotter(info.content, parser, article)
+    if archive is not None and not getattr(info, "from_cache", False):
+        with metrics.timer("archive"):
+            archive.append(url, info.content, date=date, pdcity=pdcity)
+    return incidents, date, pdcity
+
+
+def scrape(
+    url, session, headers=None, archive=None, parser="html.parser", article=None
+):
+    """Scrape a given url for content
+
+    Scrape a given url (preferably from rep-am.com) for date posted, police
+    department from whom the records are sourced, and any records. This is
+    fetch followed by read_blotter.
+    """
+    info = fetch(url, session, headers)
+    return read_blotter(url, info, archive, parser, article)
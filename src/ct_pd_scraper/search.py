@@ -0,0 +1,78 @@
+"""Full-text search of arrest records in the database"""
+import argparse
+import time
+
+from . import inserter
+from . import settings
+from . import exceptions
+
+
+def format_result(result):
+    """Format a SearchResult as a single line for the console"""
+    name = " ".join(filter(None, [result.first_name, result.last_name]))
+    return f"{result.date}  {result.pdcity}  {name}, {result.content}"
+
+
+def main(argv=None):
+    """Search the database given by config.toml, printing the results
+
+    Args:
+        argv: command line arguments, defaulting to sys.argv (list)
+    """
+    parser = argparse.ArgumentParser(
+        description="Search arrest records in the database, best matches first"
+    )
+    parser.add_argument("query", nargs="+", help="words to search for")
+    parser.add_argument(
+        "--pdcity", help="only search records from this police department"
+    )
+    parser.add_argument(
+        "--since", help="only search records dated on or after this (YYYY-MM-DD)"
+    )
+    parser.add_argument(
+        "--until", help="only search records dated on or before this (YYYY-MM-DD)"
+    )
+    parser.add_argument("--page", type=int, default=1, help="page of results")
+    parser.add_argument("--per-page", type=int, default=20, help="results per page")
+    parser.add_argument(
+        "--newest",
+        action="store_true",
+        help="show the newest records first, rather than the best matches",
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="pass the query to the database's full-text search syntax as is",
+    )
+    args = parser.parse_args(argv)
+
+    config = settings.SettingsObj("config.toml", need_login=False)
+    settings.configure_logging(config)
+    insert = inserter.get_inserter(
+        config.inserter_type, config=config.connconfig, search_index=True
+    )
+    try:
+        with insert:
+            start = time.perf_counter()
+            results = insert.search(
+                " ".join(args.query),
+                pdcity=args.pdcity,
+                since=args.since,
+                until=args.until,
+                page=args.page,
+                per_page=args.per_page,
+                raw=args.raw,
+                newest=args.newest,
+            )
+            elapsed = time.perf_counter() - start
+    except exceptions.SearchUnavailableError as e:
+        parser.exit(1, f"{e}\n")
+    finally:
+        insert.close()
+    for result in results:
+        print(format_result(result))
+    print(f"Page {args.page}: {len(results)} results in {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,61 @@
 """Pre-scrape settings for ct_pd_scrape
 
-NOTE: THIS MODULE RELIES ON A FORK OF TOMLKIT, FOUND AT
+NOTE: BEFORE PYTHON 3.11, THIS MODULE RELIES ON A FORK OF TOMLKIT, FOUND AT
     https://github.com/Haeilifax/tomlkit_fluent.git
 """
 from pathlib import Path
 import json
+import logging
 
-import environs
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
 
-import tomlkit_fluent as tomlkit
+
+logger = logging.getLogger(__name__)
+
+
+class DottedConfig(dict):
+    """Parsed TOML document whose get looks up dotted keys ("a.b") through
+    nested tables, as tomlkit_fluent's does"""
+
+    def get(self, key, default=None):
+        value = self
+        for part in key.split("."):
+            if not isinstance(value, dict) or part not in value:
+                return default
+            value = value[part]
+        return value
+
+
+def load_config(config_file):
+    """Read a TOML configuration file
+
+    The standard library's tomllib is used where available, as it is much
+    faster than tomlkit, which keeps formatting the scraper never needs.
+
+    Args:
+        config_file: path to a TOML configuration file (str or Path)
+
+    Returns:
+        config: the parsed document, supporting config.get("a.b", default)
+
+    Raises:
+        FileNotFoundError: config_file does not exist
+    """
+    text = Path(config_file).read_text()
+    if tomllib is None:
+        import tomlkit_fluent as tomlkit
+
+        return tomlkit.loads(text)
+    return DottedConfig(tomllib.loads(text))
 
 
 class SettingsObj:
     """Configuration object for ct_pd_scrape settings"""
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, need_login=True):
         """Creates an object with properties for configuration of scraper
 
         Initializes properties for a configuration object that will be used
@@ -23,6 +64,9 @@ class SettingsObj:
 
         Args:
             config_file: path to a TOML configuration file
+            need_login: whether login information must be read from the .env
+                file. Modes which never go online (e.g. reprocessing) pass
+                False. (bool)
 
         Raises:
             environs.EnvValidationError: if the .env file is incorrectly or
@@ -30,28 +74,109 @@ class SettingsObj:
                 error.
         """
         try:
-            config = tomlkit.loads(Path(config_file).read_text())
+            config = load_config(config_file)
         except FileNotFoundError:
-            config = {}
+            config = DottedConfig()
 
         self.data_path = Path(config.get("data.path", "./data")).resolve()
 
         self.link_file = Path(
             config.get("prev_links.link_file", "scraped_links.json")
         ).resolve()
+        self.link_store = config.get("prev_links.store", "sqlite")
+        self.link_db = Path(config.get("prev_links.link_db", "seen_links.db"))
 
         self.login_url = config.get("login.url", "https://www.rep-am.com/login")
         self.login_headers = config.get("login.headers")
+        self.login_cookie_file = config.get("login.cookie_file", "login_cookies.txt")
+        self.login_max_age = float(config.get("login.max_age_hours", 24)) * 3600
+        self.login_renew_before = float(config.get("login.renew_minutes", 60)) * 60
+        self.logged_in_marker = (
+            config.get("login.logged_in_marker", "logged-in") or None
+        )
         self.session_headers = config.get("session.headers")
         self.base_url = config.get(
             "session.base_url", "https://www.rep-am.com/category/local/records/police/"
         )
+        self.base_pages = int(config.get("session.base_pages", 1))
+        self.parser = config.get("scraping.parser", "html.parser")
+        self.article_selector = config.get("scraping.article") or None
+        self.fetch_config = dict(config.get("fetching", {}))
+        self.cache_enabled = bool(config.get("cache.enabled", True))
+        self.cache_dir = Path(config.get("cache.directory", "http_cache"))
+        self.cache_max_bytes = int(config.get("cache.max_size_mb", 50)) * 1024 * 1024
+        self.cache_max_age = int(config.get("cache.max_age_days", 14)) * 86400
 
         self.connconfig = dict(config.get("database.config", {}))
-        self.connconfig.update({"data_path": self.data_path})
+        self.connconfig.update(
+            {
+                "data_path": self.data_path,
+                "keep_alive": bool(config.get("database.keep_alive", True)),
+                "dedupe_persons": bool(config.get("database.dedupe_persons", False)),
+                "person_cache_size": int(
+                    config.get("database.person_cache_size", 4096)
+                ),
+                "search_index": bool(config.get("database.search_index", True)),
+            }
+        )
         self.inserter_type = config.get("database.inserter", "sqlite")
+        self.batch_size = int(config.get("database.batch_size", 50))
+        self.flush_seconds = float(config.get("database.flush_seconds", 30))
+        self.queue_size = int(config.get("database.queue_size", 8))
         self.cleaner_type = config.get("cleaning.cleaner", "basic")
 
+        self.archive_enabled = bool(config.get("archive.enabled", True))
+        self.archive_dir = Path(config.get("archive.directory", "archive"))
+        self.archive_segment_bytes = (
+            int(config.get("archive.segment_size_mb", 64)) * 1024 * 1024
+        )
+
+        self.backfill_checkpoint = Path(
+            config.get("backfill.checkpoint", "backfill_checkpoint.json")
+        )
+        self.backfill_batch_size = int(config.get("backfill.batch_size", 500))
+        self.backfill_flush_seconds = float(config.get("backfill.flush_seconds", 300))
+        self.backfill_max_pages = int(config.get("backfill.max_pages", 0))
+        self.backfill_checkpoint_seconds = float(
+            config.get("backfill.checkpoint_seconds", 30)
+        )
+
+        self.retry_db = Path(config.get("retry.database", "retry_queue.db"))
+        self.retry_config = {
+            "base_delay": float(config.get("retry.base_delay_minutes", 30)) * 60,
+            "max_delay": float(config.get("retry.max_delay_hours", 24)) * 3600,
+            "max_attempts": int(config.get("retry.max_attempts", 6)),
+            "jitter": float(config.get("retry.jitter", 0.5)),
+        }
+
+        self.watch_min_interval = (
+            float(config.get("watch.min_interval_minutes", 5)) * 60
+        )
+        self.watch_max_interval = (
+            float(config.get("watch.max_interval_minutes", 60)) * 60
+        )
+        self.watch_busy_hours = [
+            int(hour) for hour in config.get("watch.busy_hours", range(8, 18))
+        ]
+        self.watch_state = Path(config.get("watch.state", "watch_state.json"))
+
+        self.export_dir = Path(config.get("export.directory", "export"))
+        self.export_format = config.get("export.format", "csv")
+        self.export_partition = bool(config.get("export.partition", False))
+        self.export_chunk_size = int(config.get("export.chunk_size", 5000))
+
+        self.log_level = str(config.get("logging.level", "INFO")).upper()
+        self.log_file = config.get("logging.file") or None
+        self.metrics_report = config.get("metrics.report", "run_report.json") or None
+        self.metrics_prometheus = config.get("metrics.prometheus") or None
+
+        self.log_info = {}
+        if not need_login:
+            return
+
+        # Imported here, as only modes which log in read the .env file
+        import environs
+
         env_path = Path(config.get("env.path", Path("."))).resolve()
 
         env = environs.Env()
@@ -65,7 +190,7 @@ class SettingsObj:
                 "testcookie": env.str("testcookie"),
             }
         except environs.EnvValidationError as env_error:
-            print("Login information not found or incomplete")
+            logger.warning("Login information not found or incomplete")
             quit_prompt = input("Would you like to quit? (y/n) [y]")
             if not quit_prompt.lower().startswith("n"):
                 raise env_error
@@ -85,10 +210,38 @@ def get_prev_links(link_file):
         prev_links: list of links from file, or empty list if no file (list)
     """
     if Path(link_file).is_file():
-        print("Previous link file found, opening...")
+        logger.info("Previous link file found, opening...")
         with open(link_file, "r") as f:
             prev_links = json.load(f)
     else:
-        print("Previous link file not found, creating new in memory...")
+        logger.info("Previous link file not found, creating new in memory...")
         prev_links = []
     return prev_links
+
+
+def configure_logging(config):
+    """Set up logging as given by config
+
+    Messages at config.log_level or above are printed to the console
+    plainly, as the scraper always has. If config.log_file is set, they are
+    also appended, timestamped, to that file in the data folder.
+
+    Args:
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+
+    Raises:
+        ValueError: config.log_level is not a logging level name
+    """
+    level = logging.getLevelName(config.log_level)
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown logging level: {config.log_level}")
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handlers = [console]
+    if config.log_file:
+        log_file = logging.FileHandler(config.data_path / config.log_file)
+        log_file.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        handlers.append(log_file)
+    logging.basicConfig(level=level, handlers=handlers, force=True)
@@ -0,0 +1,283 @@
+"""Long running watch mode for ct_pd_scraper
+
+Rather than starting cold for every scheduled run, watch keeps one process
+running with a logged in session, the link store, and a database connection
+open, and polls the first listing page, scraping new blotters through the
+streaming pipeline as they appear. Polls are spaced by a PollSchedule: more
+often in the hours blotters are usually posted, less often at night, and
+again soon after a poll finds something, as blotters tend to be posted
+together.
+"""
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+from .__main__ import (
+    evict_cache,
+    get_fetcher,
+    get_links,
+    report_failures,
+    sign_in,
+    write_metrics,
+)
+from .archive import BlotterArchive
+from .pipeline import run_pipeline
+from .scrape_police import login_expiry
+from . import atomicfile
+from . import exceptions
+from . import inserter
+from . import linkstore
+from . import metrics
+from . import retryqueue
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollSchedule:
+    """Adaptive schedule of polls of the listing
+
+    The hours of the day (local time) in which polls have found new blotters
+    are counted, and saved to a state file so they outlast the process. The
+    interval between polls runs from max_interval, in hours which have never
+    had new blotters, down to min_interval, in the hour which has had the
+    most. Until learn_after polls have found new blotters, the hours in
+    busy_hours are polled every min_interval and the rest every max_interval
+    instead.
+    """
+
+    def __init__(
+        self, min_interval, max_interval, busy_hours=(), learn_after=14, path=None
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.busy_hours = set(busy_hours)
+        self.learn_after = learn_after
+        self.path = Path(path) if path else None
+        self.found = [0] * 24
+
+    @classmethod
+    def load(cls, path, *args, **kwargs):
+        """Load the hours counted in the state file at path, if there is one"""
+        schedule = cls(*args, path=path, **kwargs)
+        try:
+            found = json.loads(schedule.path.read_text())["found"]
+        except FileNotFoundError:
+            return schedule
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Reading %s failed, starting afresh: %s", path, e)
+            return schedule
+        if len(found) == 24:
+            schedule.found = found
+        return schedule
+
+    def save(self):
+        if self.path is None:
+            return
+        state = {
+            "found": self.found,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        }
+        atomicfile.replace(self.path, json.dumps(state))
+
+    def record(self, when, new_links):
+        """Record a poll at when (datetime) which found new_links (int)"""
+        if new_links:
+            self.found[when.hour] += 1
+            self.save()
+
+    def interval(self, hour):
+        """Get the seconds between polls in hour of the day (float)"""
+        if sum(self.found) < self.learn_after:
+            busy = hour in self.busy_hours
+            return self.min_interval if busy else self.max_interval
+        share = self.found[hour] / max(self.found)
+        return self.max_interval - (self.max_interval - self.min_interval) * share
+
+    def next_poll(self, last, scraped=0):
+        """Get when to poll next, after a poll at last
+
+        A poll late in a quiet hour is not left to run into a busy one: the
+        next poll is never later than one interval of the next hour into it.
+
+        Args:
+            last: time of the last poll (datetime)
+            scraped: number of links the last poll scraped, new or retried,
+                so a poll working through a backlog of retries is followed
+                as soon as one finding new links is (int)
+
+        Returns:
+            when: time of the next poll (datetime)
+        """
+        if scraped:
+            return last + timedelta(seconds=self.min_interval)
+        next_hour = last.replace(minute=0, second=0, microsecond=0)
+        next_hour += timedelta(hours=1)
+        return min(
+            last + timedelta(seconds=self.interval(last.hour)),
+            next_hour + timedelta(seconds=self.interval(next_hour.hour)),
+        )
+
+
+def poll(session, fetcher, insert, prev_links, retries, config, archive=None):
+    """Scrape every blotter on the listing not scraped before, and any in
+    retries due to be retried
+
+    The session logs in again first if its login is about to expire, or
+    once the site turns it away.
+
+    Returns:
+        new_links: number of new links found (int)
+        scraped: number of links scraped, new or retried (int)
+    """
+    expiry = login_expiry(session.cookies) or 0
+    if expiry - time.time() < config.login_renew_before:
+        sign_in(session, config)
+    with metrics.timer("get_links"):
+        try:
+            links = get_links(fetcher, config, seen=prev_links, queued=retries)
+        except exceptions.LoginError:
+            logger.warning("The login has lapsed, signing in again")
+            sign_in(session, config, reuse=False)
+            links = get_links(fetcher, config, seen=prev_links, queued=retries)
+    new_links = [link["href"] for link in links if link["href"] not in prev_links]
+    metrics.count("links_new", len(new_links))
+    links = retries.select(new_links)
+    metrics.count("links_retried", sum(link in retries for link in links))
+    if not links:
+        logger.info("No new links available")
+        return len(new_links), 0
+    logger.info("%d new links available, scraping...", len(links))
+    failed = run_pipeline(links, fetcher, insert, prev_links, config, archive)
+    retries.settle(links, failed, prev_links)
+    evict_cache(fetcher)
+    if failed:
+        report_failures(failed)
+    return len(new_links), len(links)
+
+
+def watch(
+    session,
+    fetcher,
+    insert,
+    prev_links,
+    retries,
+    config,
+    schedule,
+    stop,
+    archive=None,
+):
+    """Poll the listing on schedule until stop is set
+
+    A poll which fails (e.g. the site being down) is logged and the next is
+    made on schedule, so the process outlasts outages. Each poll's metrics
+    are written to the run report files given in config.
+
+    Args:
+        session: the requests.Session fetcher wraps (Session)
+        fetcher: FetchScheduler (or CachedFetcher) to fetch through
+        insert: inserter to insert records with (AbstractInserter)
+        prev_links: store of previously scraped links (SQLiteLinkStore or
+            JSONLinkStore)
+        retries: queue of failed links to retry (RetryQueue)
+        config: a SettingsObj, usually generated off config.toml (SettingsObj)
+        schedule: schedule of polls (PollSchedule)
+        stop: set to stop watching, e.g. from a signal handler (Event)
+        archive: archive to add fetched pages to (BlotterArchive)
+    """
+    while not stop.is_set():
+        started = datetime.now()
+        metrics.REGISTRY.reset()
+        new_links = scraped = 0
+        try:
+            new_links, scraped = poll(
+                session, fetcher, insert, prev_links, retries, config, archive
+            )
+        except Exception as e:
+            metrics.count("poll_errors")
+            logger.error("Polling failed: %r", e)
+        finally:
+            write_metrics(config)
+        schedule.record(started, new_links)
+        next_poll = schedule.next_poll(started, scraped)
+        logger.info("Next poll at %s", next_poll.isoformat(" ", "minutes"))
+        stop.wait(max((next_poll - datetime.now()).total_seconds(), 0))
+
+
+def main(argv=None):
+    """Watch the listing given by config.toml, scraping new blotters as they
+    are posted, until interrupted (Ctrl-C) or terminated
+
+    Args:
+        argv: command line arguments, defaulting to sys.argv (list)
+    """
+    parser = argparse.ArgumentParser(
+        description="Keep polling the listing, scraping new blotters as they appear"
+    )
+    parser.parse_args(argv)
+
+    config = settings.SettingsObj("config.toml")
+    settings.configure_logging(config)
+    schedule = PollSchedule.load(
+        config.data_path / config.watch_state,
+        config.watch_min_interval,
+        config.watch_max_interval,
+        config.watch_busy_hours,
+    )
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        run_watch(config, schedule, stop)
+    except KeyboardInterrupt:
+        pass
+    logger.info("Stopped watching")
+
+
+def run_watch(config, schedule, stop):
+    """Log in and open everything a poll needs once, then watch (see watch)"""
+    with requests.Session() as session:
+        sign_in(session, config)
+        fetcher = get_fetcher(session, config)
+        link_store = linkstore.get_link_store(
+            config.link_store,
+            config.data_path / config.link_db,
+            config.data_path / config.link_file,
+        )
+        insert = inserter.get_inserter(config.inserter_type, config=config.connconfig)
+        archive = None
+        if config.archive_enabled:
+            archive = BlotterArchive(
+                config.data_path / config.archive_dir, config.archive_segment_bytes
+            )
+        retry_queue = retryqueue.RetryQueue(
+            config.data_path / config.retry_db, **config.retry_config
+        )
+        try:
+            with link_store as prev_links, retry_queue as retries:
+                watch(
+                    session,
+                    fetcher,
+                    insert,
+                    prev_links,
+                    retries,
+                    config,
+                    schedule,
+                    stop,
+                    archive,
+                )
+        finally:
+            insert.close()
+            if archive is not None:
+                archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests run against the package in src, whether or not it is installed
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,56 @@
+"""Atomic replacement of state files"""
+import os
+import stat
+import threading
+
+import pytest
+
+from ct_pd_scraper import atomicfile
+
+
+def test_replaces_contents(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("old")
+    atomicfile.replace(path, '{"new": true}')
+    assert path.read_text() == '{"new": true}'
+    atomicfile.replace(str(path), b"bytes", sync=False)
+    assert path.read_bytes() == b"bytes"
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_failed_write_keeps_old_file(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("old")
+    with pytest.raises(TypeError):
+        atomicfile.replace(path, ["not", "bytes"])
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_mode(tmp_path):
+    path = tmp_path / "secret.txt"
+    atomicfile.replace(path, "secret", mode=0o600)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    shared = tmp_path / "report.json"
+    atomicfile.replace(shared, "{}")
+    expected = 0o666 & ~atomicfile._UMASK
+    assert stat.S_IMODE(shared.stat().st_mode) == expected
+
+
+def test_concurrent_writers_never_mix(tmp_path):
+    path = tmp_path / "cache.json"
+    versions = [bytes([65 + number]) * 200_000 for number in range(8)]
+    barrier = threading.Barrier(len(versions))
+
+    def write(data):
+        barrier.wait()
+        for _ in range(5):
+            atomicfile.replace(path, data, sync=False)
+
+    threads = [threading.Thread(target=write, args=(data,)) for data in versions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert path.read_bytes() in versions
+    assert os.listdir(tmp_path) == ["cache.json"]
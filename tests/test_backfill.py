@@ -0,0 +1,111 @@
+"""Backfill checkpoint: only the frontier is saved, at a bounded interval"""
+import json
+
+import pytest
+
+from ct_pd_scraper import backfill
+from ct_pd_scraper.backfill import Checkpoint, reconcile
+from ct_pd_scraper.inserter import SQLiteInserter
+from ct_pd_scraper.linkstore import SQLiteLinkStore
+
+
+BASE_URL = "https://www.rep-am.com/category/local/records/police/"
+
+
+def blotter(number):
+    return f"https://www.rep-am.com/local/police-blotter-{number}/"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backfill, "time", clock)
+    return clock
+
+
+def saved(path):
+    return json.loads(path.read_text())
+
+
+def test_changes_are_saved_once_the_interval_has_passed(tmp_path, clock):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = Checkpoint(path, BASE_URL, interval=30)
+    checkpoint.add_pending([blotter(1), blotter(2)], next_page=2)
+    assert not path.exists()
+    clock.now = 30
+    checkpoint.add_pending([blotter(3)], next_page=3)
+    assert saved(path)["pending"] == [blotter(1), blotter(2), blotter(3)]
+    checkpoint.complete([blotter(1), blotter(2)])
+    assert saved(path)["pending"] == [blotter(1), blotter(2), blotter(3)]
+    checkpoint.save()
+    assert saved(path)["pending"] == [blotter(3)]
+
+
+def test_completed_links_are_not_kept(tmp_path, clock):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = Checkpoint(path, BASE_URL, interval=0)
+    checkpoint.add_pending([blotter(n) for n in range(1, 101)], next_page=5)
+    checkpoint.complete([blotter(n) for n in range(1, 100)])
+    checkpoint.fail([blotter(100)])
+    state = saved(path)
+    assert (state["pending"], state["failed"]) == ([], [blotter(100)])
+    assert "completed" not in state
+    assert checkpoint.completed == 99
+
+
+def test_failed_links_are_pending_again_when_loaded(tmp_path, clock):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = Checkpoint(path, BASE_URL, interval=0)
+    checkpoint.add_pending([blotter(1), blotter(2)], next_page=2)
+    checkpoint.fail([blotter(1)])
+    loaded = Checkpoint.load(path, BASE_URL)
+    assert loaded.pending == [blotter(2), blotter(1)]
+    assert loaded.next_page == 2
+
+
+def test_older_checkpoint_listing_completed_links_loads(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    state = {
+        "base_url": BASE_URL,
+        "next_page": 4,
+        "finished": False,
+        "pending": [blotter(3)],
+        "failed": [],
+        "completed": [blotter(1), blotter(2)],
+    }
+    path.write_text(json.dumps(state))
+    checkpoint = Checkpoint.load(path, BASE_URL)
+    assert (checkpoint.next_page, checkpoint.pending) == (4, [blotter(3)])
+    checkpoint.save()
+    assert "completed" not in saved(path)
+
+
+def test_checkpoint_of_another_listing_is_refused(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    Checkpoint(path, BASE_URL).save()
+    with pytest.raises(ValueError):
+        Checkpoint.load(path, BASE_URL + "page/9/")
+
+
+def test_reconcile_finds_links_committed_since_the_last_save(tmp_path):
+    checkpoint = Checkpoint(tmp_path / "checkpoint.json", BASE_URL)
+    checkpoint.add_pending([blotter(1), blotter(2), blotter(3)], next_page=2)
+    config = {"data_path": tmp_path, "sqlite": {"database": "blotter.db"}}
+    insert = SQLiteInserter(config, search_index=False)
+    with insert:
+        blotters = [({0: {"name": "JANE DOE", "content": "22."}}, "2020-3-7", "X")]
+        insert.insert_many(blotters, [blotter(2)])
+    with SQLiteLinkStore(tmp_path / "links.db") as prev_links:
+        prev_links.add(blotter(1))
+        assert reconcile(checkpoint, insert, prev_links) == 2
+        assert blotter(2) in prev_links
+    insert.close()
+    assert checkpoint.pending == [blotter(3)]
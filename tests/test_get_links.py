@@ -0,0 +1,61 @@
+"""Listing crawl: stops at the first page with nothing new"""
+from types import SimpleNamespace
+
+import requests
+
+from ct_pd_scraper.__main__ import get_links, page_url
+
+
+BASE_URL = "https://www.rep-am.com/category/local/records/police/"
+CONFIG = SimpleNamespace(base_url=BASE_URL, base_pages=3, session_headers={})
+
+
+def blotter(number):
+    return f"https://www.rep-am.com/local/police-blotter-{number}/"
+
+
+class ListingSession:
+    """Serves three listing pages of two blotters each, recording the urls
+    fetched"""
+
+    def __init__(self):
+        self.pages = {
+            page_url(BASE_URL, page): [blotter(2 * page - 1), blotter(2 * page)]
+            for page in range(1, 4)
+        }
+        self.fetched = []
+
+    def get(self, url, headers=None):
+        self.fetched.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = "".join(
+            f'<a href="{link}">police blotter</a>' for link in self.pages[url]
+        ).encode("utf-8")
+        return response
+
+
+def test_nothing_seen_reads_every_page():
+    session = ListingSession()
+    links = get_links(session, CONFIG)
+    assert [link["href"] for link in links] == [blotter(n) for n in range(1, 7)]
+    assert len(session.fetched) == 3
+
+
+def test_stops_at_first_page_all_seen():
+    session = ListingSession()
+    get_links(session, CONFIG, seen={blotter(1), blotter(2)})
+    assert session.fetched == [BASE_URL]
+
+
+def test_links_queued_for_retry_count_as_seen():
+    session = ListingSession()
+    links = get_links(session, CONFIG, seen={blotter(1)}, queued={blotter(2)})
+    assert session.fetched == [BASE_URL]
+    assert [link["href"] for link in links] == [blotter(1), blotter(2)]
+
+
+def test_new_link_on_first_page_reads_on():
+    session = ListingSession()
+    get_links(session, CONFIG, seen={blotter(1), blotter(3), blotter(4)})
+    assert session.fetched == [BASE_URL, page_url(BASE_URL, 2)]
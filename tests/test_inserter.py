@@ -0,0 +1,95 @@
+"""SQLite inserter: batch inserts skip records already in the database, and
+search"""
+import pytest
+
+from ct_pd_scraper import exceptions
+from ct_pd_scraper.inserter import SQLiteInserter
+
+
+URL = "https://www.rep-am.com/local/police-blotter/1/"
+BLOTTER = (
+    {
+        0: {"name": "JOHN A. SMITH", "content": "34, of Naugatuck, charged."},
+        1: {"name": "JANE DOE", "content": "22, of Waterbury, charged."},
+    },
+    "2020-3-7",
+    "Naugatuck",
+)
+
+
+@pytest.fixture
+def inserter(tmp_path):
+    with SQLiteInserter(
+        {"data_path": tmp_path, "sqlite": {"database": "blotter.db"}}
+    ) as inserter:
+        yield inserter
+    inserter.close()
+
+
+def counts(inserter):
+    cur = inserter.conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM person")
+    persons = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM content")
+    return persons, cur.fetchone()[0]
+
+
+def test_batch_inserts_every_record(inserter):
+    assert inserter.insert_many([BLOTTER], [URL]) == 2
+    assert counts(inserter) == (2, 2)
+
+
+def test_records_repeated_in_a_batch_are_inserted_once(inserter):
+    assert inserter.insert_many([BLOTTER, BLOTTER], [URL, URL]) == 2
+    assert counts(inserter) == (2, 2)
+
+
+def test_retried_batch_inserts_nothing(inserter):
+    inserter.insert_many([BLOTTER], [URL])
+    assert inserter.insert_many([BLOTTER], [URL]) == 0
+    assert counts(inserter) == (2, 2)
+
+
+def test_only_new_records_of_a_batch_are_inserted(inserter):
+    inserter.insert_many([BLOTTER], [URL])
+    data, date, pdcity = BLOTTER
+    grown = {**data, 2: {"name": "MARY ROE", "content": "40, of Beacon Falls."}}
+    assert inserter.insert_many([(grown, date, pdcity)], [URL]) == 1
+    assert counts(inserter) == (3, 3)
+
+
+def test_same_record_from_another_blotter_is_inserted(inserter):
+    inserter.insert_many([BLOTTER], [URL])
+    assert inserter.insert_many([BLOTTER], [URL.replace("/1/", "/2/")]) == 2
+    assert counts(inserter) == (4, 4)
+
+
+def test_duplicate_persons_reuse_the_existing_person(tmp_path):
+    config = {
+        "data_path": tmp_path,
+        "sqlite": {"database": "blotter.db"},
+        "dedupe_persons": True,
+    }
+    with SQLiteInserter(config) as inserter:
+        inserter.insert_many([BLOTTER], [URL])
+        assert inserter.insert_many([BLOTTER], [URL.replace("/1/", "/2/")]) == 2
+        assert counts(inserter) == (2, 4)
+    inserter.close()
+
+
+def test_search_finds_inserted_records(inserter):
+    inserter.insert_many([BLOTTER], [URL])
+    [result] = inserter.search("waterbury")
+    assert (result.first_name, result.last_name, result.date) == (
+        "JANE",
+        "DOE",
+        "2020-03-07",
+    )
+
+
+def test_search_without_an_index_raises(tmp_path):
+    config = {"data_path": tmp_path, "sqlite": {"database": "blotter.db"}}
+    with SQLiteInserter(config, search_index=False) as inserter:
+        with pytest.raises(exceptions.SearchUnavailableError):
+            inserter.search("waterbury")
+    inserter.close()
@@ -0,0 +1,72 @@
+"""Detection of pages served to a logged out visitor, and saved logins"""
+import stat
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from ct_pd_scraper import exceptions
+from ct_pd_scraper.scrape_police import load_cookies, require_login, save_cookies
+
+
+LOGGED_IN = b'<html><body class="logged-in wordpress"><p>A, 1</p></body></html>'
+LOGGED_OUT = b'<html><body class="wordpress"><p>Subscribe</p></body></html>'
+
+
+class PageAdapter(BaseAdapter):
+    """Answers every request with the same page"""
+
+    def __init__(self, content, status_code=200):
+        super().__init__()
+        self.content = content
+        self.status_code = status_code
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = self.content
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def session_serving(content, status_code=200, marker="logged-in"):
+    session = requests.Session()
+    session.mount("http://", PageAdapter(content, status_code))
+    require_login(session, marker)
+    return session
+
+
+def test_logged_out_page_raises():
+    with pytest.raises(exceptions.LoginError):
+        session_serving(LOGGED_OUT).get("http://blotter.test/police/")
+
+
+def test_logged_in_page_passes():
+    response = session_serving(LOGGED_IN).get("http://blotter.test/police/")
+    assert response.content == LOGGED_IN
+
+
+def test_error_pages_are_left_to_the_fetcher():
+    response = session_serving(LOGGED_OUT, 503).get("http://blotter.test/police/")
+    assert response.status_code == 503
+
+
+def test_streamed_page_is_marked_for_checking_as_read():
+    session = session_serving(LOGGED_OUT)
+    response = session.get("http://blotter.test/police/", stream=True)
+    assert response.login_marker == "logged-in"
+
+
+def test_saved_login_is_private_and_loads(tmp_path):
+    session = requests.Session()
+    session.cookies.set("wordpress_logged_in_abc", "user|1900000000|token|hmac")
+    cookie_file = tmp_path / "login_cookies.txt"
+    save_cookies(session, cookie_file)
+    assert stat.S_IMODE(cookie_file.stat().st_mode) == 0o600
+    loaded = requests.Session()
+    assert load_cookies(loaded, cookie_file) is not None
+    assert loaded.cookies.get("wordpress_logged_in_abc") == "user|1900000000|token|hmac"
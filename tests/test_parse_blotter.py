@@ -0,0 +1,75 @@
+"""Parity of parse_blotter's parsers with the original scraper's parse
+
+Every fixture page is parsed with each parser and compared with what the
+original scraper read from it: BeautifulSoup's html.parser over the whole
+page, taking the text of every <p>. html.parser and "stream" must match it
+on every page, malformed or not. lxml and selectolax build their trees by
+the HTML standard's rules, so they only have to match it on well formed
+pages, and lxml must read the same paragraphs whether strained or not.
+"""
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from ct_pd_scraper.scrape_police import BlotterStreamParser, parse_blotter
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+WELL_FORMED = sorted((FIXTURES / "well_formed").glob("*.html"))
+MALFORMED = sorted((FIXTURES / "malformed").glob("*.html"))
+ARTICLES = [None, "div.entry-content"]
+
+
+def original_parse(content, article=None):
+    """Parse a page as the original scraper did"""
+    soup = BeautifulSoup(content, "html.parser")
+    body = (soup.select_one(article) if article else None) or soup
+    incidents = [incident.text for incident in body.find_all("p")]
+    return incidents, soup.find("time").text, soup.find("h1").text.split()[0]
+
+
+def require(parser):
+    """Skip the test if parser's package is not installed"""
+    if parser in ("lxml", "selectolax"):
+        pytest.importorskip(parser)
+
+
+@pytest.mark.parametrize("article", ARTICLES)
+@pytest.mark.parametrize("parser", ["html.parser", "stream"])
+@pytest.mark.parametrize("page", WELL_FORMED + MALFORMED, ids=lambda path: path.stem)
+def test_matches_original(page, parser, article):
+    content = page.read_bytes()
+    assert parse_blotter(content, parser, article) == original_parse(content, article)
+
+
+@pytest.mark.parametrize("article", ARTICLES)
+@pytest.mark.parametrize("parser", ["lxml", "selectolax"])
+@pytest.mark.parametrize("page", WELL_FORMED, ids=lambda path: path.stem)
+def test_well_formed_matches_original(page, parser, article):
+    require(parser)
+    content = page.read_bytes()
+    assert parse_blotter(content, parser, article) == original_parse(content, article)
+
+
+@pytest.mark.parametrize("article", ARTICLES)
+@pytest.mark.parametrize("page", WELL_FORMED + MALFORMED, ids=lambda path: path.stem)
+def test_strain_keeps_lxml_paragraphs(page, article):
+    require("lxml")
+    content = page.read_bytes()
+    strained = parse_blotter(content, "lxml", article, strain=True)
+    assert strained == parse_blotter(content, "lxml", article, strain=False)
+
+
+@pytest.mark.parametrize("size", [1, 7, 100])
+@pytest.mark.parametrize("page", WELL_FORMED + MALFORMED, ids=lambda path: path.stem)
+def test_stream_fed_in_pieces(page, size):
+    content = page.read_text(encoding="utf-8")
+    blotter = BlotterStreamParser()
+    incidents = []
+    for start in range(0, len(content), size):
+        blotter.feed(content[start : start + size])
+        incidents.extend(blotter.paragraphs())
+    blotter.close()
+    incidents.extend(blotter.paragraphs())
+    assert (incidents, blotter.date, blotter.pdcity) == original_parse(content)
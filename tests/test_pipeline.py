@@ -0,0 +1,86 @@
+"""Streamed blotters passing through the pipeline in parts"""
+import io
+import queue
+import threading
+
+import requests
+
+from ct_pd_scraper import cleaner, pipeline
+from ct_pd_scraper.scrape_police import StreamedBlotter
+
+
+def streamed_response(paragraphs):
+    html = "<html><body><h1>Naugatuck police blotter</h1><time>June 3, 2020</time>"
+    html += "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO((html + "</body></html>").encode())
+    response.url = "http://blotter.test/naugatuck/"
+    return response
+
+
+class FakeInserter:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.inserted = []
+
+    def insert_many(self, blotters, urls):
+        if self.fail:
+            raise RuntimeError("database is locked")
+        records = [record for data, _, _ in blotters for record in data.values()]
+        self.inserted.extend(records)
+        return len(records)
+
+
+def test_long_blotter_is_queued_in_parts(monkeypatch):
+    monkeypatch.setattr(pipeline, "PART_RECORDS", 10)
+    paragraphs = [
+        f"PERSON {number}, 30, of Naugatuck, charged." for number in range(25)
+    ]
+    blot = StreamedBlotter(
+        "http://blotter.test/naugatuck/", streamed_response(paragraphs)
+    )
+    cleaned = queue.Queue()
+    clean = cleaner.get_cleaner("structured")
+    last = pipeline._stream_parts("link", blot, clean, cleaned, threading.Event())
+    parts = [cleaned.get_nowait() for _ in range(cleaned.qsize())]
+    assert [len(record[0]) for _, record, _ in parts] == [10, 10]
+    assert all(
+        record[1:] == ("June 3, 2020", "Naugatuck", False) for _, record, _ in parts
+    )
+    assert len(last) == 5
+    names = [row["name"] for _, record, _ in parts for row in record[0].values()]
+    names += [row["name"] for row in last.values()]
+    assert names == [f"PERSON {number}" for number in range(25)]
+
+
+def test_only_finished_links_are_recorded():
+    batch = [
+        ("a", {0: {"name": "A", "content": "1"}}, "June 3, 2020", "Naugatuck", False),
+        ("b", {0: {"name": "B", "content": "2"}}, "June 3, 2020", "Naugatuck", True),
+        ("a", {0: {"name": "C", "content": "3"}}, "June 3, 2020", "Naugatuck", False),
+    ]
+    insert = FakeInserter()
+    seen = []
+
+    class Store:
+        def add_many(self, links):
+            seen.extend(links)
+
+    failed, failed_links = [], set()
+    pipeline._write_batch(insert, batch, Store(), failed, failed_links)
+    assert len(insert.inserted) == 3
+    assert seen == ["b"]
+    assert not failed and not batch
+
+
+def test_failed_batch_fails_each_link_once():
+    batch = [
+        ("a", {}, "June 3, 2020", "Naugatuck", False),
+        ("a", {}, "June 3, 2020", "Naugatuck", False),
+        ("b", {}, "June 3, 2020", "Naugatuck", True),
+    ]
+    failed, failed_links = [], set()
+    pipeline._write_batch(FakeInserter(fail=True), batch, None, failed, failed_links)
+    assert [link for link, _ in failed] == ["a", "b"]
+    assert failed_links == {"a", "b"}
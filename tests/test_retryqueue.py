@@ -0,0 +1,66 @@
+"""Persistent retry queue: backoff, due links, and parking"""
+import pytest
+
+from ct_pd_scraper.retryqueue import RetryQueue
+
+
+URL = "https://www.rep-am.com/local/police-blotter/1/"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with RetryQueue(
+        tmp_path / "retry.db", base_delay=100, max_delay=1000, max_attempts=3, jitter=0
+    ) as queue:
+        yield queue
+
+
+def test_failed_link_is_due_after_its_delay(queue):
+    assert not queue.fail(URL, ConnectionError("reset"), now=0)
+    assert queue.due(now=99) == []
+    assert queue.due(now=100) == [URL]
+
+
+def test_delay_doubles_with_each_failure_up_to_the_maximum(queue):
+    assert [queue.delay(attempts) for attempts in range(1, 6)] == [
+        100,
+        200,
+        400,
+        800,
+        1000,
+    ]
+    queue.fail(URL, ConnectionError("reset"), now=0)
+    queue.fail(URL, ConnectionError("reset"), now=100)
+    assert queue.due(now=299) == []
+    assert queue.due(now=300) == [URL]
+
+
+def test_jitter_only_shortens_the_delay(tmp_path):
+    with RetryQueue(tmp_path / "retry.db", base_delay=100, jitter=0.5) as queue:
+        delays = [queue.delay(1) for _ in range(100)]
+    assert all(50 <= delay <= 100 for delay in delays)
+
+
+def test_due_links_come_longest_waiting_first(queue):
+    queue.fail("b", ValueError("late"), now=10)
+    queue.fail("a", ValueError("early"), now=0)
+    assert queue.due(now=1000) == ["a", "b"]
+
+
+def test_link_is_parked_after_max_attempts(queue):
+    assert not queue.fail(URL, ConnectionError("reset"), now=0)
+    assert not queue.fail(URL, ConnectionError("reset"), now=100)
+    assert queue.fail(URL, TimeoutError("slow"), now=300)
+    assert queue.due(now=10**9) == []
+    assert URL in queue
+    [(url, attempts, error, message, _)] = queue.parked()
+    assert (url, attempts, error, message) == (URL, 3, "TimeoutError", "slow")
+
+
+def test_queue_is_kept_between_runs(tmp_path):
+    with RetryQueue(tmp_path / "retry.db", base_delay=100, jitter=0) as queue:
+        queue.fail(URL, ConnectionError("reset"), now=0)
+    with RetryQueue(tmp_path / "retry.db", base_delay=100, jitter=0) as queue:
+        assert queue.due(now=100) == [URL]
+        queue.remove([URL])
+        assert len(queue) == 0
@@ -0,0 +1,188 @@
+"""Politeness scheduler: rate limits and concurrency of streamed fetches"""
+import io
+import threading
+
+import pytest
+import requests
+
+from ct_pd_scraper import scheduler as scheduler_module
+from ct_pd_scraper.scheduler import FetchScheduler, HostLimiter, TokenBucket
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping by moving the clock on"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, "time", clock)
+    return clock
+
+
+def answer(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+class FakeSession:
+    """Answers every GET with a page, counting the responses not yet closed"""
+
+    def __init__(self):
+        self.open = 0
+        self.most_open = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.raw = io.BytesIO(b"<p>A, 1</p>")
+        with self.lock:
+            self.open += 1
+            self.most_open = max(self.most_open, self.open)
+        close = response.close
+
+        def closed():
+            with self.lock:
+                self.open -= 1
+            close()
+
+        response.close = closed
+        return response
+
+
+def scheduler(session, concurrency):
+    return FetchScheduler(session, concurrency, rate=1000, burst=1000, max_rate=1000)
+
+
+def test_bucket_spends_its_burst_then_waits_for_the_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == 0
+    bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_bucket_refills_no_further_than_its_burst(clock):
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.acquire()
+    clock.sleep(60)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == pytest.approx(61)
+
+
+def test_bucket_pause_holds_back_the_next_token(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.pause(10)
+    bucket.acquire()
+    assert clock.now >= 10
+
+
+def test_bucket_set_rate_credits_tokens_earned_at_the_old_rate(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.acquire()
+    clock.sleep(0.5)
+    bucket.set_rate(0.25)
+    bucket.acquire()
+    assert clock.now == pytest.approx(2.5)
+
+
+def test_limiter_backs_off_to_its_minimum(clock):
+    limiter = HostLimiter(rate=1, min_rate=0.2, backoff=0.5)
+    limiter.record(answer(503))
+    assert limiter.rate == pytest.approx(0.5)
+    limiter.record(None)
+    limiter.record(answer(429))
+    assert limiter.rate == pytest.approx(0.2)
+
+
+def test_limiter_recovers_after_healthy_responses_up_to_its_maximum(clock):
+    limiter = HostLimiter(rate=1, max_rate=1.1, increase=0.05, recover_after=3)
+    for _ in range(2):
+        limiter.record(answer(200))
+    assert limiter.rate == pytest.approx(1)
+    limiter.record(answer(200))
+    assert limiter.rate == pytest.approx(1.05)
+    for _ in range(6):
+        limiter.record(answer(404))
+    assert limiter.rate == pytest.approx(1.1)
+
+
+def test_limiter_error_restarts_the_healthy_streak(clock):
+    limiter = HostLimiter(rate=1, backoff=0.5, increase=0.05, recover_after=2)
+    limiter.record(answer(200))
+    limiter.record(answer(500))
+    limiter.record(answer(200))
+    assert limiter.rate == pytest.approx(0.5)
+    limiter.record(answer(200))
+    assert limiter.rate == pytest.approx(0.55)
+
+
+def test_limiter_honours_retry_after(clock):
+    limiter = HostLimiter(rate=1, backoff=0.5)
+    limiter.acquire()
+    limiter.record(answer(429, retry_after=30))
+    limiter.acquire()
+    assert clock.now >= 30
+
+
+def test_streamed_response_holds_its_slot_until_closed():
+    fetcher = scheduler(FakeSession(), 1)
+    first = fetcher.get("http://blotter.test/1/", stream=True)
+    fetched = threading.Event()
+
+    def fetch_second():
+        fetcher.get("http://blotter.test/2/", stream=True).close()
+        fetched.set()
+
+    thread = threading.Thread(target=fetch_second)
+    thread.start()
+    assert not fetched.wait(0.2)
+    first.close()
+    assert fetched.wait(2)
+    thread.join()
+
+
+def test_streamed_bodies_read_within_concurrency():
+    session = FakeSession()
+    fetcher = scheduler(session, 2)
+
+    def read(url):
+        response = fetcher.get(url, stream=True)
+        with response:
+            return b"".join(response.iter_content(4))
+
+    urls = [f"http://blotter.test/{number}/" for number in range(20)]
+    results = [future.result() for _, future in fetcher.map(read, urls)]
+    assert results == [b"<p>A, 1</p>"] * 20
+    assert session.most_open <= 2
+
+
+def test_closing_twice_releases_once():
+    fetcher = scheduler(FakeSession(), 1)
+    response = fetcher.get("http://blotter.test/1/", stream=True)
+    response.close()
+    response.close()
+    assert fetcher.slots.acquire(blocking=False)
+    assert not fetcher.slots.acquire(blocking=False)
+
+
+def test_unstreamed_response_frees_its_slot_at_once():
+    fetcher = scheduler(FakeSession(), 1)
+    fetcher.get("http://blotter.test/1/")
+    assert fetcher.slots.acquire(blocking=False)
@@ -0,0 +1,77 @@
+"""Migration of databases made before the schema was versioned"""
+import sqlite3
+
+from ct_pd_scraper import schema
+from ct_pd_scraper.cleaner import record_hash
+
+
+RECORD = "34, of 5 Main St., Naugatuck, charged with breach of peace."
+UNDATED = "22, of Waterbury, charged with larceny."
+
+
+def baseline_database(path):
+    """Make a database as the original scraper left it: the README's tables
+    without indexes or later columns, and dates stored unpadded"""
+    conn = sqlite3.connect(path)
+    with conn:
+        for statement in schema.TABLES["sqlite"]:
+            conn.execute(statement)
+        conn.execute("INSERT INTO person VALUES (1, 'JOHN A.', 'SMITH')")
+        conn.execute("INSERT INTO person VALUES (2, 'JOHN A.', 'SMITH')")
+        conn.execute("INSERT INTO person VALUES (3, 'JANE', 'DOE')")
+        conn.executemany(
+            "INSERT INTO content (person_id, pdcity, content, date) "
+            "VALUES (?, 'Naugatuck', ?, ?)",
+            [
+                (1, RECORD, "2020-3-7"),
+                (2, RECORD, "2020-3-7"),
+                (3, UNDATED, "0000-00-00"),
+            ],
+        )
+    return conn
+
+
+def test_baseline_database_is_brought_up_to_date(tmp_path):
+    conn = baseline_database(tmp_path / "baseline.db")
+    assert schema.migrate(conn, "sqlite") == schema.SCHEMA_VERSION
+    cur = conn.cursor()
+    assert {"name_key"} <= schema.columns(cur, "sqlite", "person")
+    assert set(schema.FIELDS) | {"url", "record_hash"} <= schema.columns(
+        cur, "sqlite", "content"
+    )
+    for table, name, indexed in schema.INDEXES:
+        assert schema.indexes(cur, "sqlite", table)[name] == indexed
+    assert schema.indexes(cur, "sqlite", "content")["content_record_hash"] == (
+        "record_hash",
+    )
+    cur.execute("SELECT version FROM schema_version ORDER BY version")
+    assert [row[0] for row in cur.fetchall()] == list(
+        range(1, schema.SCHEMA_VERSION + 1)
+    )
+
+
+def test_existing_records_are_filled_in(tmp_path):
+    conn = baseline_database(tmp_path / "baseline.db")
+    schema.migrate(conn, "sqlite")
+    rows = conn.execute(
+        "SELECT date, age, town, charges, record_hash FROM content ORDER BY id"
+    ).fetchall()
+    smith = record_hash(None, "JOHN A. SMITH", RECORD, "2020-03-07")
+    doe = record_hash(None, "JANE DOE", UNDATED, None)
+    assert rows == [
+        ("2020-03-07", 34, "Naugatuck", "breach of peace", smith),
+        # A duplicate of the first record is left out of the unique index
+        ("2020-03-07", 34, "Naugatuck", "breach of peace", None),
+        (None, 22, "Waterbury", "larceny", doe),
+    ]
+
+
+def test_migrating_again_changes_nothing(tmp_path):
+    conn = baseline_database(tmp_path / "baseline.db")
+    schema.migrate(conn, "sqlite")
+    before = conn.execute("SELECT * FROM content ORDER BY id").fetchall()
+    assert schema.migrate(conn, "sqlite") == schema.SCHEMA_VERSION
+    assert conn.execute("SELECT * FROM content ORDER BY id").fetchall() == before
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == (
+        schema.SCHEMA_VERSION
+    )